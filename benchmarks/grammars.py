@@ -0,0 +1,233 @@
+"""
+Grammars for the benchmark suite, each with a generator of inputs of about
+a given size. Inputs are built from a seeded random generator, so the same
+size always gives the same text.
+"""
+import copy
+import random
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, Optional
+
+from peg_leg.parser import Parser
+from peg_leg.peg import peg_parser
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # A new, linked parser for the grammar.
+    make_parser: Callable[[], Parser]
+    # Pieces of input that are joined until they reach the requested size.
+    pieces: Callable[[random.Random], Iterator[str]]
+    head: str = ''
+    separator: str = ''
+    tail: str = ''
+    # The rule to start from, if not the grammar's start rule.
+    rule: Optional[str] = None
+
+    def make_input(self, size: int, seed: int = 0) -> str:
+        rng = random.Random(seed)
+        parts = [self.head]
+        total = len(self.head) + len(self.tail)
+        for piece in self.pieces(rng):
+            if total >= size and len(parts) > 1:
+                break
+            if len(parts) > 1:
+                parts.append(self.separator)
+                total += len(self.separator)
+            parts.append(piece)
+            total += len(piece)
+        parts.append(self.tail)
+        return ''.join(parts)
+
+
+JSON_GRAMMAR = r"""
+json <- value ;
+value <- object | array | string | number | "true" | "false" | "null" ;
+object <- "{" (member ("," member)*)? "}" ;
+member <- string ":" value ;
+array <- "[" (value ("," value)*)? "]" ;
+string <- /"[^"]*"/ ;
+number <- /-?(0|[1-9][0-9]*)([.][0-9]+)?([eE][+-]?[0-9]+)?/ ;
+"""
+
+WORDS = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta',
+         'theta', 'iota', 'kappa', 'lambda', 'mu']
+
+
+def json_value(rng: random.Random, depth: int) -> str:
+    kind = rng.randrange(8 if depth < 3 else 5)
+    if kind == 0:
+        return str(rng.randrange(-1000, 100000))
+    if kind == 1:
+        return f'{rng.uniform(-1e3, 1e3):.4f}'
+    if kind == 2:
+        return f'"{rng.choice(WORDS)} {rng.choice(WORDS)}"'
+    if kind == 3:
+        return rng.choice(['true', 'false', 'null'])
+    if kind == 4:
+        return f'"{rng.choice(WORDS)}"'
+    if kind == 5:
+        items = [json_value(rng, depth + 1) for _ in range(rng.randrange(5))]
+        return '[' + ', '.join(items) + ']'
+    members = [f'"{rng.choice(WORDS)}": {json_value(rng, depth + 1)}'
+               for _ in range(rng.randrange(1, 5))]
+    return '{' + ', '.join(members) + '}'
+
+
+def json_pieces(rng: random.Random) -> Iterator[str]:
+    while True:
+        yield '\n  ' + json_value(rng, 1)
+
+
+ARITHMETIC_GRAMMAR = r"""
+lines <- line* ;
+line <- expr ";" ;
+expr <- expr "+" term | expr "-" term | term ;
+term <- term "*" factor | term "/" factor | factor ;
+factor <- /[0-9]+/ | "(" expr ")" ;
+"""
+
+
+def arithmetic_expr(rng: random.Random, depth: int) -> str:
+    terms = []
+    for _ in range(rng.randrange(1, 5)):
+        factors = []
+        for _ in range(rng.randrange(1, 4)):
+            if depth < 2 and rng.random() < 0.2:
+                factors.append(f'({arithmetic_expr(rng, depth + 1)})')
+            else:
+                factors.append(str(rng.randrange(1000)))
+        terms.append(rng.choice([' * ', ' / ']).join(factors))
+    expr = terms[0]
+    for term in terms[1:]:
+        expr += rng.choice([' + ', ' - ']) + term
+    return expr
+
+
+def arithmetic_pieces(rng: random.Random) -> Iterator[str]:
+    while True:
+        yield arithmetic_expr(rng, 0) + ';\n'
+
+
+# The grammar of tests/grammar.py, as a list of statements.
+JAVA_PRIMARY_GRAMMAR = """
+primaries <- (primary ";")* ;
+primary <- primary-no-new-array ;
+primary-no-new-array <- object-creation
+                      | method-invocation
+                      | field-access
+                      | array-access
+                      | "this" ;
+object-creation <- primary ".new " id "()"
+                 | "new " class-or-interface-type "()" ;
+method-invocation <- primary "." method-name "()"
+                   | method-name "()" ;
+field-access <- primary "." id
+              | "super." id ;
+array-access <- primary "[" expression "]"
+              | id "[" expression "]" ;
+class-or-interface-type <- class-name
+                         | interface-type-name ;
+class-name <- "C" | "D" ;
+interface-type-name <- "I" | "J" ;
+id <- "x" | "y" | class-or-interface-type ;
+method-name <- "m" | "n" ;
+expression <- "i" | "j" ;
+"""
+
+PRIMARIES = ['this', 'this.x', 'this.x.y', 'this.x.m()', 'x[i][j].y',
+             'new C()', 'x[i].n()', 'new C().new D()', 'super.y.m()',
+             'y[j].x[i].C']
+
+
+def java_primary_pieces(rng: random.Random) -> Iterator[str]:
+    while True:
+        yield rng.choice(PRIMARIES) + ';'
+
+
+def meta_parser() -> Parser:
+    # A copy, so that compiling it leaves the parser for grammars alone.
+    return copy.copy(peg_parser)
+
+
+def meta_grammar_pieces(rng: random.Random) -> Iterator[str]:
+    count = 0
+    while True:
+        name = f'rule-{count}'
+        alts = []
+        for _ in range(rng.randrange(1, 4)):
+            items = []
+            for _ in range(rng.randrange(1, 5)):
+                kind = rng.randrange(4)
+                if kind == 0:
+                    items.append(f'"{rng.choice(WORDS)}"')
+                elif kind == 1:
+                    items.append(f'/[{rng.choice("abc")}-z]+/')
+                elif kind == 2:
+                    items.append(f'rule-{rng.randrange(count + 1)}')
+                else:
+                    items.append(f'( "{rng.choice(WORDS)}" ~ )'
+                                 f'{rng.choice("*+?")}')
+            if rng.random() < 0.3:
+                items.insert(0, rng.choice('&!'))
+            alts.append(' '.join(items))
+        count += 1
+        yield f'{name} <- ' + '\n    | '.join(alts) + ' ;\n'
+
+
+CSV_GRAMMAR = """
+rows <- row* ;
+row <- field ("," field)* "\n" ;
+field <- /"[^"]*"/ | /[^,"\\\\n]*/ ;
+"""
+
+
+def csv_pieces(rng: random.Random) -> Iterator[str]:
+    while True:
+        fields = [str(rng.randrange(100000)), rng.choice(WORDS),
+                  f'"{rng.choice(WORDS)}, {rng.choice(WORDS)}"',
+                  f'{rng.uniform(0, 100):.2f}', '']
+        yield ','.join(fields) + '\n'
+
+
+LOG_GRAMMAR = """
+log <- entry* ;
+entry <- timestamp " " level " [" source "] " message "\n" ;
+timestamp <- /[0-9]{4}-[0-9]{2}-[0-9]{2}T[0-9]{2}:[0-9]{2}:[0-9]{2}/ ;
+level <- "DEBUG" | "INFO" | "WARN" | "ERROR" ;
+source <- /[a-z]+-[0-9]+/ ;
+message <- /[^\\\\n]*/ ;
+"""
+
+
+def log_pieces(rng: random.Random) -> Iterator[str]:
+    while True:
+        yield (f'2024-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02}T'
+               f'{rng.randrange(24):02}:{rng.randrange(60):02}:'
+               f'{rng.randrange(60):02} '
+               f'{rng.choice(["DEBUG", "INFO", "WARN", "ERROR"])} '
+               f'[{rng.choice(WORDS)}-{rng.randrange(16)}] '
+               f'{rng.choice(WORDS)} {rng.choice(WORDS)} '
+               f'id={rng.randrange(10 ** 6)}\n')
+
+
+def from_grammar(grammar: str, ignore_ws: bool = False) \
+        -> Callable[[], Parser]:
+    return lambda: Parser.from_grammar(grammar, ignore_ws=ignore_ws)
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+for benchmark in [
+    Benchmark('json', from_grammar(JSON_GRAMMAR, True), json_pieces,
+              head='[', separator=',', tail='\n]\n'),
+    Benchmark('arithmetic', from_grammar(ARITHMETIC_GRAMMAR, True),
+              arithmetic_pieces),
+    Benchmark('java-primary', from_grammar(JAVA_PRIMARY_GRAMMAR),
+              java_primary_pieces),
+    Benchmark('meta-grammar', meta_parser, meta_grammar_pieces,
+              rule='grammar'),
+    Benchmark('csv', from_grammar(CSV_GRAMMAR), csv_pieces),
+    Benchmark('log', from_grammar(LOG_GRAMMAR), log_pieces),
+]:
+    BENCHMARKS[benchmark.name] = benchmark
@@ -0,0 +1,47 @@
+"""
+Parse time against input size for a terminal-heavy grammar. Time per KB
+should stay flat as the input grows; a rising column means some step is
+proportional to the length of the remaining input.
+
+    python -m benchmarks.scaling [size_kb ...]
+"""
+import sys
+import time
+
+from peg_leg.parser import Parser
+
+GRAMMAR = """
+lines <- line* ;
+line <- key "=" value ";\n" ;
+key <- /[a-z]+/ ;
+value <- "true" | "false" | /[0-9]+/ ;
+"""
+
+LINES = ["alpha=true;\n", "beta=12345;\n", "gamma=false;\n", "delta=7;\n"]
+
+SIZES_KB = [1, 10, 100, 1_000, 10_000, 100_000]
+
+
+def make_input(size: int) -> str:
+    chunk = "".join(LINES)
+    return chunk * (size // len(chunk) + 1)
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv] or SIZES_KB
+    parsers = [('visitor', Parser.from_grammar(GRAMMAR)),
+               ('compiled', Parser.from_grammar(GRAMMAR).compile())]
+
+    print(f"{'mode':>10} {'size (KB)':>10} {'time (s)':>10} {'us/KB':>10}")
+    for size_kb in sizes:
+        input = make_input(size_kb * 1024)
+        for mode, parser in parsers:
+            start = time.perf_counter()
+            parser.parse(input)
+            elapsed = time.perf_counter() - start
+            print(f"{mode:>10} {size_kb:>10} {elapsed:>10.3f} "
+                  f"{elapsed / size_kb * 1e6:>10.1f}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,174 @@
+"""
+Throughput, peak memory and memo table size of realistic grammars over
+growing inputs. Results can be saved as JSON and compared with an earlier
+run; the exit status is 1 when any throughput falls more than the tolerance
+below the baseline's.
+
+    python -m benchmarks.suite [--sizes KB ...] [--benchmarks NAME ...]
+                               [--modes MODE ...] [--repeat N] [--no-memory]
+                               [--output FILE] [--baseline FILE]
+                               [--tolerance FRACTION]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from peg_leg.parser import Parser
+
+from .grammars import BENCHMARKS, Benchmark
+
+MODES: Dict[str, Callable[[Parser], Parser]] = {
+    'visitor': lambda parser: parser,
+    'compiled': lambda parser: parser.compile(),
+    'stackless': lambda parser: parser.compile(True),
+}
+
+SIZES_KB = [1, 10, 100, 1_000]
+
+Result = Dict[str, Any]
+
+
+def parse(parser: Parser, benchmark: Benchmark, input: str) -> Any:
+    if benchmark.rule is None:
+        return parser.parse(input)
+    return parser.parse_rule(benchmark.rule, input)
+
+
+def run_benchmark(benchmark: Benchmark, mode: str, size_kb: int,
+                  repeat: int = 1, memory: bool = True) -> Result:
+    """
+    Parse an input of `size_kb` KB `repeat` times and keep the best time.
+    With `memory`, parse it once more under tracemalloc for the peak of
+    what the parse allocated.
+    """
+    input = benchmark.make_input(size_kb * 1024)
+    size = len(input.encode('utf-8'))
+    parser = MODES[mode](benchmark.make_parser())
+
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(parser, benchmark, input)
+        seconds = min(seconds, time.perf_counter() - start)
+    memo = parser.memo_usage
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            parse(parser, benchmark, input)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'benchmark': benchmark.name,
+        'mode': mode,
+        'size_kb': size_kb,
+        'bytes': size,
+        'seconds': seconds,
+        'throughput': size / seconds if seconds else None,
+        'peak_memory': peak,
+        'memo_entries': memo.entries,
+        'memo_bytes': memo.bytes,
+    }
+
+
+def result_key(result: Result) -> Tuple[str, str, int]:
+    return result['benchmark'], result['mode'], result['size_kb']
+
+
+def load_results(path: str) -> Dict[Tuple[str, str, int], Result]:
+    with open(path, encoding='utf-8') as fh:
+        report = json.load(fh)
+    return {result_key(result): result for result in report['results']}
+
+
+def save_results(path: str, results: List[Result]):
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(report, fh, indent=2)
+        fh.write('\n')
+
+
+def compare(result: Result, baseline: Optional[Result]) -> Optional[float]:
+    """Throughput as a fraction of the baseline's, if there is one."""
+    if baseline is None or not baseline['throughput'] \
+            or result['throughput'] is None:
+        return None
+    return result['throughput'] / baseline['throughput']
+
+
+def format_row(result: Result, ratio: Optional[float]) -> str:
+    peak = result['peak_memory']
+    peak = '-' if peak is None else f'{peak / 2 ** 20:.1f}'
+    throughput = result['throughput'] or 0.0
+    ratio = '-' if ratio is None else f'{ratio:.2f}x'
+    return (f"{result['benchmark']:>13} {result['mode']:>9} "
+            f"{result['size_kb']:>9} {result['seconds']:>9.3f} "
+            f"{throughput / 2 ** 20:>9.3f} {peak:>9} "
+            f"{result['memo_entries']:>10} {ratio:>8}")
+
+
+HEADER = (f"{'benchmark':>13} {'mode':>9} {'size (KB)':>9} {'time (s)':>9} "
+          f"{'MB/s':>9} {'peak MB':>9} {'memo':>10} {'vs base':>8}")
+
+
+def main(argv: List[str]) -> int:
+    args = argparse.ArgumentParser(
+        prog='python -m benchmarks.suite',
+        description='Benchmark peg_leg parsers on generated inputs.')
+    args.add_argument('--sizes', type=int, nargs='+', default=SIZES_KB,
+                      metavar='KB', help='input sizes in KB')
+    args.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                      choices=list(BENCHMARKS), metavar='NAME',
+                      help=f"any of {', '.join(BENCHMARKS)}")
+    args.add_argument('--modes', nargs='+', default=['visitor', 'compiled'],
+                      choices=list(MODES), metavar='MODE',
+                      help=f"any of {', '.join(MODES)}")
+    args.add_argument('--repeat', type=int, default=1,
+                      help='parses per result, keeping the fastest')
+    args.add_argument('--no-memory', dest='memory', action='store_false',
+                      help='skip the extra parse that measures peak memory')
+    args.add_argument('--output', help='save the results to this JSON file')
+    args.add_argument('--baseline', help='compare with a saved JSON file')
+    args.add_argument('--tolerance', type=float, default=0.1,
+                      help='slowdown against the baseline that fails the '
+                           'run, as a fraction')
+    options = args.parse_args(argv)
+
+    baseline = load_results(options.baseline) if options.baseline else {}
+    results = []
+    regressions = []
+    print(HEADER)
+    for name in options.benchmarks:
+        for size_kb in options.sizes:
+            for mode in options.modes:
+                result = run_benchmark(BENCHMARKS[name], mode, size_kb,
+                                       options.repeat, options.memory)
+                ratio = compare(result, baseline.get(result_key(result)))
+                if ratio is not None and ratio < 1 - options.tolerance:
+                    regressions.append(result)
+                results.append(result)
+                print(format_row(result, ratio), flush=True)
+
+    if options.output:
+        save_results(options.output, results)
+    for result in regressions:
+        print(f"Regression: {result['benchmark']} {result['mode']} "
+              f"{result['size_kb']} KB", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,616 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Pattern, Set, Tuple
+
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, \
+    Cut, Fused, Branches, Literals
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+# Character classes larger than this count as matching any character.
+MAX_FIRST_CHARS = 256
+
+# Alts of at least this many string literals get a Literals table.
+MIN_LITERALS = 4
+
+
+class GrammarError(Exception):
+    pass
+
+
+def regex_nullable(pattern: Pattern) -> bool:
+    """
+    Whether a compiled regex can match without consuming input anywhere,
+    not only at the end of the input: lookaheads and word boundaries match
+    no characters, though they fail on an empty string.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return pattern.match('') is not None
+    return parsed.getwidth()[0] == 0
+
+
+class NullableVisitor:
+    """
+    Whether a node can succeed without consuming input, given what is known
+    so far about the rules it references.
+    """
+    def visit_rule(self, rule: Rule, nullable: Set[str]) -> bool:
+        return rule.name in nullable
+
+    def visit_seq(self, seq: Seq, nullable) -> bool:
+        return all(node.visit(self, nullable) for node in seq.nodes)
+
+    def visit_alt(self, alt: Alt, nullable) -> bool:
+        return any(node.visit(self, nullable) for node in alt.nodes)
+
+    def visit_mult(self, mult: Mult, nullable) -> bool:
+        return mult.min == 0 or mult.node.visit(self, nullable)
+
+    def visit_opt(self, opt: Opt, nullable) -> bool:
+        return True
+
+    def visit_look(self, look: Look, nullable) -> bool:
+        return True
+
+    def visit_nlook(self, nlook: NLook, nullable) -> bool:
+        return True
+
+    def visit_str(self, string: Str, nullable) -> bool:
+        return string.string == ''
+
+    def visit_rgx(self, regex: Rgx, nullable) -> bool:
+        return regex_nullable(regex.regex)
+
+    def visit_cut(self, cut: Cut, nullable) -> bool:
+        return True
+
+    def visit_fused(self, fused: Fused, nullable) -> bool:
+        return fused.node.visit(self, nullable)
+
+
+class LeftCallVisitor:
+    """
+    Collects the rules a node can call at the position it starts at.
+    """
+    nullable: Set[str]
+
+    def __init__(self, nullable: Set[str]):
+        self.nullable = nullable
+
+    def is_nullable(self, node) -> bool:
+        return node.visit(NullableVisitor(), self.nullable)
+
+    def visit_rule(self, rule: Rule, calls: List[str]):
+        calls.append(rule.name)
+
+    def visit_seq(self, seq: Seq, calls):
+        for node in seq.nodes:
+            node.visit(self, calls)
+            if not self.is_nullable(node):
+                break
+
+    def visit_alt(self, alt: Alt, calls):
+        for node in alt.nodes:
+            node.visit(self, calls)
+
+    def visit_mult(self, mult: Mult, calls):
+        mult.node.visit(self, calls)
+
+    def visit_opt(self, opt: Opt, calls):
+        opt.node.visit(self, calls)
+
+    def visit_look(self, look: Look, calls):
+        look.node.visit(self, calls)
+
+    def visit_nlook(self, nlook: NLook, calls):
+        nlook.node.visit(self, calls)
+
+    def visit_str(self, string: Str, calls):
+        pass
+
+    def visit_rgx(self, regex: Rgx, calls):
+        pass
+
+    def visit_cut(self, cut: Cut, calls):
+        pass
+
+    def visit_fused(self, fused: Fused, calls):
+        fused.node.visit(self, calls)
+
+
+class RepetitionChecker:
+    """
+    Rejects repetitions of nodes that can match the empty string, which
+    would otherwise loop forever at parse time.
+    """
+    nullable: Set[str]
+
+    def __init__(self, nullable: Set[str]):
+        self.nullable = nullable
+
+    def visit_rule(self, rule: Rule, name: str):
+        pass
+
+    def visit_seq(self, seq: Seq, name):
+        for node in seq.nodes:
+            node.visit(self, name)
+
+    def visit_alt(self, alt: Alt, name):
+        for node in alt.nodes:
+            node.visit(self, name)
+
+    def visit_mult(self, mult: Mult, name):
+        if mult.node.visit(NullableVisitor(), self.nullable):
+            raise GrammarError(f'In rule {name}: {mult} repeats an '
+                               f'expression that can match the empty string')
+        mult.node.visit(self, name)
+
+    def visit_opt(self, opt: Opt, name):
+        opt.node.visit(self, name)
+
+    def visit_look(self, look: Look, name):
+        look.node.visit(self, name)
+
+    def visit_nlook(self, nlook: NLook, name):
+        nlook.node.visit(self, name)
+
+    def visit_str(self, string: Str, name):
+        pass
+
+    def visit_rgx(self, regex: Rgx, name):
+        pass
+
+    def visit_cut(self, cut: Cut, name):
+        pass
+
+    def visit_fused(self, fused: Fused, name):
+        fused.node.visit(self, name)
+
+
+class CutLinker:
+    """
+    Points every cut at the innermost Alt around it in the same rule, and
+    counts the cuts.
+    """
+    cuts: int
+
+    def __init__(self):
+        self.cuts = 0
+
+    def visit_rule(self, rule: Rule, alt: Optional[Alt]):
+        pass
+
+    def visit_seq(self, seq: Seq, alt):
+        for node in seq.nodes:
+            node.visit(self, alt)
+
+    def visit_alt(self, alt: Alt, outer):
+        for node in alt.nodes:
+            node.visit(self, alt)
+
+    def visit_mult(self, mult: Mult, alt):
+        mult.node.visit(self, alt)
+
+    def visit_opt(self, opt: Opt, alt):
+        opt.node.visit(self, alt)
+
+    def visit_look(self, look: Look, alt):
+        look.node.visit(self, alt)
+
+    def visit_nlook(self, nlook: NLook, alt):
+        nlook.node.visit(self, alt)
+
+    def visit_str(self, string: Str, alt):
+        pass
+
+    def visit_rgx(self, regex: Rgx, alt):
+        pass
+
+    def visit_cut(self, cut: Cut, alt):
+        cut.alt = alt
+        self.cuts += 1
+
+    def visit_fused(self, fused: Fused, alt):
+        fused.node.visit(self, alt)
+
+
+@dataclass(frozen=True)
+class First:
+    """
+    The characters a match can start with, None if it can start with any,
+    and whether it can also match the empty string.
+    """
+    chars: Optional[FrozenSet[str]]
+    nullable: bool
+
+    def then(self, other: 'First') -> 'First':
+        """First of a match of self followed by one of other."""
+        if not self.nullable:
+            return self
+        return First(union(self.chars, other.chars), other.nullable)
+
+    @property
+    def prunable(self) -> bool:
+        return self.chars is not None and not self.nullable
+
+
+ANY = First(None, False)
+EMPTY = First(frozenset(), True)
+
+
+def union(left: Optional[FrozenSet[str]],
+          right: Optional[FrozenSet[str]]) -> Optional[FrozenSet[str]]:
+    if left is None or right is None:
+        return None
+    return left | right
+
+
+def sequence_first(firsts) -> First:
+    first = EMPTY
+    for item in firsts:
+        first = first.then(item)
+        if not first.nullable:
+            break
+    return first
+
+
+def choice_first(firsts) -> First:
+    chars = frozenset()
+    nullable = False
+    for item in firsts:
+        chars = union(chars, item.chars)
+        nullable = nullable or item.nullable
+    return First(chars, nullable)
+
+
+def regex_first(pattern: Pattern) -> First:
+    """
+    A FIRST set for a compiled regex, from the parsed pattern. Anything
+    this does not follow, like case folding, counts as any character.
+    """
+    if pattern.flags & re.IGNORECASE:
+        return First(None, regex_nullable(pattern))
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return First(None, regex_nullable(pattern))
+    return sequence_first(regex_item_first(op, av) for op, av in parsed)
+
+
+def regex_item_first(op, av) -> First:
+    if op is sre_parse.LITERAL:
+        return First(frozenset(chr(av)), False)
+    if op is sre_parse.IN:
+        chars = set()
+        for item_op, item_av in av:
+            if item_op is sre_parse.LITERAL:
+                chars.add(chr(item_av))
+            elif (item_op is sre_parse.RANGE
+                  and item_av[1] - item_av[0] < MAX_FIRST_CHARS):
+                chars.update(map(chr, range(item_av[0], item_av[1] + 1)))
+            else:
+                return ANY
+        if len(chars) > MAX_FIRST_CHARS:
+            return ANY
+        return First(frozenset(chars), False)
+    if op is sre_parse.BRANCH:
+        return choice_first(
+            sequence_first(regex_item_first(*item) for item in branch)
+            for branch in av[1])
+    if op is sre_parse.SUBPATTERN:
+        if av[1] & re.IGNORECASE:
+            return ANY
+        return sequence_first(regex_item_first(*item) for item in av[-1])
+    if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+        minimum, _, items = av
+        first = sequence_first(regex_item_first(*item) for item in items)
+        return First(first.chars, first.nullable or minimum == 0)
+    if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        return EMPTY
+    if op in (sre_parse.ANY, sre_parse.NOT_LITERAL):
+        return ANY
+    return First(None, True)
+
+
+class FirstVisitor:
+    """
+    The FIRST set of a node, given what is known so far about the rules it
+    references.
+    """
+    def visit_rule(self, rule: Rule, firsts: Dict[str, First]) -> First:
+        return firsts.get(rule.name, First(None, True))
+
+    def visit_seq(self, seq: Seq, firsts) -> First:
+        return sequence_first(node.visit(self, firsts) for node in seq.nodes)
+
+    def visit_alt(self, alt: Alt, firsts) -> First:
+        return choice_first(node.visit(self, firsts) for node in alt.nodes)
+
+    def visit_mult(self, mult: Mult, firsts) -> First:
+        first = mult.node.visit(self, firsts)
+        return First(first.chars, first.nullable or mult.min == 0)
+
+    def visit_opt(self, opt: Opt, firsts) -> First:
+        return First(opt.node.visit(self, firsts).chars, True)
+
+    def visit_look(self, look: Look, firsts) -> First:
+        return First(look.node.visit(self, firsts).chars, True)
+
+    def visit_nlook(self, nlook: NLook, firsts) -> First:
+        return EMPTY
+
+    def visit_str(self, string: Str, firsts) -> First:
+        if string.string == '':
+            return EMPTY
+        return First(frozenset(string.string[0]), False)
+
+    def visit_rgx(self, regex: Rgx, firsts) -> First:
+        return regex_first(regex.regex)
+
+    def visit_cut(self, cut: Cut, firsts) -> First:
+        # Skipping a cut would skip its commit, so nothing before one is
+        # ever skipped.
+        return First(None, True)
+
+    def visit_fused(self, fused: Fused, firsts) -> First:
+        return fused.node.visit(self, firsts)
+
+
+class LeadingVisitor:
+    """
+    The terminals a node tries at its start, in order, when the next
+    character does not let any of them match.
+    """
+    nullable: Set[str]
+
+    def __init__(self, nullable: Set[str]):
+        self.nullable = nullable
+
+    def visit_rule(self, rule: Rule, terminals: List[Node], seen: Set[str]):
+        if rule.name not in seen and rule.node is not None:
+            seen.add(rule.name)
+            rule.node.visit(self, terminals, seen)
+
+    def visit_seq(self, seq: Seq, terminals, seen):
+        for node in seq.nodes:
+            node.visit(self, terminals, seen)
+            if not node.visit(NullableVisitor(), self.nullable):
+                break
+
+    def visit_alt(self, alt: Alt, terminals, seen):
+        for node in alt.nodes:
+            node.visit(self, terminals, seen)
+
+    def visit_mult(self, mult: Mult, terminals, seen):
+        mult.node.visit(self, terminals, seen)
+
+    def visit_opt(self, opt: Opt, terminals, seen):
+        opt.node.visit(self, terminals, seen)
+
+    def visit_look(self, look: Look, terminals, seen):
+        look.node.visit(self, terminals, seen)
+
+    def visit_nlook(self, nlook: NLook, terminals, seen):
+        pass
+
+    def visit_str(self, string: Str, terminals, seen):
+        terminals.append(string)
+
+    def visit_rgx(self, regex: Rgx, terminals, seen):
+        terminals.append(regex)
+
+    def visit_cut(self, cut: Cut, terminals, seen):
+        pass
+
+    def visit_fused(self, fused: Fused, terminals, seen):
+        fused.node.visit(self, terminals, seen)
+
+
+class DispatchBuilder:
+    """
+    Gives every Alt with alternatives that cannot start with some characters
+    a table of the Branches to take for each next character, or if they are
+    all string literals, a Literals table.
+    """
+    firsts: Dict[str, First]
+    nullable: Set[str]
+    alts: List[Tuple[str, Alt]]
+
+    def __init__(self, firsts: Dict[str, First], nullable: Set[str]):
+        self.firsts = firsts
+        self.nullable = nullable
+        self.alts = []
+
+    def visit_rule(self, rule: Rule, name: str):
+        pass
+
+    def visit_seq(self, seq: Seq, name):
+        for node in seq.nodes:
+            node.visit(self, name)
+
+    def visit_alt(self, alt: Alt, name):
+        for node in alt.nodes:
+            node.visit(self, name)
+
+        alt.literals = None
+        if len(alt.nodes) >= MIN_LITERALS and all(
+                type(node) is Str and node.string for node in alt.nodes):
+            alt.id, alt.dispatch, alt.default = -1, None, None
+            alt.literals = Literals(tuple(alt.nodes))
+            return
+
+        firsts = [node.visit(FirstVisitor(), self.firsts)
+                  for node in alt.nodes]
+        if not any(first.prunable for first in firsts):
+            alt.id, alt.dispatch, alt.default = -1, None, None
+            return
+
+        chars = set()
+        for first in firsts:
+            if first.prunable:
+                chars |= first.chars
+        leading = LeadingVisitor(self.nullable)
+        expected = []
+        for node in alt.nodes:
+            terminals = []
+            node.visit(leading, terminals, set())
+            expected.append(terminals)
+
+        def branches(char: Optional[str]) -> Branches:
+            steps = []
+            skipped = 0
+            for node, first, terminals in zip(alt.nodes, firsts, expected):
+                if not first.prunable or char in first.chars:
+                    steps.append(node)
+                    continue
+                skipped += 1
+                steps.append(tuple({id(t): t for t in terminals}.values()))
+            return Branches(tuple(steps), skipped)
+
+        alt.id = len(self.alts)
+        alt.dispatch = {char: branches(char) for char in sorted(chars)}
+        alt.default = branches(None)
+        self.alts.append((name, alt))
+
+    def visit_mult(self, mult: Mult, name):
+        mult.node.visit(self, name)
+
+    def visit_opt(self, opt: Opt, name):
+        opt.node.visit(self, name)
+
+    def visit_look(self, look: Look, name):
+        look.node.visit(self, name)
+
+    def visit_nlook(self, nlook: NLook, name):
+        nlook.node.visit(self, name)
+
+    def visit_str(self, string: Str, name):
+        pass
+
+    def visit_rgx(self, regex: Rgx, name):
+        pass
+
+    def visit_cut(self, cut: Cut, name):
+        pass
+
+    def visit_fused(self, fused: Fused, name):
+        fused.node.visit(self, name)
+
+
+def find_nullable_rules(rules: Dict[str, Rule]) -> Set[str]:
+    nullable = set()
+    visitor = NullableVisitor()
+    changed = True
+    while changed:
+        changed = False
+        for name, rule in rules.items():
+            if name in nullable or rule.node is None:
+                continue
+            if rule.node.visit(visitor, nullable):
+                nullable.add(name)
+                changed = True
+    return nullable
+
+
+def find_first_sets(rules: Dict[str, Rule]) -> Dict[str, First]:
+    firsts = {name: First(frozenset(), False)
+              for name, rule in rules.items() if rule.node is not None}
+    visitor = FirstVisitor()
+    changed = True
+    while changed:
+        changed = False
+        for name in firsts:
+            first = rules[name].node.visit(visitor, firsts)
+            if first != firsts[name]:
+                firsts[name] = first
+                changed = True
+    return firsts
+
+
+def strongly_connected(graph: Dict[str, List[str]]) -> List[List[str]]:
+    """Tarjan's algorithm, over the names that are keys of `graph`."""
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+
+    def connect(name):
+        index[name] = lowlink[name] = len(index)
+        stack.append(name)
+        on_stack.add(name)
+        for succ in graph[name]:
+            if succ not in graph:
+                continue
+            if succ not in index:
+                connect(succ)
+                lowlink[name] = min(lowlink[name], lowlink[succ])
+            elif succ in on_stack:
+                lowlink[name] = min(lowlink[name], index[succ])
+        if lowlink[name] == index[name]:
+            component = []
+            while True:
+                succ = stack.pop()
+                on_stack.remove(succ)
+                component.append(succ)
+                if succ == name:
+                    break
+            components.append(component)
+
+    for name in graph:
+        if name not in index:
+            connect(name)
+    return components
+
+
+class GrammarAnalysis:
+    """
+    Facts about a linked grammar: which rules can match the empty string,
+    which rules each rule can call without consuming input first, and the
+    groups of rules that are left recursive through each other. Alts get
+    their dispatch tables, and `alts` lists them with their rules.
+    """
+    nullable: Set[str]
+    firsts: Dict[str, First]
+    alts: List[Tuple[str, Alt]]
+    left_calls: Dict[str, List[str]]
+    components: List[List[str]]
+    left_recursive: Set[str]
+    cuts: bool
+
+    def __init__(self, rules: Dict[str, Rule]):
+        self.nullable = find_nullable_rules(rules)
+        visitor = LeftCallVisitor(self.nullable)
+        checker = RepetitionChecker(self.nullable)
+        linker = CutLinker()
+
+        self.left_calls = {}
+        for name, rule in rules.items():
+            calls = []
+            if rule.node is not None:
+                rule.node.visit(visitor, calls)
+                rule.node.visit(checker, name)
+                rule.node.visit(linker, None)
+            self.left_calls[name] = calls
+        self.cuts = linker.cuts > 0
+
+        self.firsts = find_first_sets(rules)
+        builder = DispatchBuilder(self.firsts, self.nullable)
+        for name, rule in rules.items():
+            if rule.node is not None:
+                rule.node.visit(builder, name)
+        self.alts = builder.alts
+
+        self.components = [
+            component
+            for component in strongly_connected(self.left_calls)
+            if len(component) > 1
+            or component[0] in self.left_calls[component[0]]]
+        self.left_recursive = {name
+                               for component in self.components
+                               for name in component}
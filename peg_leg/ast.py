@@ -1,13 +1,20 @@
-from dataclasses import dataclass
-from typing import Union, List, Dict, Optional
+import re
+from dataclasses import dataclass, field
+from typing import Any, Union, List, Dict, Optional, Pattern, Tuple
 
-Node = Union['Rule', 'Seq', 'Alt', 'Mult', 'Opt', 'Look', 'NLook', 'Str', 'Rgx']
+Node = Union['Rule', 'Seq', 'Alt', 'Mult', 'Opt', 'Look', 'NLook', 'Str', 'Rgx',
+             'Cut', 'Fused']
 
 
 @dataclass
 class Rule:
     name: str
     node: Optional[Node] = None
+    # Index of the rule's memo table, assigned when the grammar is linked.
+    id: int = field(default=-1, repr=False, compare=False)
+    # Cleared when linking finds that the rule cannot call itself without
+    # consuming input, so it can skip the left recursion bookkeeping.
+    left_recursive: bool = field(default=True, repr=False, compare=False)
 
     def __str__(self):
         return self.name
@@ -34,6 +41,18 @@ class Seq:
 @dataclass
 class Alt:
     nodes: List[Node]
+    # Set when linking finds alternatives that cannot start with some
+    # characters: what to do for each next character, and for any other
+    # character or the end of input.
+    id: int = field(default=-1, repr=False, compare=False)
+    dispatch: Optional[Dict[str, 'Branches']] = field(
+        default=None, repr=False, compare=False)
+    default: Optional['Branches'] = field(
+        default=None, repr=False, compare=False)
+    # Set instead when there are enough alternatives and all of them are
+    # string literals.
+    literals: Optional['Literals'] = field(
+        default=None, repr=False, compare=False)
 
     def __init__(self, *nodes):
         self.nodes = list(nodes)
@@ -46,6 +65,64 @@ class Alt:
         return visitor.visit_alt(self, *args, **kwargs)
 
 
+@dataclass
+class Branches:
+    """
+    The alternatives of an Alt to try in order, with the alternatives that
+    cannot match in between replaced by tuples of the terminals they would
+    have failed to match, so errors still list them.
+    """
+    steps: Tuple[Union[Node, Tuple[Node, ...]], ...]
+    skipped: int
+
+
+@dataclass
+class Literals:
+    """
+    The alternatives of an Alt of non-empty string literals, grouped by first
+    character and then by length, so that finding the first one that matches
+    takes a dict lookup per length rather than a test per literal.
+    """
+    strings: Tuple['Str', ...]
+    # By first character, for each length: the position of the first literal
+    # of that length in the Alt, the length, and the positions by literal.
+    # Lengths are in the order of their first literals.
+    table: Dict[str, Tuple[Tuple[int, int, Dict[str, int]], ...]] = field(
+        init=False, repr=False)
+    # By position, the literals before it, which fail when it matches.
+    before: Tuple[Tuple['Str', ...], ...] = field(init=False, repr=False)
+    longest: int = field(init=False, repr=False)
+
+    def __post_init__(self):
+        groups: Dict[str, Dict[int, Dict[str, int]]] = {}
+        for rank, string in enumerate(self.strings):
+            text = string.string
+            lengths = groups.setdefault(text[0], {})
+            lengths.setdefault(len(text), {}).setdefault(text, rank)
+        self.table = {char: tuple((min(ranks.values()), length, ranks)
+                                  for length, ranks in lengths.items())
+                      for char, lengths in groups.items()}
+        self.before = tuple(self.strings[:rank]
+                            for rank in range(len(self.strings)))
+        self.longest = max(len(string.string) for string in self.strings)
+
+    def match(self, input: str, index: int) -> int:
+        """
+        The position of the first literal that `input` has at `index`, or -1.
+        """
+        groups = self.table.get(input[index:index + 1])
+        if groups is None:
+            return -1
+        best = -1
+        for first, length, ranks in groups:
+            if best != -1 and first > best:
+                break
+            rank = ranks.get(input[index:index + length], -1)
+            if rank != -1 and (best == -1 or rank < best):
+                best = rank
+        return best
+
+
 @dataclass
 class Mult:
     min: int
@@ -111,6 +188,15 @@ class Str:
 @dataclass
 class Rgx:
     pattern: str
+    compiled: Optional[Pattern] = field(
+        default=None, repr=False, compare=False)
+
+    @property
+    def regex(self) -> Pattern:
+        # Compiled on first use, so that rules match without being linked.
+        if self.compiled is None:
+            self.compiled = re.compile(self.pattern)
+        return self.compiled
 
     def __str__(self):
         return f"/{self.pattern}/"
@@ -119,6 +205,41 @@ class Rgx:
         return visitor.visit_rgx(self, *args, **kwargs)
 
 
+@dataclass
+class Cut:
+    """
+    Matches nothing and yields None. Once it is passed, the innermost Alt of
+    the same rule may not try its remaining alternatives.
+    """
+    # The Alt the cut commits, assigned when the grammar is linked.
+    alt: Optional[Alt] = field(default=None, repr=False, compare=False)
+
+    def __str__(self):
+        return "~"
+
+    def visit(self, visitor, *args, **kwargs):
+        return visitor.visit_cut(self, *args, **kwargs)
+
+
+@dataclass
+class Fused:
+    """
+    A subtree of terminals that matches as a single regex. `shape` says how
+    to build the value `node` would give from the regex's groups. When the
+    regex fails, `node` runs as usual so that the error is the same.
+    """
+    node: Node
+    pattern: str
+    shape: Tuple[Any, ...] = field(repr=False)
+    regex: Optional[Pattern] = field(default=None, repr=False, compare=False)
+
+    def __str__(self):
+        return str(self.node)
+
+    def visit(self, visitor, *args, **kwargs):
+        return visitor.visit_fused(self, *args, **kwargs)
+
+
 class GrammarResolver:
     def visit_rule(self, rule: Rule, rules: Dict[str, Rule]) -> Rule:
         if rule.name in rules:
@@ -157,3 +278,12 @@ class GrammarResolver:
 
     def visit_rgx(self, regex: Rgx, rules) -> Rgx:
         return regex
+
+    def visit_cut(self, cut: Cut, rules) -> Cut:
+        return cut
+
+    def visit_fused(self, fused: Fused, rules) -> Fused:
+        fused.node = fused.node.visit(self, rules)
+        if fused.regex is None:
+            fused.regex = re.compile(fused.pattern)
+        return fused
@@ -0,0 +1,301 @@
+import re
+from mmap import mmap
+from typing import Any, Callable, Dict, Optional, Pattern, Tuple, Union
+
+from .analysis import GrammarError
+from .ast import Alt, Str, Rgx, Fused, Literals
+from .compiler import Compiler, Match
+from .fusion import build, CONST, LIST, CHOICE, OPTION, REPEAT
+from .parser import ParserRun, PRes, FAIL
+from .stackless import StacklessCompiler
+
+Buffer = Union[bytes, bytearray, memoryview, mmap]
+
+# Grammars are matched against buffers as UTF-8.
+ENCODING = 'utf-8'
+WHITESPACE = re.compile(rb'\s*')
+
+
+def as_buffer(input: Buffer) -> Buffer:
+    """`input`, or a view of it as bytes if it is a view of other items."""
+    if type(input) is memoryview and (input.format != 'B' or input.ndim != 1):
+        return input.cast('B')
+    return input
+
+
+def ascii_pattern(pattern: str, flags: int, what: Any) -> Pattern:
+    # A character class over non-ASCII characters would match their bytes
+    # one by one.
+    if not pattern.isascii():
+        raise GrammarError(f'{what} has characters that are not ASCII, so it '
+                           f'cannot be matched as bytes')
+    return re.compile(pattern.encode(ENCODING), flags & ~re.UNICODE)
+
+
+class BytePatterns:
+    """
+    The terminals of a grammar as bytes: each string literal encoded, and
+    each regex compiled again for bytes. They are made when first asked
+    for and kept with the node they were made from.
+    """
+    patterns: Dict[int, Tuple[Any, Any]]
+
+    def __init__(self):
+        self.patterns = {}
+
+    def get(self, node: Any, make: Callable[[Any], Any]) -> Any:
+        entry = self.patterns.get(id(node))
+        if entry is None or entry[0] is not node:
+            entry = node, make(node)
+            self.patterns[id(node)] = entry
+        return entry[1]
+
+    def string(self, string: Str) -> bytes:
+        return self.get(string, lambda string: string.string.encode(ENCODING))
+
+    def regex(self, regex: Rgx) -> Pattern:
+        return self.get(regex, lambda regex: ascii_pattern(
+            regex.regex.pattern, regex.regex.flags, regex))
+
+    def fused(self, fused: Fused) -> Optional[Tuple[Pattern, Any]]:
+        """
+        The regex and shape of `fused`, or None to match its subtree
+        instead.
+        """
+        def make(fused):
+            try:
+                pattern = ascii_pattern(fused.regex.pattern,
+                                        fused.regex.flags, fused)
+            except GrammarError:
+                return None
+            return pattern, encode_shape(fused.shape)
+        return self.get(fused, make)
+
+    def literals(self, literals: Literals) -> Tuple[Tuple[bytes, ...],
+                                                    Pattern]:
+        """
+        The literals encoded, and a regex with a group for each, in order,
+        so that the group that matched is the first literal that does.
+        """
+        def make(literals):
+            encoded = tuple(string.string.encode(ENCODING)
+                            for string in literals.strings)
+            return encoded, re.compile(b'|'.join(
+                b'(' + re.escape(text) + b')' for text in encoded))
+        return self.get(literals, make)
+
+    def dispatch(self, alt: Alt) -> Optional[Dict[int, Any]]:
+        """
+        The dispatch table of `alt` by byte, or None if it has characters
+        that are not ASCII. Alternatives that need an ASCII character first
+        cannot start with any other byte, so the default still holds.
+        """
+        def make(alt):
+            if not all(char.isascii() for char in alt.dispatch):
+                return None
+            return {ord(char): branches
+                    for char, branches in alt.dispatch.items()}
+        return self.get(alt, make)
+
+
+def encode_shape(shape: Tuple[Any, ...]) -> Tuple[Any, ...]:
+    """`shape` with its literals and patterns as bytes."""
+    kind = shape[0]
+    if kind == CONST:
+        value = shape[1]
+        return kind, value.encode(ENCODING) if type(value) is str else value
+    if kind == LIST:
+        return kind, tuple(encode_shape(part) for part in shape[1])
+    if kind == CHOICE:
+        return kind, tuple((marker, encode_shape(part))
+                           for marker, part in shape[1])
+    if kind == OPTION:
+        return kind, shape[1], encode_shape(shape[2])
+    if kind == REPEAT:
+        _, group, regex, part = shape
+        return kind, group, re.compile(regex.pattern.encode(ENCODING)), \
+            encode_shape(part)
+    return shape
+
+
+class BytesRun(ParserRun):
+    """
+    A visitor run over a buffer of bytes rather than a str. Terminals
+    match their BytePatterns, and give bytes: the encoded literal or the
+    slice a regex matched.
+    """
+    patterns: BytePatterns
+
+    def __init__(self, actions, input: Buffer, patterns: BytePatterns,
+                 ignore_ws: bool, rules: int, cuts: bool = False):
+        super().__init__(actions, as_buffer(input), ignore_ws, rules, cuts)
+        self.patterns = patterns
+
+    def skip_whitespace(self, index: int) -> int:
+        return WHITESPACE.match(self.input, index).end()
+
+    def branches(self, alt: Alt, index: int):
+        dispatch = self.patterns.dispatch(alt)
+        if dispatch is None:
+            return alt.nodes
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        byte = self.input[pos] if pos < len(self.input) else -1
+        branches = dispatch.get(byte, alt.default)
+        if branches.skipped:
+            self.skipped[alt.id] += branches.skipped
+        return branches.steps
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        encoded, pattern = self.patterns.literals(literals)
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        match = pattern.match(self.input, pos)
+        if match is None:
+            if pos >= self.fail_index:
+                self.expect(pos, literals.strings)
+            return FAIL, index
+        rank = match.lastindex - 1
+        if rank and pos >= self.fail_index:
+            self.expect(pos, literals.before[rank])
+        return encoded[rank], match.end()
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        regex = self.patterns.fused(fused)
+        if self.fusing and regex is not None:
+            pattern, shape = regex
+            match = pattern.match(self.input, index)
+            if match:
+                return build(shape, match), match.end()
+        return fused.node.visit(self, index, *args)
+
+    def visit_str(self, string: Str, index: int, *args) -> PRes:
+        if self.ignore_ws:
+            index = self.skip_whitespace(index)
+        encoded = self.patterns.string(string)
+        end = index + len(encoded)
+        # Slices compare with bytes for every kind of buffer, where only
+        # some have startswith().
+        if self.input[index:end] == encoded:
+            return encoded, end
+        self.expect(index, string)
+        return FAIL, index
+
+    def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
+        if self.ignore_ws:
+            index = self.skip_whitespace(index)
+        match = self.patterns.regex(regex).match(self.input, index)
+        if match:
+            return match.group(), match.end()
+        self.expect(index, regex)
+        return FAIL, index
+
+
+class BytesMatching:
+    """
+    Overrides for the compilers that match terminals against a buffer of
+    bytes, as the visit methods of a BytesRun do.
+    """
+    patterns: BytePatterns
+    ignore_ws: bool
+
+    def dispatcher(self, alt: Alt, matchers):
+        if alt.dispatch is None or self.patterns.dispatch(alt) is None:
+            return None
+        return super().dispatcher(alt, matchers)
+
+    def dispatch_on_character(self, alt_id: int, table: Dict[str, Any],
+                              default: Any) -> Callable[[BytesRun, int], Any]:
+        table = {ord(char): steps for char, steps in table.items()}
+        ignore_ws = self.ignore_ws
+
+        def dispatch(run, index):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            input = run.input
+            byte = input[index] if index < len(input) else -1
+            steps, skipped = table.get(byte, default)
+            if skipped:
+                run.skipped[alt_id] += skipped
+            return steps
+
+        return dispatch
+
+    def literals_matcher(self, alt: Alt) -> Match:
+        literals = alt.literals
+        encoded, pattern = self.patterns.literals(literals)
+        ignore_ws = self.ignore_ws
+
+        def match_literals(run, index, stack, involved):
+            pos = run.skip_whitespace(index) if ignore_ws else index
+            match = pattern.match(run.input, pos)
+            if match is None:
+                if pos >= run.fail_index:
+                    run.expect(pos, literals.strings)
+                return FAIL, index
+            rank = match.lastindex - 1
+            if rank and pos >= run.fail_index:
+                run.expect(pos, literals.before[rank])
+            return encoded[rank], match.end()
+
+        return match_literals
+
+    def visit_fused(self, fused: Fused) -> Match:
+        regex = self.patterns.fused(fused)
+        if regex is None:
+            return fused.node.visit(self)
+        pattern, shape = regex
+        match_node = fused.node.visit(self)
+
+        def match_fused(run, index, stack, involved):
+            if run.fusing:
+                match = pattern.match(run.input, index)
+                if match:
+                    return build(shape, match), match.end()
+            return match_node(run, index, stack, involved)
+
+        return match_fused
+
+    def visit_str(self, string: Str) -> Match:
+        encoded = self.patterns.string(string)
+        length = len(encoded)
+        ignore_ws = self.ignore_ws
+
+        def match_str(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            if run.input[index:index + length] == encoded:
+                return encoded, index + length
+            if index >= run.fail_index:
+                run.expect(index, string)
+            return FAIL, index
+
+        return match_str
+
+    def visit_rgx(self, regex: Rgx) -> Match:
+        pattern = self.patterns.regex(regex)
+        ignore_ws = self.ignore_ws
+
+        def match_rgx(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            match = pattern.match(run.input, index)
+            if match:
+                return match.group(), match.end()
+            if index >= run.fail_index:
+                run.expect(index, regex)
+            return FAIL, index
+
+        return match_rgx
+
+
+class BytesCompiler(BytesMatching, Compiler):
+    def __init__(self, actions: Dict[str, Callable], patterns: BytePatterns,
+                 ignore_ws: bool, cuts: bool = False):
+        super().__init__(actions, ignore_ws, cuts)
+        self.patterns = patterns
+
+
+class BytesStacklessCompiler(BytesMatching, StacklessCompiler):
+    def __init__(self, actions: Dict[str, Callable], patterns: BytePatterns,
+                 ignore_ws: bool, cuts: bool = False):
+        super().__init__(actions, ignore_ws, cuts)
+        self.patterns = patterns
@@ -0,0 +1,174 @@
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+from typing import Any, Dict, Optional, Tuple
+
+from . import __version__
+from .ast import Rule
+
+# Part of every key. Bump it whenever what is pickled changes: the AST
+# classes, the fields linking sets on them, or the grammar analysis.
+CACHE_FORMAT = 4
+# What a damaged or truncated cache file raises when it is loaded.
+LOAD_ERRORS = (pickle.UnpicklingError, EOFError)
+# Pickled grammars by cache key. Each load unpickles a fresh copy, since
+# parsers change their rules when they are linked or compiled.
+memory_cache: Dict[str, bytes] = {}
+# Where pickled grammars are also kept between processes, if anywhere.
+cache_dir: Optional[str] = os.environ.get('PEG_LEG_CACHE_DIR')
+
+
+def set_cache_dir(path: Optional[str]):
+    global cache_dir
+    cache_dir = path
+
+
+def clear_cache():
+    memory_cache.clear()
+
+
+def cache_key(kind: str, text: str) -> str:
+    digest = hashlib.sha256()
+    for part in (__version__, str(CACHE_FORMAT), kind, text):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def lookup(key: str) -> Optional[bytes]:
+    data = memory_cache.get(key)
+    if cache_dir is None:
+        return data
+    path = os.path.join(cache_dir, key)
+    if data is not None:
+        # Entries cached before the directory was set are written there too.
+        if not os.path.exists(path):
+            write(key, data)
+        return data
+    try:
+        with open(path, 'rb') as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    memory_cache[key] = data
+    return data
+
+
+def store(key: str, data: bytes):
+    memory_cache[key] = data
+    if cache_dir is not None:
+        write(key, data)
+
+
+def write(key: str, data: bytes):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Readers must never see a partly written file.
+        fd, path = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(path, os.path.join(cache_dir, key))
+    except OSError:
+        pass
+
+
+class RulePickler(pickle.Pickler):
+    """
+    Writes references to the grammar's rules by name, so that pickling a
+    rule does not recurse through every rule reachable from it.
+    """
+    rules: Dict[str, Rule]
+
+    def __init__(self, file, rules: Dict[str, Rule]):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.rules = rules
+
+    def persistent_id(self, obj):
+        if type(obj) is Rule and self.rules.get(obj.name) is obj:
+            return obj.name
+        return None
+
+
+class RuleUnpickler(pickle.Unpickler):
+    rules: Dict[str, Rule]
+
+    def __init__(self, file, rules: Dict[str, Rule]):
+        super().__init__(file)
+        self.rules = rules
+
+    def persistent_load(self, name: str) -> Rule:
+        return self.rules[name]
+
+
+def dump_rules(rules: Dict[str, Rule], state: Any) -> bytes:
+    """
+    Pickle `rules`, then `state`, which can refer to them, each rule on its
+    own so that linked rules do not pickle recursively.
+    """
+    buffer = io.BytesIO()
+    pickler = RulePickler(buffer, rules)
+    pickler.dump(list(rules))
+    for rule in rules.values():
+        pickler.dump(rule.__dict__)
+    pickler.dump(state)
+    return buffer.getvalue()
+
+
+def load_rules(data: bytes) -> Tuple[Dict[str, Rule], Any]:
+    rules = {}
+    unpickler = RuleUnpickler(io.BytesIO(data), rules)
+    for name in unpickler.load():
+        rules[name] = Rule.__new__(Rule)
+    for rule in rules.values():
+        rule.__dict__.update(unpickler.load())
+    return rules, unpickler.load()
+
+
+def dump_grammar(parser) -> bytes:
+    return dump_rules(parser.rules, (parser.grammar.name, parser.analysis))
+
+
+def load_grammar(parser, data: bytes):
+    rules, (name, analysis) = load_rules(data)
+    parser.grammar = rules[name]
+    parser.rules = rules
+    parser.analysis = analysis
+    parser.linked = True
+    parser.compiler = None
+
+
+def cached_grammar(parser, text: str) -> bool:
+    """
+    Give `parser` the linked rules of grammar `text` if they are cached, and
+    tell whether they were.
+    """
+    data = lookup(cache_key('grammar', text))
+    if data is None:
+        return False
+    try:
+        load_grammar(parser, data)
+    except LOAD_ERRORS:
+        # A damaged cache file only costs parsing the grammar again.
+        return False
+    return True
+
+
+def cache_grammar(parser, text: str):
+    store(cache_key('grammar', text), dump_grammar(parser))
+
+
+def cached_rule(pattern: str) -> Optional[Rule]:
+    data = lookup(cache_key('rule', pattern))
+    if data is None:
+        return None
+    try:
+        return pickle.loads(data)
+    except LOAD_ERRORS:
+        return None
+
+
+def cache_rule(pattern: str, rule: Rule):
+    store(cache_key('rule', pattern),
+          pickle.dumps(rule, pickle.HIGHEST_PROTOCOL))
@@ -0,0 +1,543 @@
+import re
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, Cut, \
+    Fused
+from .fusion import LIST, CHOICE, OPTION, REPEAT
+
+PRELUDE = '''\
+# Generated by peg_leg from a grammar, do not edit.
+import re
+
+from peg_leg.ast import Str, Rgx, Literals
+from peg_leg.compiler import get_involved_rules
+from peg_leg.fusion import build
+from peg_leg.parser import ParserRun, ParsingError, Error, FAIL, \
+    LeftRecursion, MemoEntry
+
+ACTIONS = {{}}
+IGNORE_WS = {ignore_ws!r}
+CUTS = {cuts!r}
+FUSED = {fused!r}
+START = {start!r}
+
+
+def action(name):
+    def wrap(fn):
+        ACTIONS[name] = fn
+        return fn
+
+    return wrap
+
+
+def _memoized(run, rule_id, name, body, index, stack, involved):
+    table = run.memotable[rule_id]
+    memo = table[index]
+    if memo:
+        return memo.res, memo.idx
+    res, idx = body(run, index, stack, involved)
+    if type(res) is not Error:
+        action = ACTIONS.get(name)
+        if action is not None:
+            res = action(res)
+    table[index] = MemoEntry(res, idx)
+    run.memo_entries += 1
+    return res, idx
+
+
+def _left_recursive(run, rule_id, name, body, index, stack, involved):
+    table = run.memotable[rule_id]
+    memo = table[index]
+    action = ACTIONS.get(name)
+    if memo:
+        if name in involved:
+            res, idx = body(run, index, (name, stack), involved - {{name}})
+            if action is not None and type(res) is not Error:
+                res = action(res)
+            memo.res = res
+            memo.idx = idx
+            return res, idx
+        elif type(memo.res) is LeftRecursion:
+            path = get_involved_rules(stack, name)
+            memo.res.involved |= set(path)
+            run.expect(index, path)
+            return FAIL, index
+        else:
+            return memo.res, memo.idx
+
+    if CUTS:
+        run.choices.append([index, name, False])
+    lr = LeftRecursion()
+    memo = MemoEntry(lr, index)
+    table[index] = memo
+    run.memo_entries += 1
+    res, idx = body(run, index, (name, stack), involved)
+    if type(res) is not Error:
+        if action is not None:
+            res = action(res)
+        memo.res = res
+        memo.idx = idx
+        involved = lr.involved - {{name}}
+        while lr.involved:
+            res, idx = body(run, index, stack, involved)
+            if type(res) is Error or idx <= memo.idx:
+                break
+            if action is not None:
+                res = action(res)
+            memo.res = res
+            memo.idx = idx
+        res, idx = memo.res, memo.idx
+    else:
+        memo.res = res
+        memo.idx = idx
+    if CUTS:
+        run.choices.pop()
+    return res, idx
+'''
+
+EPILOGUE = '''
+
+def parse(input: str, rule: str = START):
+    run = ParserRun(ACTIONS, input, IGNORE_WS, len(RULES), CUTS)
+    res, end_index = RULES[rule](run, 0, None, set())
+    try:
+        return run.finish(res, end_index)
+    except ParsingError:
+        if not FUSED:
+            raise
+    # Fused subtrees that matched did not record what they expected.
+    run = ParserRun(ACTIONS, input, IGNORE_WS, len(RULES), CUTS)
+    run.fusing = False
+    res, end_index = RULES[rule](run, 0, None, set())
+    return run.finish(res, end_index)
+'''
+
+# Every Seq, Alt and Mult opens a loop, and CPython refuses to compile more
+# than 20 statically nested blocks, so deeper nodes get their own function.
+MAX_DEPTH = 16
+
+
+class ReferenceCollector:
+    def visit_rule(self, rule: Rule, names: List[str]):
+        names.append(rule.name)
+
+    def visit_seq(self, seq: Seq, names):
+        for node in seq.nodes:
+            node.visit(self, names)
+
+    def visit_alt(self, alt: Alt, names):
+        for node in alt.nodes:
+            node.visit(self, names)
+
+    def visit_mult(self, mult: Mult, names):
+        mult.node.visit(self, names)
+
+    def visit_opt(self, opt: Opt, names):
+        opt.node.visit(self, names)
+
+    def visit_look(self, look: Look, names):
+        look.node.visit(self, names)
+
+    def visit_nlook(self, nlook: NLook, names):
+        nlook.node.visit(self, names)
+
+    def visit_str(self, string: Str, names):
+        pass
+
+    def visit_rgx(self, regex: Rgx, names):
+        pass
+
+    def visit_cut(self, cut: Cut, names):
+        pass
+
+    def visit_fused(self, fused: Fused, names):
+        fused.node.visit(self, names)
+
+
+def find_cyclic_rules(graph: Dict[str, List[str]]) -> Set[str]:
+    """Names of the rules that can reach themselves through `graph`."""
+    cyclic = set()
+    for start in graph:
+        seen = set()
+        todo = list(graph[start])
+        while todo:
+            name = todo.pop()
+            if name == start:
+                cyclic.add(start)
+                break
+            if name in seen or name not in graph:
+                continue
+            seen.add(name)
+            todo.extend(graph[name])
+    return cyclic
+
+
+def shape_source(shape: Tuple) -> str:
+    """Source for `shape`, with the regexes of repetitions compiled again."""
+    kind = shape[0]
+    if kind == LIST:
+        parts = ''.join(f'{shape_source(part)}, ' for part in shape[1])
+        return f'({kind}, ({parts}))'
+    if kind == CHOICE:
+        parts = ''.join(f'({marker}, {shape_source(part)}), '
+                        for marker, part in shape[1])
+        return f'({kind}, ({parts}))'
+    if kind == OPTION:
+        return f'({kind}, {shape[1]}, {shape_source(shape[2])})'
+    if kind == REPEAT:
+        _, group, regex, part = shape
+        return f'({kind}, {group}, re.compile({regex.pattern!r}), ' \
+            f'{shape_source(part)})'
+    return repr(shape)
+
+
+class Emitter:
+    lines: List[str]
+    level: int
+
+    def __init__(self, level: int = 0):
+        self.lines = []
+        self.level = level
+
+    def line(self, text: str):
+        self.lines.append('    ' * self.level + text)
+
+    def indent(self):
+        self.level += 1
+
+    def dedent(self):
+        self.level -= 1
+
+    def source(self) -> str:
+        return '\n'.join(self.lines)
+
+
+class CodeGenerator:
+    """
+    Emits a standalone Python module for a linked grammar, with one function
+    per rule. Terminals are matched inline; only rules that take part in a
+    reference cycle, or are referenced more than once, go through the memo
+    table, and only left recursive ones grow their results.
+    """
+    rules: Dict[str, Rule]
+    ignore_ws: bool
+    cuts: bool
+
+    names: Dict[str, str]
+    memoized: Set[str]
+    constants: List[str]
+    functions: List[str]
+    alt_keys: Dict[int, str]
+    # Whether any Fused node was emitted.
+    fused: bool
+
+    def __init__(self, rules: Dict[str, Rule], ignore_ws: bool,
+                 cuts: bool = False):
+        self.rules = rules
+        self.ignore_ws = ignore_ws
+        self.cuts = cuts
+
+        self.names = {}
+        self.memoized = set()
+        self.constants = []
+        self.functions = []
+        self.alt_keys = {}
+        self.fused = False
+        self.counter = 0
+
+    def generate(self, start: Optional[Rule]) -> str:
+        graph = {}
+        counts = {name: 0 for name in self.rules}
+        for name, rule in self.rules.items():
+            refs = []
+            rule.node.visit(ReferenceCollector(), refs)
+            graph[name] = refs
+            for ref in refs:
+                counts[ref] = counts.get(ref, 0) + 1
+
+        cyclic = find_cyclic_rules(graph)
+        self.memoized = {name for name, count in counts.items()
+                         if count > 1 or name in cyclic}
+        # Rules called from inside a cyclic rule are re-run while its seed
+        # grows, so they keep their memo entries as well.
+        for name in cyclic:
+            self.memoized.update(graph[name])
+
+        for name in self.rules:
+            ident = 'rule_' + re.sub(r'\W', '_', name)
+            while ident in self.names.values():
+                ident += '_'
+            self.names[name] = ident
+
+        for rule_id, (name, rule) in enumerate(self.rules.items()):
+            self.emit_rule(rule_id, name, rule)
+
+        start_name = start.name if start is not None else None
+        prelude = PRELUDE.format(ignore_ws=self.ignore_ws, cuts=self.cuts,
+                                 fused=self.fused, start=start_name)
+        table = ['RULES = {']
+        for name, ident in self.names.items():
+            table.append(f'    {name!r}: {ident},')
+        table.append('}')
+
+        parts = [prelude]
+        if self.constants:
+            parts.append('\n'.join(self.constants) + '\n')
+        parts.extend(self.functions)
+        parts.append('\n'.join(table) + '\n' + EPILOGUE)
+        return '\n\n'.join(parts)
+
+    def var(self, prefix: str) -> str:
+        self.counter += 1
+        return f'{prefix}{self.counter}'
+
+    def constant(self, prefix: str, value: str) -> str:
+        name = f'{prefix}{len(self.constants)}'
+        self.constants.append(f'{name} = {value}')
+        return name
+
+    def alt_key(self, alt: Alt) -> str:
+        """Constant that stands for `alt` on the run's choice stack."""
+        if id(alt) not in self.alt_keys:
+            self.alt_keys[id(alt)] = self.constant('_ALT_', 'object()')
+        return self.alt_keys[id(alt)]
+
+    def push_choice(self, out: Emitter, pos: str, key: str = 'None'):
+        if self.cuts:
+            out.line(f'run.choices.append([{pos}, {key}, False])')
+
+    def pop_choice(self, out: Emitter):
+        if self.cuts:
+            out.line('run.choices.pop()')
+
+    def emit_rule(self, rule_id: int, name: str, rule: Rule):
+        assert rule.node is not None, f'Rule {name} does not have a body'
+        ident = self.names[name]
+        if name in self.memoized:
+            body_ident = '_' + ident + '_body'
+            helper = '_left_recursive' if rule.left_recursive else '_memoized'
+            out = Emitter(1)
+            out.line(f'return {helper}(run, {rule_id}, {name!r}, '
+                     f'{body_ident}, index, stack, involved)')
+            self.add_function(ident, out)
+            self.emit_function(body_ident, rule.node)
+        else:
+            out = Emitter(1)
+            out.line('input = run.input')
+            res, end = self.var('r'), self.var('e')
+            rule.node.visit(self, out, 'index', res, end, 0)
+            out.line(f'if type({res}) is not Error:')
+            out.indent()
+            out.line(f'action = ACTIONS.get({name!r})')
+            out.line('if action is not None:')
+            out.line(f'    {res} = action({res})')
+            out.dedent()
+            out.line(f'return {res}, {end}')
+            self.add_function(ident, out)
+
+    def emit_function(self, ident: str, node: Node):
+        out = Emitter(1)
+        out.line('input = run.input')
+        res, end = self.var('r'), self.var('e')
+        node.visit(self, out, 'index', res, end, 0)
+        out.line(f'return {res}, {end}')
+        self.add_function(ident, out)
+
+    def add_function(self, ident: str, out: Emitter):
+        header = f'def {ident}(run, index, stack, involved):'
+        self.functions.append(header + '\n' + out.source() + '\n')
+
+    def emit_node(self, node: Node, out: Emitter,
+                  pos: str, res: str, end: str, depth: int):
+        if depth < MAX_DEPTH:
+            node.visit(self, out, pos, res, end, depth)
+        else:
+            ident = self.var('_node')
+            self.emit_function(ident, node)
+            out.line(f'{res}, {end} = {ident}(run, {pos}, stack, involved)')
+
+    def visit_rule(self, rule: Rule, out, pos, res, end, depth):
+        ident = self.names.get(rule.name)
+        assert ident is not None, f'Rule {rule.name} does not have a body'
+        out.line(f'{res}, {end} = {ident}(run, {pos}, stack, involved)')
+
+    def visit_seq(self, seq: Seq, out, pos, res, end, depth):
+        val, idx = self.var('v'), self.var('i')
+        out.line(f'{res} = []')
+        out.line(f'{end} = {pos}')
+        out.line('while True:')
+        out.indent()
+        for node in seq.nodes:
+            self.emit_node(node, out, end, val, idx, depth + 1)
+            out.line(f'if type({val}) is Error:')
+            out.line(f'    {res}, {end} = {val}, {idx}')
+            out.line('    break')
+            out.line(f'{res}.append({val})')
+            out.line(f'{end} = {idx}')
+        out.line('break')
+        out.dedent()
+
+    def visit_alt(self, alt: Alt, out, pos, res, end, depth):
+        if alt.literals is not None:
+            strings = ''.join(self.terminal(string) + ', '
+                              for string in alt.literals.strings)
+            literals = self.constant('_LITERALS_', f'Literals(({strings}))')
+            out.line(f'{res}, {end} = run.match_literals({literals}, {pos})')
+            return
+        if self.cuts:
+            choice = self.var('c')
+            out.line(f'{choice} = [{pos}, {self.alt_key(alt)}, False]')
+            out.line(f'run.choices.append({choice})')
+        guards = self.dispatch_guards(alt, out, pos)
+        out.line('while True:')
+        out.indent()
+        for node in alt.nodes:
+            guard = guards.get(id(node))
+            if guard is not None:
+                out.line(f'if {guard[0]}:')
+                out.indent()
+            self.emit_node(node, out, pos, res, end, depth + 2)
+            out.line(f'if type({res}) is not Error:')
+            out.line('    break')
+            if self.cuts:
+                out.line(f'if {choice}[2]:')
+                out.line(f'    {res}, {end} = FAIL, {pos}')
+                out.line('    break')
+            if guard is not None:
+                out.dedent()
+                out.line('else:')
+                out.line(f'    run.expect_skipped({pos}, {guard[1]})')
+        out.line(f'{res}, {end} = FAIL, {pos}')
+        out.line('break')
+        out.dedent()
+        self.pop_choice(out)
+
+    def dispatch_guards(self, alt: Alt, out: Emitter, pos: str) \
+            -> Dict[int, Tuple[str, str]]:
+        """
+        For the alternatives of `alt` that cannot start with every
+        character, by node id: the condition for trying one, and what to
+        expect instead, after emitting the next character they test.
+        """
+        if alt.dispatch is None:
+            return {}
+        char = self.var('ch')
+        if self.ignore_ws:
+            out.line(f'{char} = run.skip_whitespace({pos})')
+        else:
+            out.line(f'{char} = {pos}')
+        out.line(f'{char} = input[{char}:{char} + 1]')
+
+        guards = {}
+        for i, (node, step) in enumerate(zip(alt.nodes, alt.default.steps)):
+            if type(step) is not tuple:
+                continue
+            chars = ''.join(char for char, branches in alt.dispatch.items()
+                            if branches.steps[i] is node)
+            first = self.constant('_FIRST_', f'frozenset({chars!r})')
+            expected = ', '.join(self.terminal(term) for term in step)
+            expected = self.constant('_EXPECT_',
+                                     f'({expected},)' if step else '()')
+            guards[id(node)] = f'{char} in {first}', expected
+        return guards
+
+    def terminal(self, terminal: Union[Str, Rgx]) -> str:
+        if type(terminal) is Str:
+            return self.constant('_STR_', f'Str({terminal.string!r})')
+        return self.constant('_RGX_', f'Rgx({terminal.pattern!r})')
+
+    def visit_mult(self, mult: Mult, out, pos, res, end, depth):
+        val, idx = self.var('v'), self.var('i')
+        out.line(f'{res} = []')
+        out.line(f'{end} = {pos}')
+        out.line('while True:')
+        out.indent()
+        self.push_choice(out, end)
+        self.emit_node(mult.node, out, end, val, idx, depth + 1)
+        self.pop_choice(out)
+        out.line(f'if type({val}) is Error:')
+        out.indent()
+        out.line(f'if len({res}) < {mult.min}:')
+        out.line(f'    {res}, {end} = {val}, {idx}')
+        out.line('break')
+        out.dedent()
+        out.line(f'{res}.append({val})')
+        out.line(f'{end} = {idx}')
+        out.dedent()
+
+    def visit_opt(self, opt: Opt, out, pos, res, end, depth):
+        val, idx = self.var('v'), self.var('i')
+        self.push_choice(out, pos)
+        self.emit_node(opt.node, out, pos, val, idx, depth)
+        self.pop_choice(out)
+        out.line(f'if type({val}) is Error:')
+        out.line(f'    {res}, {end} = None, {pos}')
+        out.line('else:')
+        out.line(f'    {res}, {end} = {val}, {idx}')
+
+    def visit_look(self, look: Look, out, pos, res, end, depth):
+        self.push_choice(out, pos)
+        self.emit_node(look.node, out, pos, res, end, depth)
+        self.pop_choice(out)
+        out.line(f'{end} = {pos}')
+
+    def visit_nlook(self, nlook: NLook, out, pos, res, end, depth):
+        msg = self.constant('_MSG_', repr(f'Did not expect {nlook.node}'))
+        val, idx = self.var('v'), self.var('i')
+        failure = self.var('f')
+        out.line(f'{failure} = run.save_failure()')
+        self.push_choice(out, pos)
+        self.emit_node(nlook.node, out, pos, val, idx, depth)
+        self.pop_choice(out)
+        out.line(f'run.restore_failure({failure})')
+        out.line(f'if type({val}) is Error:')
+        out.line(f'    {res}, {end} = None, {pos}')
+        out.line('else:')
+        out.line(f'    run.expect({pos}, {msg})')
+        out.line(f'    {res}, {end} = FAIL, {pos}')
+
+    def visit_str(self, string: Str, out, pos, res, end, depth):
+        s = string.string
+        expected = self.constant('_STR_', f'Str({s!r})')
+        if self.ignore_ws:
+            out.line(f'{end} = run.skip_whitespace({pos})')
+            pos = end
+        out.line(f'if input.startswith({s!r}, {pos}):')
+        out.line(f'    {res}, {end} = {s!r}, {pos} + {len(s)}')
+        self.emit_failure(out, expected, pos, res, end)
+
+    def visit_rgx(self, regex: Rgx, out, pos, res, end, depth):
+        pattern = self.constant('_RGX_', f're.compile({regex.pattern!r})')
+        expected = self.constant('_RGX_', f'Rgx({regex.pattern!r})')
+        match = self.var('m')
+        if self.ignore_ws:
+            out.line(f'{end} = run.skip_whitespace({pos})')
+            pos = end
+        out.line(f'{match} = {pattern}.match(input, {pos})')
+        out.line(f'if {match}:')
+        out.line(f'    {res}, {end} = {match}.group(), {match}.end()')
+        self.emit_failure(out, expected, pos, res, end)
+
+    def emit_failure(self, out, expected, pos, res, end):
+        out.line('else:')
+        out.line(f'    if {pos} >= run.fail_index:')
+        out.line(f'        run.expect({pos}, {expected})')
+        out.line(f'    {res}, {end} = FAIL, {pos}')
+
+    def visit_cut(self, cut: Cut, out, pos, res, end, depth):
+        key = self.alt_key(cut.alt) if cut.alt is not None else 'None'
+        out.line(f'run.commit({key}, {pos})')
+        out.line(f'{res}, {end} = None, {pos}')
+
+    def visit_fused(self, fused: Fused, out, pos, res, end, depth):
+        pattern = self.constant('_FUSED_', f're.compile({fused.pattern!r})')
+        shape = self.constant('_SHAPE_', shape_source(fused.shape))
+        match = self.var('m')
+        self.fused = True
+        out.line(f'{match} = run.fusing and {pattern}.match(input, {pos})')
+        out.line(f'if {match}:')
+        out.line(f'    {res}, {end} = build({shape}, {match}), {match}.end()')
+        out.line('else:')
+        out.indent()
+        self.emit_node(fused.node, out, pos, res, end, depth + 1)
+        out.dedent()
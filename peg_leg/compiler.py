@@ -0,0 +1,364 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, Cut, \
+    Fused
+from .fusion import build
+from .parser import PRes, Error, FAIL, LeftRecursion, MemoEntry, ParserRun
+
+# The rule stack is kept as a linked list of (name, parent) pairs so that
+# entering a rule does not copy the whole stack.
+Stack = Optional[Tuple[str, Any]]
+Match = Callable[[ParserRun, int, Stack, Set[str]], PRes]
+
+
+def get_involved_rules(stack: Stack, head: str) -> List[str]:
+    involved = []
+    while stack is not None:
+        name, stack = stack
+        involved.insert(0, name)
+        if name == head:
+            break
+    return involved
+
+
+class Compiler:
+    """
+    Turns a linked grammar into a graph of closures, one per node. Each
+    closure has the constants of its node bound in and calls the closures
+    of its children directly, so matching does not go through visit().
+    Choice points are only tracked for grammars with cuts.
+    """
+    stackless = False
+    actions: Dict[str, Callable]
+    ignore_ws: bool
+    cuts: bool
+    rules: Dict[str, Match]
+
+    def __init__(self, actions: Dict[str, Callable], ignore_ws: bool,
+                 cuts: bool = False):
+        self.actions = actions
+        self.ignore_ws = ignore_ws
+        self.cuts = cuts
+        self.rules = {}
+
+    def compile(self, node: Node) -> Match:
+        return node.visit(self)
+
+    def choice_point(self, node: Node, match: Match) -> Match:
+        if not self.cuts:
+            return match
+
+        def match_choice(run, index, stack, involved):
+            choices = run.choices
+            choices.append([index, node, False])
+            res = match(run, index, stack, involved)
+            choices.pop()
+            return res
+
+        return match_choice
+
+    def visit_rule(self, rule: Rule) -> Match:
+        name = rule.name
+        rule_id = rule.id
+        if name in self.rules:
+            return self.rules[name]
+        assert rule.node is not None, f'Rule {name} does not have a body'
+
+        action = self.actions.get(name)
+        body = None
+
+        if rule.left_recursive:
+            def grow(run, index, stack, involved, memo):
+                involved = involved - {name}
+                while True:
+                    res, end_idx = body(run, index, stack, involved)
+                    if type(res) is Error or end_idx <= memo.idx:
+                        break
+                    if action is not None:
+                        res = action(res)
+                    memo.res = res
+                    memo.idx = end_idx
+                return memo.res, memo.idx
+
+            def match_rule(run, index, stack, involved):
+                table = run.memotable[rule_id]
+                memo = table[index]
+                if memo:
+                    if name in involved:
+                        res, idx = body(
+                            run, index, (name, stack), involved - {name})
+                        if action is not None and type(res) is not Error:
+                            res = action(res)
+                        memo.res = res
+                        memo.idx = idx
+                        return res, idx
+                    elif type(memo.res) is LeftRecursion:
+                        path = get_involved_rules(stack, name)
+                        memo.res.involved |= set(path)
+                        run.expect(index, path)
+                        return FAIL, index
+                    else:
+                        return memo.res, memo.idx
+                else:
+                    choices = run.choices
+                    if choices is not None:
+                        choices.append([index, rule, False])
+                    lr = LeftRecursion()
+                    memo = MemoEntry(lr, index)
+                    table[index] = memo
+                    run.memo_entries += 1
+                    res, idx = body(run, index, (name, stack), involved)
+                    is_err = type(res) is Error
+                    if action is not None and not is_err:
+                        res = action(res)
+                    memo.res = res
+                    memo.idx = idx
+                    if lr.involved and not is_err:
+                        res, idx = grow(run, index, stack, lr.involved, memo)
+                    if choices is not None:
+                        choices.pop()
+                    return res, idx
+        else:
+            def match_rule(run, index, stack, involved):
+                table = run.memotable[rule_id]
+                memo = table[index]
+                if memo:
+                    return memo.res, memo.idx
+                res, idx = body(run, index, stack, involved)
+                if action is not None and type(res) is not Error:
+                    res = action(res)
+                table[index] = MemoEntry(res, idx)
+                run.memo_entries += 1
+                return res, idx
+
+        self.rules[name] = match_rule
+        body = self.compile_body(rule)
+        return match_rule
+
+    def compile_body(self, rule: Rule) -> Match:
+        return rule.node.visit(self)
+
+    def visit_seq(self, seq: Seq) -> Match:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            res = []
+            for match in matchers:
+                val, index = match(run, index, stack, involved)
+                if type(val) is Error:
+                    return val, index
+                res.append(val)
+            return res, index
+
+        return match_seq
+
+    def dispatcher(self, alt: Alt, matchers: List[Any]) \
+            -> Optional[Callable[[ParserRun, int], Tuple[Any, ...]]]:
+        """
+        A function giving the steps of the Branches of `alt` for an index,
+        like ParserRun.branches, with matchers in place of nodes.
+        """
+        if alt.dispatch is None:
+            return None
+        position = {id(node): i for i, node in enumerate(alt.nodes)}
+
+        def compile_branches(branches):
+            steps = tuple(step if type(step) is tuple
+                          else matchers[position[id(step)]]
+                          for step in branches.steps)
+            return steps, branches.skipped
+
+        table = {char: compile_branches(branches)
+                 for char, branches in alt.dispatch.items()}
+        default = compile_branches(alt.default)
+        return self.dispatch_on_character(alt.id, table, default)
+
+    def dispatch_on_character(self, alt_id: int, table: Dict[str, Any],
+                              default: Any) -> Callable[[ParserRun, int], Any]:
+        ignore_ws = self.ignore_ws
+
+        def dispatch(run, index):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            steps, skipped = table.get(run.input[index:index + 1], default)
+            if skipped:
+                run.skipped[alt_id] += skipped
+            return steps
+
+        return dispatch
+
+    def literals_matcher(self, alt: Alt) -> Match:
+        literals = alt.literals
+
+        def match_literals(run, index, stack, involved):
+            return run.match_literals(literals, index)
+
+        return match_literals
+
+    def visit_alt(self, alt: Alt) -> Match:
+        if alt.literals is not None:
+            return self.literals_matcher(alt)
+        matchers = [node.visit(self) for node in alt.nodes]
+        dispatch = self.dispatcher(alt, matchers)
+
+        if self.cuts:
+            def match_alt(run, index, stack, involved):
+                choices = run.choices
+                choice = [index, alt, False]
+                choices.append(choice)
+                branches = matchers
+                if dispatch is not None:
+                    branches = dispatch(run, index)
+                for match in branches:
+                    if type(match) is tuple:
+                        run.expect_skipped(index, match)
+                        continue
+                    res, idx = match(run, index, stack, involved)
+                    if type(res) is not Error:
+                        choices.pop()
+                        return res, idx
+                    if choice[2]:
+                        break
+                choices.pop()
+                return FAIL, index
+        elif dispatch is not None:
+            def match_alt(run, index, stack, involved):
+                for match in dispatch(run, index):
+                    if type(match) is tuple:
+                        run.expect_skipped(index, match)
+                        continue
+                    res, idx = match(run, index, stack, involved)
+                    if type(res) is not Error:
+                        return res, idx
+                return FAIL, index
+        else:
+            def match_alt(run, index, stack, involved):
+                for match in matchers:
+                    res, idx = match(run, index, stack, involved)
+                    if type(res) is not Error:
+                        return res, idx
+                return FAIL, index
+
+        return match_alt
+
+    def visit_mult(self, mult: Mult) -> Match:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            res = []
+            while True:
+                val, idx = match(run, index, stack, involved)
+                if type(val) is Error:
+                    if len(res) < minimum:
+                        return val, idx
+                    else:
+                        return res, index
+                res.append(val)
+                index = idx
+
+        return match_mult
+
+    def visit_opt(self, opt: Opt) -> Match:
+        match = self.choice_point(opt, opt.node.visit(self))
+
+        def match_opt(run, index, stack, involved):
+            res, idx = match(run, index, stack, involved)
+            if type(res) is Error:
+                return None, index
+            else:
+                return res, idx
+
+        return match_opt
+
+    def visit_look(self, look: Look) -> Match:
+        match = self.choice_point(look, look.node.visit(self))
+
+        def match_look(run, index, stack, involved):
+            res, _ = match(run, index, stack, involved)
+            return res, index
+
+        return match_look
+
+    def visit_nlook(self, nlook: NLook) -> Match:
+        match = self.choice_point(nlook, nlook.node.visit(self))
+
+        def match_nlook(run, index, stack, involved):
+            failure = run.save_failure()
+            res, _ = match(run, index, stack, involved)
+            run.restore_failure(failure)
+            if type(res) is Error:
+                return None, index
+            else:
+                run.expect(index, nlook)
+                return FAIL, index
+
+        return match_nlook
+
+    def visit_str(self, string: Str) -> Match:
+        s = string.string
+        length = len(s)
+
+        if self.ignore_ws:
+            def match_str(run, index, stack, involved):
+                index = run.skip_whitespace(index)
+                if run.input.startswith(s, index):
+                    return s, index + length
+                if index >= run.fail_index:
+                    run.expect(index, string)
+                return FAIL, index
+        else:
+            def match_str(run, index, stack, involved):
+                if run.input.startswith(s, index):
+                    return s, index + length
+                if index >= run.fail_index:
+                    run.expect(index, string)
+                return FAIL, index
+
+        return match_str
+
+    def visit_rgx(self, regex: Rgx) -> Match:
+        pattern = regex.regex
+
+        if self.ignore_ws:
+            def match_rgx(run, index, stack, involved):
+                index = run.skip_whitespace(index)
+                match = pattern.match(run.input, index)
+                if match:
+                    return match.group(), match.end()
+                if index >= run.fail_index:
+                    run.expect(index, regex)
+                return FAIL, index
+        else:
+            def match_rgx(run, index, stack, involved):
+                match = pattern.match(run.input, index)
+                if match:
+                    return match.group(), match.end()
+                if index >= run.fail_index:
+                    run.expect(index, regex)
+                return FAIL, index
+
+        return match_rgx
+
+    def visit_cut(self, cut: Cut) -> Match:
+        alt = cut.alt
+
+        def match_cut(run, index, stack, involved):
+            run.commit(alt, index)
+            return None, index
+
+        return match_cut
+
+    def visit_fused(self, fused: Fused) -> Match:
+        pattern = fused.regex
+        shape = fused.shape
+        match_node = fused.node.visit(self)
+
+        def match_fused(run, index, stack, involved):
+            if run.fusing:
+                match = pattern.match(run.input, index)
+                if match:
+                    return build(shape, match), match.end()
+            return match_node(run, index, stack, involved)
+
+        return match_fused
@@ -0,0 +1,63 @@
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+
+class Deferred:
+    """
+    A rule match whose action has not run yet: the action, and the value
+    the rule's body built, which can hold more Deferreds. Matches that are
+    given up are dropped without their actions running. Once the action
+    has run, `action` is None and `value` its result.
+    """
+    __slots__ = ('action', 'value')
+    action: Optional[Callable]
+    value: Any
+
+    def __init__(self, action: Callable, value: Any):
+        self.action = action
+        self.value = value
+
+    def __repr__(self):
+        return f'Deferred({self.action!r}, {self.value!r})'
+
+
+def defer(actions: Dict[str, Callable]) -> Dict[str, Callable]:
+    """Actions that record their matches as Deferreds instead of running."""
+    return {name: partial(Deferred, action)
+            for name, action in actions.items()}
+
+
+def resolve(value: Any) -> Any:
+    """
+    Run the actions of the Deferreds in `value`, children first and left
+    to right, the order eager actions run in, and put their results in
+    place of them. Lists are updated in place, so lists shared between memo
+    entries stay shared. A Deferred found twice, as under a lookahead and
+    the rule after it, runs its action once.
+    """
+    holder = [value]
+    # Lists being walked, the index of their next item, and the Deferred
+    # whose raw value the list holds, with the list and index it sits at.
+    stack = [[holder, 0, None]]
+    while stack:
+        frame = stack[-1]
+        items, i, owner = frame
+        if i < len(items):
+            frame[1] = i + 1
+            item = items[i]
+            if type(item) is list:
+                stack.append([item, 0, None])
+            elif type(item) is Deferred:
+                if item.action is None:
+                    items[i] = item.value
+                else:
+                    stack.append([[item.value], 0, (item, items, i)])
+            continue
+
+        stack.pop()
+        if owner is not None:
+            deferred, parent, index = owner
+            deferred.value = deferred.action(items[0])
+            deferred.action = None
+            parent[index] = deferred.value
+    return holder[0]
@@ -0,0 +1,276 @@
+import re
+import sys
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, \
+    Cut, Fused
+
+# Atomic groups keep the regex from backtracking into a part that already
+# matched, as PEG never does. The re module has them from Python 3.11.
+HAS_ATOMIC_GROUPS = sys.version_info >= (3, 11)
+
+DEFAULT_FLAGS = re.compile('').flags
+
+# How to build a value from the match of a fused pattern:
+#   (TEXT, group)                  the text of a group
+#   (CONST, value)                 a value that does not depend on the match
+#   (LIST, shapes)                 a list of the values of `shapes`
+#   (CHOICE, ((marker, shape),))   the first shape whose marker group matched
+#   (OPTION, marker, shape)        None unless the marker group matched
+#   (REPEAT, group, regex, shape)
+#                                  the values of `shape` for the successive
+#                                  matches of `regex` over a group's span
+TEXT, CONST, LIST, CHOICE, OPTION, REPEAT = range(6)
+
+
+class NotFusable(Exception):
+    pass
+
+
+def build(shape: Tuple[Any, ...], match) -> Any:
+    kind = shape[0]
+    if kind == TEXT:
+        return match.group(shape[1])
+    if kind == CONST:
+        return shape[1]
+    if kind == LIST:
+        return [build(part, match) for part in shape[1]]
+    if kind == CHOICE:
+        for marker, part in shape[1]:
+            if match.start(marker) >= 0:
+                return build(part, match)
+        raise AssertionError('No alternative of a fused Alt matched')
+    if kind == OPTION:
+        if match.start(shape[1]) < 0:
+            return None
+        return build(shape[2], match)
+    if kind == REPEAT:
+        _, group, regex, part = shape
+        input = match.string
+        index, end = match.span(group)
+        values = []
+        while index < end:
+            item = regex.match(input, index)
+            values.append(build(part, item))
+            index = item.end()
+        return values
+    raise AssertionError(f'Unknown shape {shape!r}')
+
+
+def atomic(pattern: str) -> str:
+    return f'(?>{pattern})'
+
+
+class PatternBuilder:
+    """
+    Writes the regex for a subtree, and with `capture`, the shape of its
+    value. Raises NotFusable for subtrees with cuts, rules that have actions
+    or call themselves, and regexes that have groups or flags of their own.
+    """
+    actions: Dict[str, Callable]
+    whitespace: Optional[str]
+    groups: int
+    active: Set[str]
+
+    def __init__(self, actions: Dict[str, Callable], whitespace: Optional[str],
+                 active: Optional[Set[str]] = None):
+        self.actions = actions
+        self.whitespace = whitespace
+        self.groups = 0
+        self.active = set() if active is None else active
+
+    def group(self) -> int:
+        self.groups += 1
+        return self.groups
+
+    def skip_whitespace(self, pattern: str) -> str:
+        if self.whitespace is None:
+            return pattern
+        return atomic(self.whitespace) + pattern
+
+    def visit_rule(self, rule: Rule, capture: bool):
+        if rule.node is None or rule.left_recursive \
+                or rule.name in self.actions or rule.name in self.active:
+            raise NotFusable(rule.name)
+        self.active.add(rule.name)
+        try:
+            return rule.node.visit(self, capture)
+        finally:
+            self.active.discard(rule.name)
+
+    def visit_seq(self, seq: Seq, capture):
+        parts = [node.visit(self, capture) for node in seq.nodes]
+        pattern = ''.join(part for part, _ in parts)
+        if not capture:
+            return pattern, None
+        return pattern, (LIST, tuple(shape for _, shape in parts))
+
+    def visit_alt(self, alt: Alt, capture):
+        patterns = []
+        shapes = []
+        for node in alt.nodes:
+            pattern, shape = node.visit(self, capture)
+            if capture:
+                marker = self.group()
+                pattern += '()'
+                shapes.append((marker, shape))
+            patterns.append(pattern)
+        if not capture:
+            return atomic('|'.join(patterns)), None
+        return atomic('|'.join(patterns)), (CHOICE, tuple(shapes))
+
+    def visit_mult(self, mult: Mult, capture):
+        if mult.min == 0:
+            symbol = '*'
+        elif mult.min == 1:
+            symbol = '+'
+        else:
+            symbol = '{%d,}' % mult.min
+
+        if not capture:
+            pattern, _ = mult.node.visit(self, False)
+            return atomic(f'(?:{pattern}){symbol}'), None
+        group = self.group()
+        pattern, _ = mult.node.visit(self, False)
+        item = PatternBuilder(self.actions, self.whitespace, self.active)
+        item_pattern, item_shape = mult.node.visit(item, True)
+        pattern = f'({atomic(f"(?:{pattern}){symbol}")})'
+        return pattern, (REPEAT, group, re.compile(item_pattern), item_shape)
+
+    def visit_opt(self, opt: Opt, capture):
+        pattern, shape = opt.node.visit(self, capture)
+        if not capture:
+            return atomic(f'(?:{pattern})?'), None
+        marker = self.group()
+        return atomic(f'(?:{pattern}())?'), (OPTION, marker, shape)
+
+    def visit_look(self, look: Look, capture):
+        pattern, shape = look.node.visit(self, capture)
+        return f'(?={pattern})', shape
+
+    def visit_nlook(self, nlook: NLook, capture):
+        pattern, _ = nlook.node.visit(self, False)
+        return f'(?!{pattern})', (CONST, None) if capture else None
+
+    def visit_str(self, string: Str, capture):
+        pattern = self.skip_whitespace(re.escape(string.string))
+        return pattern, (CONST, string.string) if capture else None
+
+    def visit_rgx(self, regex: Rgx, capture):
+        compiled = regex.regex
+        if compiled.groups or compiled.flags != DEFAULT_FLAGS:
+            raise NotFusable(regex.pattern)
+        if not capture:
+            return self.skip_whitespace(atomic(regex.pattern)), None
+        group = self.group()
+        pattern = self.skip_whitespace(f'({atomic(regex.pattern)})')
+        return pattern, (TEXT, group)
+
+    def visit_cut(self, cut: Cut, capture):
+        raise NotFusable('~')
+
+    def visit_fused(self, fused: Fused, capture):
+        return fused.node.visit(self, capture)
+
+
+class Fuser:
+    """
+    Replaces the largest subtrees of each rule that PatternBuilder can write
+    as a regex with Fused nodes, keeping single terminals and rule calls as
+    they are. `fused` lists the replacements with the rules they are in.
+    """
+    actions: Dict[str, Callable]
+    whitespace: Optional[str]
+    fused: List[Tuple[str, Fused]]
+
+    def __init__(self, actions: Dict[str, Callable],
+                 whitespace: Optional[str]):
+        self.actions = actions
+        self.whitespace = whitespace
+        self.fused = []
+
+    def fuse(self, node: Node, name: str) -> Optional[Fused]:
+        builder = PatternBuilder(self.actions, self.whitespace, {name})
+        try:
+            pattern, shape = node.visit(builder, True)
+            regex = re.compile(pattern)
+        except (NotFusable, re.error, RecursionError):
+            return None
+        fused = Fused(node, pattern, shape, regex)
+        self.fused.append((name, fused))
+        return fused
+
+    def visit_rule(self, rule: Rule, name: str) -> Node:
+        return rule
+
+    def visit_seq(self, seq: Seq, name) -> Node:
+        fused = self.fuse(seq, name)
+        if fused is not None:
+            return fused
+        for i, node in enumerate(seq.nodes):
+            seq.nodes[i] = node.visit(self, name)
+        return seq
+
+    def visit_alt(self, alt: Alt, name) -> Node:
+        fused = self.fuse(alt, name)
+        if fused is not None:
+            return fused
+        for i, node in enumerate(alt.nodes):
+            alt.nodes[i] = node.visit(self, name)
+        return alt
+
+    def visit_mult(self, mult: Mult, name) -> Node:
+        fused = self.fuse(mult, name)
+        if fused is not None:
+            return fused
+        mult.node = mult.node.visit(self, name)
+        return mult
+
+    def visit_opt(self, opt: Opt, name) -> Node:
+        fused = self.fuse(opt, name)
+        if fused is not None:
+            return fused
+        opt.node = opt.node.visit(self, name)
+        return opt
+
+    def visit_look(self, look: Look, name) -> Node:
+        fused = self.fuse(look, name)
+        if fused is not None:
+            return fused
+        look.node = look.node.visit(self, name)
+        return look
+
+    def visit_nlook(self, nlook: NLook, name) -> Node:
+        fused = self.fuse(nlook, name)
+        if fused is not None:
+            return fused
+        nlook.node = nlook.node.visit(self, name)
+        return nlook
+
+    def visit_str(self, string: Str, name) -> Node:
+        return string
+
+    def visit_rgx(self, regex: Rgx, name) -> Node:
+        return regex
+
+    def visit_cut(self, cut: Cut, name) -> Node:
+        return cut
+
+    def visit_fused(self, fused: Fused, name) -> Node:
+        self.fused.append((name, fused))
+        return fused
+
+
+def fuse_rules(rules: Dict[str, Rule], actions: Dict[str, Callable],
+               whitespace: Optional[str]) -> List[Tuple[str, Fused]]:
+    """
+    Fuse the subtrees of linked `rules` that can match as one regex, in
+    place. Terminals skip `whitespace` first, a pattern, if it is given.
+    """
+    fuser = Fuser(actions, whitespace)
+    if not HAS_ATOMIC_GROUPS:
+        return fuser.fused
+    for name, rule in rules.items():
+        if rule.node is not None:
+            rule.node = rule.node.visit(fuser, name)
+    return fuser.fused
@@ -0,0 +1,507 @@
+from typing import Any, Callable, Dict, List, Optional, Pattern, Set, \
+    Tuple
+
+from .analysis import sre_parse
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, \
+    Fused, Literals
+from .fusion import build
+from .parser import Parser, ParserRun, ParsingError, PRes, MemoEntry, \
+    SparseMemo, is_err, is_lr
+
+try:
+    from re import _compiler as sre_compile
+except ImportError:  # Python < 3.11
+    import sre_compile
+
+# The number of earlier versions of the input whose memo entries are kept.
+MAX_LAYERS = 8
+
+# Single characters a regex can match, as opposed to its other items.
+CHARACTER_OPS = (sre_parse.LITERAL, sre_parse.NOT_LITERAL, sre_parse.ANY,
+                 sre_parse.IN)
+REPEAT_OPS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) \
+    + ((sre_parse.POSSESSIVE_REPEAT,)
+       if hasattr(sre_parse, 'POSSESSIVE_REPEAT') else ())
+GROUP_OPS = (sre_parse.SUBPATTERN,) \
+    + ((sre_parse.ATOMIC_GROUP,) if hasattr(sre_parse, 'ATOMIC_GROUP') else ())
+# Anchors that look at the character before where they are tried.
+BEHIND_ATS = (sre_parse.AT_BEGINNING, sre_parse.AT_BEGINNING_LINE,
+              sre_parse.AT_BOUNDARY, sre_parse.AT_NON_BOUNDARY)
+
+# For an input and an index, the index right after the last character a
+# regex match tried there could have looked at.
+Reach = Callable[[str, int], int]
+# The Reach of a regex, and how many characters before where it is tried
+# it can look at.
+RegexReach = Tuple[Reach, int]
+# For an input and the farthest index a match can have got to, how far it
+# can get through some items from any index up to that one, and the index
+# right after the last character they could look at.
+Reader = Callable[[str, int], Tuple[int, int]]
+
+
+class MemoLayer:
+    """
+    The memo table of one version of the input, with how far into the input
+    each entry looked, forward and back, which entries depend on left
+    recursion, and the edit that turned that version into the next.
+    """
+    memotable: List[SparseMemo]
+    reaches: List[Dict[int, int]]
+    backs: List[Dict[int, int]]
+    growing: List[Set[int]]
+    edit: Optional[Tuple[int, int, int]]
+
+    def __init__(self, memotable: List[SparseMemo],
+                 reaches: List[Dict[int, int]], backs: List[Dict[int, int]],
+                 growing: List[Set[int]]):
+        self.memotable = memotable
+        self.reaches = reaches
+        self.backs = backs
+        self.growing = growing
+        self.edit = None
+
+
+class IncrementalRun(ParserRun):
+    """
+    A visitor run that records, for every memo entry, the index right after
+    the last character its rule looked at, and the first one if that is
+    before where the rule started. On a miss, it looks for an entry in the
+    memo layers of earlier versions whose text did not change.
+
+    How far a regex looked is worked out from its pattern, see
+    regex_reach() and regex_behind(). Entries of left-recursive rules, and
+    entries made while a seed was growing, depend on the rules being
+    grown at the time rather than only on the text, so they are never
+    taken from earlier versions.
+    """
+    reaches: List[Dict[int, int]]
+    reach: int
+    # The first index looked at by the entries that looked before their
+    # start, and by the current rule.
+    backs: List[Dict[int, int]]
+    back: int
+    # Indexes of the entries made while a seed was growing, by rule.
+    growing: List[Set[int]]
+    layers: List[MemoLayer]
+    # How far past its match each Fused node can look, by node id.
+    lookaheads: Dict[int, int]
+    # The RegexReach of each regex, by pattern, kept across runs.
+    regex_reaches: Dict[Pattern, RegexReach]
+
+    def __init__(self, parser: Parser, input: str, layers: List[MemoLayer],
+                 regex_reaches: Dict[Pattern, RegexReach]):
+        super().__init__(parser.actions, input, parser.ignore_ws,
+                         len(parser.rules), parser.has_cuts)
+        self.memotable = [SparseMemo() for _ in parser.rules]
+        self.reaches = [{} for _ in parser.rules]
+        self.reach = 0
+        self.backs = [{} for _ in parser.rules]
+        self.back = 0
+        self.growing = [set() for _ in parser.rules]
+        self.layers = layers
+        self.lookaheads = {}
+        self.regex_reaches = regex_reaches
+
+    def layer(self) -> MemoLayer:
+        return MemoLayer(self.memotable, self.reaches, self.backs,
+                         self.growing)
+
+    def recall(self, rule_id: int, index: int) -> Optional[MemoEntry]:
+        pos = index
+        # Entries before an edit must not have looked past `limit`, and
+        # entries after one not before `floor`.
+        limit = None
+        floor = 0
+        for layer in self.layers:
+            start, old_end, new_end = layer.edit
+            delta = new_end - old_end
+            if limit is not None and limit > start:
+                limit = start if limit < new_end else limit - delta
+            if floor > start:
+                floor = old_end if floor < new_end else floor - delta
+            if pos < start:
+                limit = start if limit is None else min(limit, start)
+            elif pos >= new_end:
+                pos -= delta
+                floor = max(floor, old_end)
+            else:
+                return None
+
+            memo = layer.memotable[rule_id][pos]
+            if memo is None or pos in layer.growing[rule_id]:
+                continue
+            reach = layer.reaches[rule_id][pos]
+            back = layer.backs[rule_id].get(pos, pos)
+            if (limit is None or reach <= limit) and back >= floor:
+                shift = index - pos
+                self.reaches[rule_id][index] = reach + shift
+                if back < pos:
+                    self.backs[rule_id][index] = back + shift
+                return MemoEntry(memo.res, memo.idx + shift)
+        return None
+
+    def visit_rule(self, rule: Rule, index: int, stack: List[str],
+                   involved: Set[str]) -> PRes:
+        table = self.memotable[rule.id]
+        made = table[index] is None
+        if made and not rule.left_recursive and not involved:
+            memo = self.recall(rule.id, index)
+            if memo is not None:
+                table[index] = memo
+                self.memo_entries += 1
+                made = False
+
+        outer, outer_back = self.reach, self.back
+        self.reach = self.back = index
+        res = super().visit_rule(rule, index, stack, involved)
+        reaches = self.reaches[rule.id]
+        reach = max(self.reach, reaches.get(index, 0))
+        reaches[index] = reach
+        self.reach = max(outer, reach)
+        backs = self.backs[rule.id]
+        back = min(self.back, backs.get(index, index))
+        if back < index:
+            backs[index] = back
+        self.back = min(outer_back, back)
+        if made and involved:
+            self.growing[rule.id].add(index)
+        return res
+
+    def visit_str(self, string: Str, index: int, *args) -> PRes:
+        res, idx = super().visit_str(string, index, *args)
+        if is_err(res):
+            reach = idx + len(string.string)
+        else:
+            reach = idx
+        if reach > self.reach:
+            self.reach = reach
+        return res, idx
+
+    def regex_reach(self, pattern: Pattern, index: int) -> int:
+        """
+        The Reach of `pattern` at `index`, lowering `back` to the first
+        character the regex can look at before it.
+        """
+        reaches = self.regex_reaches.get(pattern)
+        if reaches is None:
+            reaches = regex_reach(pattern), regex_behind(pattern)
+            self.regex_reaches[pattern] = reaches
+        reach, behind = reaches
+        # Looking back from the start of the input sees that it starts
+        # there, which an edit before it changes.
+        if index - behind < self.back:
+            self.back = index - behind
+        return reach(self.input, index)
+
+    def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
+        if self.ignore_ws:
+            # Skipping whitespace looked at the character it stopped at.
+            index = self.skip_whitespace(index)
+            reach = max(index + 1, self.regex_reach(regex.regex, index))
+        else:
+            reach = self.regex_reach(regex.regex, index)
+        if reach > self.reach:
+            self.reach = reach
+        return super().visit_rgx(regex, index, *args)
+
+    def branches(self, alt: Alt, index: int):
+        # Which alternatives are tried, or only expected, depends on the
+        # next character.
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        if pos + 1 > self.reach:
+            self.reach = pos + 1
+        return super().branches(alt, index)
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        if pos + literals.longest > self.reach:
+            self.reach = pos + literals.longest
+        return super().match_literals(literals, index)
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        match = fused.regex.match(self.input, index)
+        if not match:
+            return fused.node.visit(self, index, *args)
+        # Terminals inside that failed started at most at the end, after
+        # whitespace, and looked as far as the longest of them.
+        lookahead = self.lookaheads.get(id(fused))
+        if lookahead is None:
+            lookahead = max(1, longest_string(fused.node, set()))
+            self.lookaheads[id(fused)] = lookahead
+        end = match.end()
+        if self.ignore_ws:
+            reach = self.skip_whitespace(end) + lookahead
+        else:
+            reach = end + lookahead
+        reach = max(reach, self.regex_reach(fused.regex, index))
+        if reach > self.reach:
+            self.reach = reach
+        return build(fused.shape, match), end
+
+
+def regex_reach(pattern: Pattern) -> Reach:
+    """
+    The Reach of `pattern`. Patterns that can only look a bounded number of
+    characters ahead get that number, plus one for the character a repeat
+    or an anchor stopped at. Others follow how far their items could get
+    through the input, from the characters each one can match.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return lambda input, index: len(input) + 1
+    extent = regex_extent(parsed)
+    if extent is not None:
+        return lambda input, index: index + extent[1] + 1
+    read = sequence_reader(parsed, parsed.state, pattern.flags)
+    return lambda input, index: read(input, index)[1]
+
+
+def regex_behind(pattern: Pattern) -> int:
+    """
+    How many characters before where it is tried `pattern` can look at,
+    through lookbehinds, word boundaries and line anchors, or the whole
+    input if that is not known.
+    """
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return sre_parse.MAXREPEAT
+    return items_behind(parsed)
+
+
+def items_behind(items) -> int:
+    """
+    At most how far before their start `items` look. Items that come after
+    others look back from farther on, so this only counts too many.
+    """
+    behind = 0
+    for op, av in items:
+        if op is sre_parse.AT:
+            if av in BEHIND_ATS:
+                behind = max(behind, 1)
+        elif op in GROUP_OPS:
+            behind = max(behind, items_behind(
+                av if op is not sre_parse.SUBPATTERN else av[-1]))
+        elif op is sre_parse.BRANCH or op is sre_parse.GROUPREF_EXISTS:
+            branches = av[1] if op is sre_parse.BRANCH else av[1:]
+            behind = max([behind] + [items_behind(branch)
+                                     for branch in branches
+                                     if branch is not None])
+        elif op in REPEAT_OPS:
+            behind = max(behind, items_behind(av[2]))
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            direction, item = av
+            look = items_behind(item)
+            if direction != 1:
+                look += item.getwidth()[1]
+            behind = max(behind, look)
+    return behind
+
+
+def regex_extent(items) -> Optional[Tuple[int, int]]:
+    """
+    The most characters `items` can match, and the most they can look at,
+    from where they start, or None if either has no bound.
+    """
+    width = look = 0
+    for op, av in items:
+        if op in CHARACTER_OPS:
+            width += 1
+        elif op in GROUP_OPS:
+            extent = regex_extent(av if op is not sre_parse.SUBPATTERN
+                                  else av[-1])
+            if extent is None:
+                return None
+            look = max(look, width + extent[1])
+            width += extent[0]
+        elif op is sre_parse.BRANCH or op is sre_parse.GROUPREF_EXISTS:
+            branches = av[1] if op is sre_parse.BRANCH else av[1:]
+            extents = [regex_extent(branch) for branch in branches
+                       if branch is not None]
+            if None in extents:
+                return None
+            look = max([look] + [width + extent[1] for extent in extents])
+            width += max([0] + [extent[0] for extent in extents])
+        elif op in REPEAT_OPS:
+            minimum, maximum, item = av
+            if maximum == sre_parse.MAXREPEAT:
+                return None
+            extent = regex_extent(item)
+            if extent is None:
+                return None
+            if maximum:
+                look = max(look, width + (maximum - 1) * extent[0]
+                           + extent[1])
+                width += maximum * extent[0]
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            direction, item = av
+            if direction == 1:
+                extent = regex_extent(item)
+                if extent is None:
+                    return None
+                look = max(look, width + extent[1])
+        elif op is sre_parse.AT:
+            if av is sre_parse.AT_END:
+                # Whether the character there ends the input.
+                look = max(look, width + 1)
+        else:
+            return None
+        look = max(look, width)
+    return width, look
+
+
+def sequence_reader(items, state, flags: int) -> Reader:
+    readers = [item_reader(op, av, state, flags) for op, av in items]
+
+    def read(input, end):
+        reach = end
+        for reader in readers:
+            end, item_reach = reader(input, end)
+            if item_reach > reach:
+                reach = item_reach
+        return end, reach
+
+    return read
+
+
+def item_reader(op, av, state, flags: int) -> Reader:
+    """
+    A Reader for one item of a parsed pattern. Matching it from the
+    farthest index a match can have got to takes it at least as far as
+    from any index before that, so only that index is followed.
+    """
+    if op in CHARACTER_OPS:
+        character = compile_items([(op, av)], state, flags)
+
+        def read(input, end):
+            if character.match(input, end):
+                return end + 1, end + 1
+            return end, end + 1
+
+        return read
+    if op in GROUP_OPS:
+        return sequence_reader(av if op is not sre_parse.SUBPATTERN
+                               else av[-1], state, flags)
+    if op is sre_parse.BRANCH or op is sre_parse.GROUPREF_EXISTS:
+        branches = av[1] if op is sre_parse.BRANCH else av[1:]
+        readers = [sequence_reader(branch, state, flags)
+                   for branch in branches if branch is not None]
+
+        def read(input, end):
+            ends, reaches = zip(*(reader(input, end) for reader in readers))
+            return max(ends + (end,)), max(reaches)
+
+        return read
+    if op in REPEAT_OPS:
+        minimum, maximum, item = av
+        if len(item) == 1 and item[0][0] in CHARACTER_OPS:
+            # The longest run of the character from the farthest index.
+            run = compile_items(
+                [(sre_parse.MAX_REPEAT, (0, maximum, item))], state, flags)
+
+            def read(input, end):
+                end = run.match(input, end).end()
+                return end, end + 1
+
+            return read
+        item_read = sequence_reader(item, state, flags)
+
+        def read(input, end):
+            reach = end + 1
+            count = 0
+            while count != maximum:
+                item_end, item_reach = item_read(input, end)
+                if item_reach > reach:
+                    reach = item_reach
+                if item_end <= end:
+                    break
+                end = item_end
+                count += 1
+            return end, reach
+
+        return read
+    if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+        direction, item = av
+        if direction != 1:
+            return lambda input, end: (end, end)
+        item_read = sequence_reader(item, state, flags)
+        return lambda input, end: (end, item_read(input, end)[1])
+    if op is sre_parse.AT:
+        # $ also matches before a newline that ends the input.
+        look = 2 if av is sre_parse.AT_END else 1
+        return lambda input, end: (end, end + look)
+    # Backreferences can match any text a group did.
+    return lambda input, end: (len(input), len(input) + 1)
+
+
+def compile_items(items, state, flags: int) -> Pattern:
+    """A regex of some items of a parsed pattern, on their own."""
+    return sre_compile.compile(sre_parse.SubPattern(state, items), flags)
+
+
+def longest_string(node: Node, seen: Set[str]) -> int:
+    """The length of the longest Str that `node` can try."""
+    if type(node) is Str:
+        return len(node.string)
+    if type(node) is Rule:
+        if node.name in seen or node.node is None:
+            return 0
+        seen.add(node.name)
+        return longest_string(node.node, seen)
+    if type(node) in (Seq, Alt):
+        children = node.nodes
+    elif type(node) in (Mult, Opt, Look, NLook, Fused):
+        children = [node.node]
+    else:
+        children = []
+    return max((longest_string(child, seen) for child in children),
+               default=0)
+
+
+class IncrementalParse:
+    """
+    The result of parsing a text that is edited in place. After an edit,
+    rules are only re-run where their memo entries looked at changed text;
+    everything else is taken from the memo tables of earlier versions.
+    """
+    parser: Parser
+    text: str
+    result: Any
+    layers: List[MemoLayer]
+    regex_reaches: Dict[Pattern, RegexReach]
+
+    def __init__(self, parser: Parser, text: str):
+        self.parser = parser
+        self.text = text
+        self.result = None
+        self.layers = []
+        self.regex_reaches = {}
+        self.reparse()
+
+    def edit(self, start: int, end: int, new_text: str) -> Any:
+        """Replace text[start:end] with `new_text` and parse again."""
+        assert 0 <= start <= end <= len(self.text), 'Edit out of range'
+        self.text = self.text[:start] + new_text + self.text[end:]
+        if self.layers:
+            self.layers[0].edit = start, end, start + len(new_text)
+        return self.reparse()
+
+    def reparse(self) -> Any:
+        run = IncrementalRun(self.parser, self.text, self.layers,
+                             self.regex_reaches)
+        try:
+            node = self.parser.grammar
+            res, end_index = node.visit(run, 0, [], set())
+            self.result = run.finish(res, end_index)
+            return self.result
+        except ParsingError:
+            if not self.layers:
+                raise
+            # Failures taken from earlier versions do not record what they
+            # expected again, so the error comes from a full parse.
+            self.parser.parse(self.text)
+            raise
+        finally:
+            self.layers = [run.layer()] + self.layers[:MAX_LAYERS - 1]
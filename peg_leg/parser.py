@@ -1,27 +1,130 @@
+import codecs
+import os
 import re
-from collections import defaultdict
-from typing import Callable, Dict, Optional, Tuple, Any, List, Set
+import sys
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from itertools import repeat
+from mmap import mmap, ACCESS_READ
+from typing import Callable, Dict, Optional, Tuple, Any, List, Set, Union, \
+    Iterator, Iterable, IO, Pattern, Sequence, AsyncIterator
 
 from .ast import GrammarResolver, Node, Rule, Seq, Alt, Mult, Opt, Str, Rgx, \
-    Look, NLook
+    Look, NLook, Cut, Fused, Literals
+from .fusion import build, fuse_rules
+
+
+class LineIndex:
+    """
+    How many line breaks come before each block of LINE_BLOCK_SIZE
+    characters of an input, for locating positions in it. Blocks are only
+    counted as far as the positions asked about, and each is counted once,
+    so all the errors reported for an input share one pass over it. A
+    position is then located from its block's count, the line breaks
+    between the block's start and the position, and the nearest line
+    breaks around it.
+    """
+    input: 'Input'
+    # Line breaks before the start of each block counted so far, and
+    # before the end of the last one.
+    counts: array
+    newline: Union[str, bytes]
+
+    def __init__(self, input: 'Input'):
+        self.input = input
+        self.counts = array('q', [0])
+        self.newline = '\n' if isinstance(input, str) else b'\n'
+
+    def text(self, start: int, end: int) -> Union[str, bytes]:
+        part = self.input[start:end]
+        return bytes(part) if type(part) is memoryview else part
+
+    def count_lines(self, index: int) -> int:
+        """The number of line breaks before `index`."""
+        block = index // LINE_BLOCK_SIZE
+        while len(self.counts) <= block:
+            start = (len(self.counts) - 1) * LINE_BLOCK_SIZE
+            count = self.text(start, start + LINE_BLOCK_SIZE).count(
+                self.newline)
+            self.counts.append(self.counts[-1] + count)
+        start = block * LINE_BLOCK_SIZE
+        return self.counts[block] + self.text(start, index).count(
+            self.newline)
+
+    def line_start(self, index: int) -> int:
+        size = LINE_SEARCH_SIZE
+        end = index
+        while end > 0:
+            start = max(end - size, 0)
+            newline = self.text(start, end).rfind(self.newline)
+            if newline != -1:
+                return start + newline + 1
+            end = start
+            size *= 2
+        return 0
+
+    def line_end(self, index: int) -> int:
+        size = LINE_SEARCH_SIZE
+        start = index
+        while start < len(self.input):
+            newline = self.text(start, start + size).find(self.newline)
+            if newline != -1:
+                return start + newline
+            start += size
+            size *= 2
+        return len(self.input)
+
+    def locate(self, index: int) -> Tuple[Optional[Tuple[int, int]], str]:
+        """
+        The line number and column of `index`, or None past the end of
+        the input, and the text of its line, or the last line, with a line
+        break.
+        """
+        located = min(index, len(self.input))
+        start = self.line_start(located)
+        line = self.text(start, self.line_end(located))
+        if isinstance(line, str):
+            pos = located - start
+        else:
+            # Buffers hold UTF-8, and columns count characters.
+            pos = len(line[:located - start].decode('utf-8', 'replace'))
+            line = line.decode('utf-8', 'replace')
+        if index > len(self.input):
+            return None, line + '\n'
+        return (self.count_lines(located) + 1, pos), line + '\n'
 
 
 class ParsingError(Exception):
-    def __init__(self, msg: str, index: int, input: str):
-        lines = [line + "\n" for line in input.split('\n')]
-        curr_len = 0
-        for line_no, line in enumerate(lines):
-            if curr_len + len(line) > index:
-                pos = index - curr_len
-                self.args = msg, (line_no + 1, pos), line
-                return
-            else:
-                curr_len += len(line)
-        self.args = msg, None, lines[-1]
-        return
+    # Where the error is in the input it was raised on.
+    index: int
+
+    def __init__(self, msg: str, index: int, input: 'Input',
+                 lines: Optional[LineIndex] = None):
+        """
+        An error at `index` of `input`, located with `lines`, which can be
+        shared by the errors of one input, or else an index of its own.
+        """
+        if lines is None:
+            lines = LineIndex(input)
+        loc, line = lines.locate(index)
+        self.args = msg, loc, line
+        self.index = index
+
+    def relocate(self, index: int, lines: LineIndex):
+        """Locate the error at `index` of the input of `lines` instead."""
+        loc, line = lines.locate(index)
+        self.args = self.args[0], loc, line
+        self.index = index
 
     def __str__(self):
         msg, loc, line = self.args
+        if line is None:
+            # The text of the line is not known.
+            if loc:
+                line_no, pos = loc
+                return f'{msg} at line {line_no}, pos {pos}'
+            return f'{msg} at end of input'
         if line[-1] != '\n':
             line += '\n'
         if loc:
@@ -36,35 +139,129 @@ class ParsingError(Exception):
         msg, loc, line = self.args
         self.args = f'{new_msg}\n{msg}', loc, line
 
+    def shift(self, lines: int, columns: int):
+        """
+        Move the location past text that came before the input the error
+        was raised on: `lines` whole lines, then `columns` characters.
+        Those characters start the first line, so if the error may be on
+        it, the line it quotes is left out.
+        """
+        msg, loc, line = self.args
+        if loc:
+            line_no, pos = loc
+            if line_no == 1:
+                pos += columns
+                if columns:
+                    line = None
+            self.args = msg, (line_no + lines, pos), line
+        elif columns:
+            self.args = msg, loc, None
+
+    def __reduce__(self):
+        # __init__ takes the index and input, not the args it works out.
+        return type(self).__new__, (type(self),), \
+            {'args': self.args, 'index': self.index}
+
+
+@dataclass
+class MemoUsage:
+    """Size of the memo table left behind by a parse."""
+    entries: int
+    bytes: int
+    dense: bool
+
 
 class Parser:
     grammar: Optional[Node]
     rules: Dict[str, Rule]
     actions: Dict[str, Callable]
     ignore_ws: bool
+    # Cleared by add_rule(); parsing links the rules again first.
+    linked: bool
+    compiler: Optional['Compiler']
+    analysis: Optional['GrammarAnalysis']
+    memo_usage: Optional[MemoUsage]
+    # Alternatives that dispatch skipped in the last parse, by rule and Alt.
+    pruned_branches: Dict[str, int]
+    # Subtrees that fuse() turned into regexes, with their rules.
+    fused: List[Tuple[str, Fused]]
+    # Set by tokenize() to match over tokens instead of characters.
+    tokenizer: Optional['Tokenizer']
+    # Set by defer_actions() to run actions once the parse is done.
+    deferred: bool
+    # The terminals as bytes, and the compiler for bytes with the compiler
+    # it was made for, once a buffer has been parsed.
+    byte_patterns: Optional['BytePatterns']
+    byte_compiler: Optional[Tuple['Compiler', 'Compiler']]
 
     def __init__(self, ignore_ws: bool = False):
         self.grammar = None
         self.rules = {}
         self.actions = {}
         self.ignore_ws = ignore_ws
+        self.linked = False
+        self.compiler = None
+        self.analysis = None
+        self.memo_usage = None
+        self.pruned_branches = {}
+        self.fused = []
+        self.tokenizer = None
+        self.deferred = False
+        self.byte_patterns = None
+        self.byte_compiler = None
+
+    def __getstate__(self):
+        from .cache import dump_rules
+
+        # Closures do not pickle; a compiled parser compiles again instead.
+        state = self.__dict__.copy()
+        if self.compiler is not None:
+            state['compiler'] = self.compiler.stackless
+        state['byte_patterns'] = None
+        state['byte_compiler'] = None
+        # Pickling linked rules directly recurses as deep as they go.
+        return dump_rules(state.pop('rules'), state)
+
+    def __setstate__(self, data: bytes):
+        from .cache import load_rules
+
+        rules, state = load_rules(data)
+        state['rules'] = rules
+        stackless = state.pop('compiler')
+        self.__dict__.update(state)
+        self.compiler = None
+        if stackless is not None:
+            self.compile(stackless)
 
     @staticmethod
     def from_grammar(grammar: str, *args, **kwargs):
+        """
+        Parse and link the rules of `grammar`. Linked grammars are cached by
+        their text, in memory and in the directory set with
+        `cache.set_cache_dir` or the PEG_LEG_CACHE_DIR variable.
+        """
+        from . import cache
         from .peg import peg_parser
 
-        rules = peg_parser.parse_rule("grammar", grammar)
-
         parser = Parser(*args, **kwargs)
+        if cache.cached_grammar(parser, grammar):
+            return parser
+
+        rules = peg_parser.parse_rule("grammar", grammar)
         parser.grammar = rules[0]
         parser.rules = {rule.name: rule for rule in rules}
         parser.link_rules()
+        cache.cache_grammar(parser, grammar)
         return parser
 
     def add_rule(self, pattern: str, action: Optional[Callable] = None):
+        from . import cache
         from .peg import peg_parser
 
-        rule = peg_parser.parse_rule('rule', pattern)
+        rule = cache.cached_rule(pattern)
+        if rule is None:
+            rule = peg_parser.parse_rule('rule', pattern)
+            cache.cache_rule(pattern, rule)
         if self.grammar is None:
             self.grammar = rule
 
@@ -72,6 +269,8 @@ class Parser:
         self.rules[name] = rule
         if action:
             self.actions[name] = action
+        self.linked = False
+        self.compiler = None
 
     def register_action(self, pattern: str):
         def wrap(action: Callable):
@@ -81,45 +280,571 @@ class Parser:
         return wrap
 
     def link_rules(self):
+        from .analysis import GrammarAnalysis
+
         resolver = GrammarResolver()
-        for rule in self.rules.values():
+        for rule_id, rule in enumerate(self.rules.values()):
+            rule.id = rule_id
             rule.node = rule.node.visit(resolver, self.rules)
 
-    def parse(self, input: str) -> Any:
+        self.analysis = GrammarAnalysis(self.rules)
+        for name, rule in self.rules.items():
+            rule.left_recursive = name in self.analysis.left_recursive
+        self.linked = True
+        self.compiler = None
+
+    def link_if_needed(self):
+        if not self.linked:
+            self.link_rules()
+
+    def fuse(self) -> 'Parser':
+        """
+        Turn the subtrees of the linked grammar that only match terminals
+        into single regexes, so they run in the re module instead of node by
+        node. Rules with actions, rules that call themselves and cuts stop a
+        subtree from being fused; regexes with groups or flags of their own
+        are left as they are. The parts are made atomic, so a fused subtree
+        matches what it did before and builds the same value. `fused` lists
+        what was fused. Needs Python 3.11; before that, nothing is fused.
+
+        Fused subtrees that match do not record what they expected, so an
+        input that does not parse is parsed again without them to report
+        the same error. Like relinking, this drops back to the visitor until
+        compile() is called again.
+        """
+        self.link_if_needed()
+        whitespace = WHITESPACE.pattern if self.ignore_ws else None
+        self.fused = fuse_rules(self.rules, self.actions, whitespace)
+        self.link_rules()
+        return self
+
+    def tokenize(self, tokens: Optional[Iterable[str]] = None,
+                 skip: Optional[str] = r'\s*') -> 'Parser':
+        """
+        Match over tokens instead of characters. The input is cut into
+        tokens once, with a single regex made of the token rules, which are
+        `tokens` or else the rules whose names are upper case, then the
+        string literals of the other rules, longest first. Whatever `skip`
+        matches between tokens is dropped, in place of ignore_ws.
+
+        A token rule then matches one token of its kind, and a string
+        literal or a regex in the other rules the whole text of one token,
+        so the tokenizer has to cut the input where the grammar expects
+        tokens to end. Token rules must match something, and must not
+        have cuts or call themselves; rules they call are inlined without
+        their actions. Needs Python 3.11.
+
+        parse_iter(), parse_incremental() and generate_source() match
+        characters and cannot be used after this. Like relinking, this
+        drops back to the visitor until compile() is called again.
+        """
+        from .tokens import Tokenizer
+
+        self.link_if_needed()
+        if tokens is None:
+            tokens = [name for name in self.rules if name.isupper()]
+        nullable = self.analysis.nullable if self.analysis else ()
+        self.tokenizer = Tokenizer(self.rules, tokens, skip, nullable)
+        self.compiler = None
+        return self
+
+    def defer_actions(self, deferred: bool = True) -> 'Parser':
+        """
+        Run actions after the parse rather than as rules match. While
+        matching, a rule with an action only records the value its body
+        built; once the input has parsed, the actions run over the matches
+        the result is made of, children first, so the actions of matches
+        that were given up and of the seeds that left recursion grew from
+        never run. The result is the same as with actions run as rules
+        match, as long as actions only look at their arguments.
+
+        parse(), parse_rule(), parse_iter() and the pools defer actions;
+        incremental sessions and profile() run them as rules match. Like
+        relinking, this drops back to the visitor until compile() is called
+        again.
+        """
+        self.deferred = deferred
+        self.compiler = None
+        return self
+
+    def run_actions(self) -> Dict[str, Callable]:
+        """The actions given to runs and compilers, to call as rules match."""
+        if not self.deferred:
+            return self.actions
+        from .deferred import defer
+        return defer(self.actions)
+
+    def resolve(self, res: Any) -> Any:
+        """`res` with the actions defer_actions() put off applied."""
+        if not self.deferred:
+            return res
+        from .deferred import resolve
+        return resolve(res)
+
+    def check_characters(self, feature: str):
+        if self.tokenizer is not None:
+            raise ValueError(f'{feature} does not work over tokens')
+
+    @property
+    def has_cuts(self) -> bool:
+        return self.analysis is not None and self.analysis.cuts
+
+    def compile(self, stackless: bool = False) -> 'Parser':
+        """
+        Switch this parser to closure-compiled matching, linking the rules
+        first if they are not. Relinking or adding rules drops back to the
+        visitor-based matching until compile() is called again.
+
+        With `stackless`, matching keeps its frames on a list rather than
+        the Python stack, so the depth of nesting in the input is not
+        limited by the recursion limit, at some cost in speed.
+        """
+        from .compiler import Compiler
+        from .stackless import StacklessCompiler
+        from .tokens import TokenCompiler, TokenStacklessCompiler
+
+        self.link_if_needed()
+        if self.tokenizer is not None:
+            compiler_type = TokenStacklessCompiler if stackless \
+                else TokenCompiler
+            compiler = compiler_type(self.run_actions(), self.tokenizer,
+                                     self.has_cuts)
+        else:
+            compiler_type = StacklessCompiler if stackless else Compiler
+            compiler = compiler_type(self.run_actions(), self.ignore_ws,
+                                     self.has_cuts)
+        for rule in self.rules.values():
+            compiler.compile(rule)
+        self.compiler = compiler
+        return self
+
+    def generate_source(self) -> str:
+        """
+        Source of a standalone module that parses this (linked) grammar
+        without the visitor. Actions are not part of the output; register
+        them on the generated module with its `action` decorator.
+        """
+        from .codegen import CodeGenerator
+
+        self.check_characters('generate_source()')
+        self.link_if_needed()
+        generator = CodeGenerator(self.rules, self.ignore_ws, self.has_cuts)
+        return generator.generate(self.grammar)
+
+    def write_source(self, path: str):
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write(self.generate_source())
+
+    def parse(self, input: 'Input') -> Any:
+        """
+        Parse `input` from the start rule. `input` can be a str, or bytes,
+        a bytearray, a memoryview or an mmap holding UTF-8 text. Buffers
+        are matched as they are, without decoding them: string literals
+        match their encoded bytes, regexes are compiled again for bytes,
+        and terminals give bytes. Regexes then match byte by byte, so they
+        must be ASCII, and `.` or a class like `[^,]` matches a single byte
+        of a character that takes more. An error in a buffer is located
+        in the decoded text.
+        """
         return self.parse_node(self.grammar, input)
 
-    def parse_rule(self, name: str, input: str) -> Any:
+    def parse_rule(self, name: str, input: 'Input') -> Any:
         return self.parse_node(self.rules[name], input)
 
-    def parse_node(self, node: Node, input: str) -> Any:
-        run = ParserRun(self.actions, input, self.ignore_ws)
-        res, end_index = node.visit(run, 0, [], set())
-        if is_err(res):
-            raise ParsingError(res.msg, end_index, input)
-        if self.ignore_ws:
-            end_index = run.skip_whitespace(end_index)
-        if len(input) == end_index:
-            return res
-        raise ParsingError('Expected end of input', end_index, input)
+    def parse_file(self, path: Union[str, os.PathLike],
+                   encoding: Optional[str] = None,
+                   rule: Optional[str] = None) -> Any:
+        """
+        Parse the file at `path` from `rule`, or the start rule. Without an
+        `encoding`, the file is mapped into memory and parsed as bytes, as
+        parse() parses buffers, so the system reads it in as matching gets
+        to it. With one, it is read and decoded into a str first.
+        """
+        node = self.grammar if rule is None else self.rules[rule]
+        if encoding is not None:
+            with open(path, encoding=encoding) as fh:
+                return self.parse_node(node, fh.read())
+        with open(path, 'rb') as fh:
+            # Empty files cannot be mapped.
+            if os.fstat(fh.fileno()).st_size == 0:
+                return self.parse_node(node, b'')
+            with mmap(fh.fileno(), 0, access=ACCESS_READ) as data:
+                return self.parse_node(node, data)
+
+    def parse_node(self, node: Node, input: 'Input') -> Any:
+        run = self.new_run(input)
+        res, end_index = self.match_node(run, node, 0)
+        self.memo_usage = run.memo_usage()
+        self.pruned_branches = self.count_pruned_branches(run)
+        try:
+            return self.resolve(run.finish(res, end_index))
+        except ParsingError:
+            if not self.fused or self.tokenizer is not None:
+                raise
+        # Fused subtrees that matched did not record what they expected.
+        run = self.new_run(input, fusing=False)
+        res, end_index = self.match_node(run, node, 0)
+        return self.resolve(run.finish(res, end_index))
+
+    def parse_recovering(self,
+                         input: 'Input',
+                         sync: Union[str, Pattern] = ';',
+                         rule: Optional[str] = None) -> 'Recovery':
+        """
+        Parse `input` as a sequence of `rule` items, or the items of the
+        start rule as with parse_iter(), going on past the items that do
+        not parse. When an item fails, its error is kept and parsing goes
+        on right after the next match of the `sync` regex from where the
+        item failed, like after the `;` that ends a statement.
+
+        Returns a Recovery with the result, made of the items that parsed
+        as parse() would make it, and the errors, in order, located with
+        one LineIndex for the whole input.
+        """
+        from .recovery import recover
+
+        self.check_characters('parse_recovering()')
+        return recover(self, rule, input, sync)
+
+    def parse_tree(self, input: str, rule: Optional[str] = None) -> 'Tree':
+        """
+        Parse `input` from `rule`, or the start rule, into a Tree: flat
+        arrays with the rule and span of each rule match and links to its
+        first child and next sibling. Terminals only appear as the text
+        under their rules' spans, and no actions run. Compiled parsers
+        match with closures compiled for the purpose, stackless if the
+        parser is.
+        """
+        from .tree import parse_tree
+
+        self.check_characters('parse_tree()')
+        self.link_if_needed()
+        node = self.grammar if rule is None else self.rules[rule]
+        return parse_tree(self, node, input)
+
+    def matches(self, input: str, rule: Optional[str] = None) -> bool:
+        """
+        Whether `rule`, or the start rule, matches the whole of `input`.
+        Nothing is built and no actions run: values are all None, and the
+        memo entries of rules that are not left-recursive are only the
+        index they matched up to. Compiled parsers match with closures
+        compiled for the purpose, stackless if the parser is.
+        """
+        return self.match_length(input, rule, True) is not None
+
+    def match_length(self, input: str, rule: Optional[str] = None,
+                     whole: bool = False) -> Optional[int]:
+        """
+        How far from its start `rule`, or the start rule, matches `input`,
+        or None if it does not, matching as matches() does. With `whole`,
+        None as well unless the match reaches the end of the input.
+        """
+        from .recognizer import match_length
+
+        self.check_characters('match_length()')
+        self.link_if_needed()
+        node = self.grammar if rule is None else self.rules[rule]
+        return match_length(self, node, input, whole)
+
+    def profile(self, input: str, rule: Optional[str] = None,
+                memory: bool = False) -> 'Profile':
+        """
+        Parse `input` from `rule`, or the start rule, and report for each
+        rule its calls, memo hits and misses, left recursion growing
+        iterations, failed alternatives and time, with `memory`, also what
+        it allocated, as traced by tracemalloc. The report holds the result
+        or the ParsingError rather than raising it, and prints as a table.
+        Profiling always matches with the visitor.
+        """
+        from .profiling import profile_parse
+
+        self.check_characters('profile()')
+        self.link_if_needed()
+        node = self.grammar if rule is None else self.rules[rule]
+        return profile_parse(self, node, input, memory)
+
+    def parse_iter(self,
+                   source: Union[str, os.PathLike, IO[str]],
+                   rule: Optional[str] = None,
+                   chunk_size: int = 1 << 16) -> Iterator[Any]:
+        """
+        Parse `source`, a path or a text file, as a sequence of `rule` items
+        and yield the result of each item as soon as it is complete. Without
+        `rule`, the start rule has to be a repetition like `items <- item*`,
+        and the results of its items are yielded.
+
+        Input is read `chunk_size` characters at a time, and text and memo
+        entries are dropped once the items they belong to are yielded. An
+        item only counts as complete once a chunk of input past it has been
+        read, so terminals should not look further ahead than that.
+        """
+        from .stream import ItemStream
+
+        self.check_characters('parse_iter()')
+        node, minimum = self.item_node(rule)
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, encoding='utf-8') as fh:
+                yield from ItemStream(self, node, minimum, chunk_size, fh)
+        else:
+            yield from ItemStream(self, node, minimum, chunk_size, source)
+
+    def feeder(self, rule: Optional[str] = None,
+               lookahead: int = 1 << 10) -> 'ItemFeeder':
+        """
+        A push parser for a sequence of `rule` items, or the items of the
+        start rule as with parse_iter(). Its `feed(text)` adds text to the
+        input and returns the results of the items that text completed;
+        `close()` ends the input and returns the rest, or raises the
+        ParsingError if the input does not parse.
+
+        Input that stops partway through an item is kept until more comes,
+        and the text of items that were returned is dropped. An item only
+        counts as complete once `lookahead` characters past it are in,
+        so terminals should not look further ahead than that.
+        """
+        from .stream import ItemFeeder
+
+        self.check_characters('feeder()')
+        node, minimum = self.item_node(rule)
+        return ItemFeeder(self, node, minimum, lookahead)
+
+    async def aparse(self,
+                     reader: Any,
+                     rule: Optional[str] = None,
+                     chunk_size: int = 1 << 16,
+                     lookahead: int = 1 << 10,
+                     encoding: str = 'utf-8') -> AsyncIterator[Any]:
+        """
+        Parse what `reader`, an asyncio.StreamReader or anything else with
+        an awaitable `read(n)`, reads until it reads nothing, as a feeder()
+        would, and yield the result of each item once it is complete.
+        Bytes that are read are decoded with `encoding`.
+        """
+        feeder = self.feeder(rule, lookahead)
+        decoder = codecs.getincrementaldecoder(encoding)()
+        while True:
+            chunk = await reader.read(chunk_size)
+            if not chunk:
+                break
+            if not isinstance(chunk, str):
+                chunk = decoder.decode(chunk)
+            for result in feeder.feed(chunk):
+                yield result
+        for result in feeder.feed(decoder.decode(b'', final=True)):
+            yield result
+        for result in feeder.close():
+            yield result
+
+    def item_node(self, rule: Optional[str]) -> Tuple[Node, int]:
+        """The node items of `rule` match, and how many there must be."""
+        self.link_if_needed()
+        if rule is None:
+            mult = self.start_repetition()
+            return mult.node, mult.min
+        if self.analysis is not None and rule in self.analysis.nullable:
+            raise ValueError(f'Rule {rule} can match the empty string')
+        return self.rules[rule], 0
+
+    def parse_incremental(self, input: str) -> 'IncrementalParse':
+        """
+        Parse `input` and return a session whose `edit(start, end, new_text)`
+        parses the edited text again, reusing the memo entries of the parts
+        that did not change. Sessions always match with the visitor.
+        """
+        from .incremental import IncrementalParse
+
+        self.check_characters('parse_incremental()')
+        self.link_if_needed()
+        return IncrementalParse(self, input)
+
+    def parse_parallel(self,
+                       input: str,
+                       boundary: Union[str, Pattern],
+                       workers: Optional[int] = None,
+                       chunk_size: Optional[int] = None,
+                       start_method: Optional[str] = None) -> Any:
+        """
+        Parse `input` in a pool of `workers` processes. The start rule has
+        to be a repetition of independent items like `items <- item*`.
+        Input is cut into chunks of about `chunk_size` characters, each
+        right after a match of the `boundary` regex. `boundary` must only
+        match where an item ends, as in `;\\n` for statements that end a
+        line.
+
+        The items of the chunks are joined in order before the start rule's
+        action runs. If a chunk does not parse, the error of the first such
+        chunk is raised, located in the whole input. Workers start as they
+        do for imap_parse().
+        """
+        from .pool import parse_parallel
+        return parse_parallel(self, input, boundary, workers, chunk_size,
+                              start_method)
+
+    def parse_many(self,
+                   inputs: Iterable[str],
+                   workers: Optional[int] = None,
+                   chunksize: int = 16,
+                   start_method: Optional[str] = None) -> List[Any]:
+        """The results of imap_parse(), as a list."""
+        return list(self.imap_parse(inputs, workers, chunksize,
+                                    start_method))
+
+    def imap_parse(self,
+                   inputs: Iterable[str],
+                   workers: Optional[int] = None,
+                   chunksize: int = 16,
+                   start_method: Optional[str] = None) -> Iterator[Any]:
+        """
+        Parse independent inputs in a pool of `workers` processes, sending
+        them `chunksize` at a time, and yield the results in order. An input
+        that does not parse yields its ParsingError instead of raising it.
+
+        Each worker gets a copy of this parser when it starts, with
+        `start_method` as for multiprocessing.get_context(), by default the
+        platform's. Where processes are forked, actions can be any callable;
+        elsewhere they and the results have to be picklable.
+        """
+        from .pool import imap_parse
+        return imap_parse(self, inputs, workers, chunksize, start_method)
+
+    def count_pruned_branches(self, run: 'ParserRun') -> Dict[str, int]:
+        if self.analysis is None:
+            return {}
+        return {f'{name}: {alt}': run.skipped[alt.id]
+                for name, alt in self.analysis.alts}
+
+    def start_repetition(self) -> Mult:
+        mult = self.grammar.node
+        if type(mult) is Fused:
+            mult = mult.node
+        if type(mult) is not Mult:
+            raise ValueError(f'Start rule {self.grammar} is not a '
+                             f'repetition of items')
+        return mult
+
+    def new_run(self, input: 'Input', fusing: bool = True) -> 'ParserRun':
+        self.link_if_needed()
+        if not isinstance(input, str):
+            from .buffers import BytesRun, BytePatterns
+            self.check_characters('Parsing bytes')
+            if self.byte_patterns is None:
+                self.byte_patterns = BytePatterns()
+            run = BytesRun(self.run_actions(), input, self.byte_patterns,
+                           self.ignore_ws, len(self.rules), self.has_cuts)
+            run.fusing = fusing
+            return run
+        if self.tokenizer is not None:
+            from .tokens import TokenRun
+            return TokenRun(self.run_actions(), input, self.tokenizer,
+                            len(self.rules), self.has_cuts)
+        run = ParserRun(self.run_actions(), input, self.ignore_ws,
+                        len(self.rules), self.has_cuts)
+        run.fusing = fusing
+        return run
+
+    def match_node(self, run: 'ParserRun', node: Node, index: int) -> 'PRes':
+        if self.compiler is None:
+            return node.visit(run, index, [], set())
+        match = self.compiler_for(run).compile(node)
+        return match(run, index, None, set())
+
+    def compiler_for(self, run: 'ParserRun') -> 'Compiler':
+        if isinstance(run.input, str):
+            return self.compiler
+        if self.byte_compiler is None \
+                or self.byte_compiler[0] is not self.compiler:
+            from .buffers import BytesCompiler, BytesStacklessCompiler
+
+            compiler_type = BytesStacklessCompiler \
+                if self.compiler.stackless else BytesCompiler
+            compiler = compiler_type(self.run_actions(), self.byte_patterns,
+                                     self.ignore_ws, self.has_cuts)
+            for rule in self.rules.values():
+                compiler.compile(rule)
+            self.byte_compiler = self.compiler, compiler
+        return self.byte_compiler[1]
 
 
 PRes = Tuple[Any, int]
 
+# What parse() takes: text, or UTF-8 text in a buffer.
+Input = Union[str, bytes, bytearray, memoryview, mmap]
+
+WHITESPACE = re.compile(r'\s*')
+
+# Line breaks are counted in blocks of this many characters, and looked
+# for around a position first this far, then twice as far each time.
+LINE_BLOCK_SIZE = 1 << 16
+LINE_SEARCH_SIZE = 1 << 8
+
+# Runs needing up to this many memo slots, one per rule and position, get
+# a list with a slot per position for each rule's memo table; others get a
+# dict holding only the positions the rule was tried at, so that grammars
+# of many rules do not allocate slots they never fill.
+DENSE_MEMO_LIMIT = 1 << 15
+
 
 class Error:
-    msg: str
+    """
+    A failed match. Failures are the common case while backtracking, so they
+    carry nothing: what was expected is recorded on the run, and a message is
+    only built from it once the parse as a whole fails.
+    """
+    __slots__ = ()
 
-    def __init__(self, msg):
-        self.msg = msg
 
-    def prepend_msg(self, msg):
-        self.msg = msg + self.msg
+FAIL = Error()
+
+# Recorded when a parse succeeds without consuming all of the input.
+END_OF_INPUT = object()
 
 
 def is_err(x):
     return type(x) == Error
 
 
+def describe_terminal(terminal: Union[Str, Rgx]) -> str:
+    if type(terminal) is Str:
+        return f'`{terminal.string}`'
+    return str(terminal)
+
+
+def describe_failure(expected: List[Any]) -> str:
+    """
+    Message for the expectations recorded at the farthest failure. Left
+    recursion paths are only reported when nothing else was expected there.
+    """
+    terminals = []
+    lines = []
+    recursions = []
+    for item in expected:
+        if type(item) is tuple:
+            terminals.extend(map(describe_terminal, item))
+        elif type(item) in (Str, Rgx):
+            terminals.append(describe_terminal(item))
+        elif type(item) is Rule:
+            terminals.append(item.name)
+        elif item is END_OF_INPUT:
+            terminals.append('end of input')
+        elif type(item) is NLook:
+            lines.append(f'Did not expect {item.node}')
+        elif type(item) is str:
+            lines.append(item)
+        else:
+            recursions.append('->'.join(item))
+
+    terminals = list(dict.fromkeys(terminals))
+    if terminals:
+        last = terminals.pop()
+        if terminals:
+            last = ', '.join(terminals) + ' or ' + last
+        lines.insert(0, f'Expected {last}')
+    if not lines:
+        lines = [f'Infinite left recursion in path {path}'
+                 for path in dict.fromkeys(recursions)]
+    return '\n'.join(dict.fromkeys(lines)) or 'Could not parse input'
+
+
 class LeftRecursion:
     involved: Set[str]
 
@@ -132,6 +857,7 @@ def is_lr(x):
 
 
 class MemoEntry:
+    __slots__ = ('res', 'idx')
     res: Any
     idx: int
 
@@ -146,30 +872,203 @@ class MemoEntry:
         return self.res, self.idx
 
 
+class SparseMemo(dict):
+    """Memo entries of one rule keyed by position, for long inputs."""
+    __slots__ = ()
+
+    def __missing__(self, index: int):
+        return None
+
+
+MemoTable = Union[List[Optional[MemoEntry]], SparseMemo]
+
+# A place parsing can go back to: the index, the node that would go back
+# there, and whether a cut has committed that node.
+Choice = List[Any]
+
+
 class ParserRun:
     actions: Dict[str, Callable]
     input: str
     ignore_ws: bool
 
-    memotable: Dict[Tuple[str, int], MemoEntry]
+    memotable: List[MemoTable]
+    fail_index: int
+    expected: List[Any]
+    # Only tracked when the grammar has cuts.
+    choices: Optional[List[Choice]]
+    pruned: int
+    # Alternatives skipped by dispatch, by Alt id.
+    skipped: Counter
+    # Cleared to match Fused nodes node by node, which records everything
+    # they expected.
+    fusing: bool
+    # Whether the memo tables have a slot per position.
+    dense: bool
+    # Memo entries stored so far, less those pruned.
+    memo_entries: int
+    # Made when the first error is located.
+    lines: Optional[LineIndex]
 
-    def __init__(self, actions, input: str, ignore_ws: bool):
+    def __init__(self, actions, input: str, ignore_ws: bool, rules: int,
+                 cuts: bool = False, positions: Optional[int] = None):
         self.actions = actions
         self.input = input
         self.ignore_ws = ignore_ws
 
-        self.memotable = defaultdict(lambda: None)
+        # Rules are tried at each index of the input and at its end, unless
+        # indexes count something else.
+        if positions is None:
+            positions = len(input) + 1
+        self.dense = rules * positions <= DENSE_MEMO_LIMIT
+        if self.dense:
+            self.memotable = [[None] * positions for _ in range(rules)]
+        else:
+            self.memotable = [SparseMemo() for _ in range(rules)]
+        self.memo_entries = 0
+        self.fail_index = -1
+        self.expected = []
+        self.choices = [] if cuts else None
+        self.pruned = 0
+        self.skipped = Counter()
+        self.fusing = True
+        self.lines = None
 
-    def skip_whitespace(self, index: int) -> int:
-        curr_index = index
-        while True:
-            char = self.input[curr_index:curr_index + 1]
-            if len(char) > 0 and char.isspace():
-                curr_index += 1
+    def memo_usage(self) -> MemoUsage:
+        entries = self.memo_entries
+        size = sys.getsizeof(self.memotable)
+        for table in self.memotable:
+            size += sys.getsizeof(table)
+        size += entries * sys.getsizeof(MemoEntry(None, 0))
+        return MemoUsage(entries, size, self.dense)
+
+    def push_choice(self, index: int, node: Any) -> Optional[Choice]:
+        if self.choices is None:
+            return None
+        choice = [index, node, False]
+        self.choices.append(choice)
+        return choice
+
+    def pop_choice(self, choice: Optional[Choice]):
+        if choice is not None:
+            self.choices.pop()
+
+    def commit(self, alt: Optional[Alt], index: int):
+        """
+        Stop `alt` from trying its other alternatives, then drop the memo
+        entries before the earliest index parsing can still go back to.
+        """
+        choices = self.choices
+        if choices is None:
+            return
+        if alt is not None:
+            for choice in reversed(choices):
+                if choice[1] is alt:
+                    choice[2] = True
+                    break
+        for choice in choices:
+            if not choice[2]:
+                index = choice[0]
+                break
+        if index > self.pruned:
+            self.prune(index)
+
+    def prune(self, index: int):
+        start = self.pruned
+        for table in self.memotable:
+            if type(table) is list:
+                self.memo_entries -= index - start \
+                    - table[start:index].count(None)
+                table[start:index] = repeat(None, index - start)
             else:
-                return curr_index
+                keys = [key for key in table if key < index]
+                self.memo_entries -= len(keys)
+                for key in keys:
+                    del table[key]
+        self.pruned = index
+
+    def branches(self, alt: Alt, index: int) -> Sequence[Any]:
+        """
+        The steps of the Branches of `alt` for the character at `index`:
+        alternatives to try, and tuples of terminals to expect instead of
+        trying the alternatives that cannot match there.
+        """
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        branches = alt.dispatch.get(self.input[pos:pos + 1], alt.default)
+        if branches.skipped:
+            self.skipped[alt.id] += branches.skipped
+        return branches.steps
+
+    def expect_skipped(self, index: int, terminals: Tuple[Any, ...]):
+        if self.ignore_ws:
+            index = self.skip_whitespace(index)
+        if index >= self.fail_index:
+            self.expect(index, terminals)
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        """
+        Match an Alt of string literals from its table, recording the
+        literals that did not match as trying them in turn would.
+        """
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        rank = literals.match(self.input, pos)
+        if rank == -1:
+            if pos >= self.fail_index:
+                self.expect(pos, literals.strings)
+            return FAIL, index
+        if rank and pos >= self.fail_index:
+            self.expect(pos, literals.before[rank])
+        string = literals.strings[rank].string
+        return string, pos + len(string)
+
+    def skip_whitespace(self, index: int) -> int:
+        return WHITESPACE.match(self.input, index).end()
+
+    def expect(self, index: int, expected: Any):
+        """
+        Record a failure at `index` if it is at least as far into the input
+        as the farthest one so far. `expected` is the Str or Rgx that did not
+        match, a tuple of those, a token rule that did not match, an NLook
+        whose node did, END_OF_INPUT, the rule path of an infinite left
+        recursion, or a message of its own.
+        """
+        if index > self.fail_index:
+            self.fail_index = index
+            self.expected = [expected]
+        elif index == self.fail_index:
+            self.expected.append(expected)
+
+    def save_failure(self) -> Tuple[int, List[Any], int]:
+        return self.fail_index, self.expected, len(self.expected)
 
-    def apply_action(self, res, rule):
+    def restore_failure(self, state: Tuple[int, List[Any], int]):
+        """
+        Forget the failures recorded since save_failure(), for nodes whose
+        failure is not an error, like the node of a negative lookahead.
+        """
+        self.fail_index, self.expected, count = state
+        del self.expected[count:]
+
+    def line_index(self) -> LineIndex:
+        if self.lines is None:
+            self.lines = LineIndex(self.input)
+        return self.lines
+
+    def error(self) -> ParsingError:
+        msg = describe_failure(self.expected)
+        return ParsingError(msg, max(self.fail_index, 0), self.input,
+                            self.line_index())
+
+    def finish(self, res: Any, end_index: int) -> Any:
+        if not is_err(res):
+            if self.ignore_ws:
+                end_index = self.skip_whitespace(end_index)
+            if len(self.input) == end_index:
+                return res
+            self.expect(end_index, END_OF_INPUT)
+        raise self.error()
+
+    def apply_action(self, res, rule, start: int, end: int):
         if rule.name in self.actions and not is_err(res) and not is_lr(res):
             res = self.actions[rule.name](res)
         return res
@@ -185,7 +1084,7 @@ class ParserRun:
                 self, beg_idx, stack, involved - {rule.name})
             if is_err(res) or end_idx <= memo.idx:
                 break
-            memo.res = self.apply_action(res, rule)
+            memo.res = self.apply_action(res, rule, beg_idx, end_idx)
             memo.idx = end_idx
         return memo.unwrap()
 
@@ -204,33 +1103,46 @@ class ParserRun:
                    involved: Set[Tuple[str, int]]) -> PRes:
         assert rule.node is not None, f'Rule {rule.name} does not have a body'
 
-        memo = self.memotable[rule.name, index]
+        table = self.memotable[rule.id]
+        memo = table[index]
+        if not rule.left_recursive:
+            if memo:
+                return memo.unwrap()
+            res, idx = rule.node.visit(self, index, stack, involved)
+            res = self.apply_action(res, rule, index, idx)
+            table[index] = MemoEntry(res, idx)
+            self.memo_entries += 1
+            return res, idx
+
         if memo:
             if rule.name in involved:
                 memo.res, memo.idx = rule.node.visit(
                     self, index, stack + [rule.name], involved - {rule.name})
-                memo.res = self.apply_action(memo.res, rule)
+                memo.res = self.apply_action(memo.res, rule, index, memo.idx)
                 return memo.unwrap()
             elif is_lr(memo.res):
                 path = self.get_involved_rules(stack, rule)
-                str_path = "->".join(path)
                 memo.res.involved |= set(path)
-                msg = f'Infinite left recursion in path {str_path}'
-                return Error(msg), index
-            else:
-                return memo.unwrap()
-        else:
-            lr = LeftRecursion()
-            memo = MemoEntry(lr, index)
-            self.memotable[rule.name, index] = memo
-            memo.res, memo.idx = rule.node.visit(
-                self, index, stack + [rule.name], involved)
-            memo.res = self.apply_action(memo.res, rule)
-            if lr.involved and not is_err(memo.res):
-                return self.grow_parse(rule, index, stack, lr.involved, memo)
+                self.expect(index, path)
+                return FAIL, index
             else:
                 return memo.unwrap()
 
+        # Growing the seed goes back to `index`, so its memo entries have
+        # to outlive any cut until then.
+        choice = self.push_choice(index, rule)
+        lr = LeftRecursion()
+        memo = MemoEntry(lr, index)
+        table[index] = memo
+        self.memo_entries += 1
+        memo.res, memo.idx = rule.node.visit(
+            self, index, stack + [rule.name], involved)
+        memo.res = self.apply_action(memo.res, rule, index, memo.idx)
+        if lr.involved and not is_err(memo.res):
+            self.grow_parse(rule, index, stack, lr.involved, memo)
+        self.pop_choice(choice)
+        return memo.unwrap()
+
     def visit_seq(self, seq: Seq, index: int, *args) -> PRes:
         res = []
         curr_index = index
@@ -243,64 +1155,95 @@ class ParserRun:
         return res, curr_index
 
     def visit_alt(self, alt: Alt, index: int, *args) -> PRes:
-        for node in alt.nodes:
-            res, idx = node.visit(self, index, *args)
-            if is_err(res):
+        if alt.literals is not None:
+            return self.match_literals(alt.literals, index)
+        choice = self.push_choice(index, alt)
+        nodes = alt.nodes
+        if alt.dispatch is not None:
+            nodes = self.branches(alt, index)
+        for node in nodes:
+            if type(node) is tuple:
+                self.expect_skipped(index, node)
                 continue
-            else:
+            res, idx = node.visit(self, index, *args)
+            if not is_err(res):
+                self.pop_choice(choice)
                 return res, idx
-        return Error(f'No alternative matched in {alt}'), index
+            if choice is not None and choice[2]:
+                break
+        self.pop_choice(choice)
+        return FAIL, index
 
     def visit_mult(self, mult: Mult, index: int, *args) -> PRes:
         res = []
         curr_index = index
 
         while True:
-            val, curr_index = mult.node.visit(self, curr_index, *args)
+            choice = self.push_choice(curr_index, mult)
+            val, idx = mult.node.visit(self, curr_index, *args)
+            self.pop_choice(choice)
             if is_err(val):
                 if len(res) < mult.min:
-                    msg = f'{mult} matched fewer than {mult.min} time(s):\n'
-                    val.prepend_msg(msg)
-                    return val, curr_index
+                    return val, idx
                 else:
                     return res, curr_index
             else:
                 res.append(val)
+                curr_index = idx
 
     def visit_opt(self, opt: Opt, index: int, *args) -> PRes:
+        choice = self.push_choice(index, opt)
         res, idx = opt.node.visit(self, index, *args)
+        self.pop_choice(choice)
         if is_err(res):
             return None, index
         else:
             return res, idx
 
     def visit_look(self, look: Look, index: int, *args) -> PRes:
+        choice = self.push_choice(index, look)
         res, _ = look.node.visit(self, index, *args)
+        self.pop_choice(choice)
         return res, index
 
     def visit_nlook(self, nlook: NLook, index: int, *args) -> PRes:
+        failure = self.save_failure()
+        choice = self.push_choice(index, nlook)
         res, _ = nlook.node.visit(self, index, *args)
+        self.pop_choice(choice)
+        self.restore_failure(failure)
         if is_err(res):
             return None, index
         else:
-            return Error(f'Did not expect {nlook.node}'), index
+            self.expect(index, nlook)
+            return FAIL, index
+
+    def visit_cut(self, cut: Cut, index: int, *args) -> PRes:
+        self.commit(cut.alt, index)
+        return None, index
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        if self.fusing:
+            match = fused.regex.match(self.input, index)
+            if match:
+                return build(fused.shape, match), match.end()
+        return fused.node.visit(self, index, *args)
 
     def visit_str(self, string: Str, index: int, *args) -> PRes:
         if self.ignore_ws:
             index = self.skip_whitespace(index)
-        str_len = len(string.string)
-        if str_len <= len(self.input[index:]) and \
-                string.string == self.input[index:index + str_len]:
-            return string.string, index + str_len
+        if self.input.startswith(string.string, index):
+            return string.string, index + len(string.string)
         else:
-            return Error(f'Expected `{string.string}`'), index
+            self.expect(index, string)
+            return FAIL, index
 
     def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
         if self.ignore_ws:
             index = self.skip_whitespace(index)
-        match = re.match(regex.pattern, self.input[index:])
+        match = regex.regex.match(self.input, index)
         if match:
-            string = match.group()
-            return string, index + len(string)
+            return match.group(), match.end()
         else:
-            return Error(f'Could not match /{regex.pattern}/'), index
+            self.expect(index, regex)
+            return FAIL, index
@@ -1,6 +1,6 @@
 from typing import Any, Tuple, List
 
-from .ast import Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx
+from .ast import Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, Cut
 from .parser import Parser
 
 rules = [
@@ -37,6 +37,7 @@ rules = [
              Rule("group"),
              Rule("string"),
              Rule("regex"),
+             Rule("cut"),
              Rule("id"))),
     Rule("prefixed",
          Seq(Alt(Str("&"),
@@ -58,23 +59,19 @@ rules = [
     Rule("string",
          Seq(Str('"'),
              Mult(0,
-                  Alt(Rule('escaped-quote'),
-                      Rule('escaped-bslash'),
+                  Alt(Str(r'\"'),
+                      Str(r"\\"),
                       Rgx(r'[^\\"]+'))),
              Str('"'))),
-    Rule("escaped-quote",
-         Str(r'\"')),
-    Rule("escaped-bslash",
-         Str(r"\\")),
     Rule("regex",
          Seq(Str("/"),
              Mult(0,
-                  Alt(Rule('escaped-fslash'),
-                      Rule('escaped-bslash'),
+                  Alt(Str(r"\/"),
+                      Str(r"\\"),
                       Rgx('[^\\\\/]+'))),
              Str("/"))),
-    Rule("escaped-fslash",
-         Str(r"\/")),
+    Rule("cut",
+         Str("~")),
     Rule("id",
          Rgx(r"[\w_-]+")),
     Rule("_",
@@ -136,8 +133,13 @@ def suffixed_action(raw):
         raise AssertionError(f"Unexpected suffix `{symbol}`")
 
 
+# Escape sequences in strings and regexes, and what they stand for. The
+# segments between them never contain a backslash.
+ESCAPES = {r'\"': '"', r'\/': '/', '\\\\': '\\'}
+
+
 def join_segments(raw: Tuple[str, List[str], str]):
-    string = ''.join(raw[1])
+    string = ''.join(ESCAPES.get(segment, segment) for segment in raw[1])
     return string
 
 
@@ -155,10 +157,10 @@ peg_parser.actions = {"grammar": grammar_action,
                       "suffixed": suffixed_action,
                       "group": lambda x: x[2],
                       "string": lambda x: Str(join_segments(x)),
-                      "escaped-quote": lambda x: "\"",
-                      "escaped-bslash": lambda x: "\\",
                       "regex": lambda x: Rgx(join_segments(x)),
-                      "escaped-fslash": lambda x: "/",
+                      "cut": lambda x: Cut(),
                       "id": lambda x: Rule(x)}
 peg_parser.grammar = peg_parser.rules['rule']
 peg_parser.link_rules()
+# The string and regex rules match as one regex each.
+peg_parser.fuse()
@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import re
+from typing import Any, Iterable, Iterator, List, Optional, Pattern, \
+    Tuple, Union
+
+from .ast import Mult
+from .parser import Parser, ParsingError, LineIndex
+
+# Chunks of a single input are no smaller than this, so that splitting
+# does not cost more than it saves.
+MIN_CHUNK_SIZE = 1 << 16
+
+# The parser of a worker process, and the input it parses chunks of, set
+# once when the process starts.
+worker_parser: Optional[Parser] = None
+worker_input: Optional[str] = None
+
+
+def init_worker(parser: Parser, input: Optional[str] = None):
+    global worker_parser, worker_input
+    worker_parser = parser
+    worker_input = input
+
+
+def parse_input(input: str) -> Any:
+    try:
+        return worker_parser.parse(input)
+    except ParsingError as e:
+        return e
+
+
+def parse_chunk(bounds: Tuple[int, int]) -> Any:
+    start, end = bounds
+    mult = worker_parser.start_repetition()
+    # The minimum count applies to the whole input, not to each chunk.
+    node = Mult(0, mult.node)
+    try:
+        return worker_parser.parse_node(node, worker_input[start:end])
+    except ParsingError as e:
+        return e
+
+
+def imap_parse(parser: Parser,
+               inputs: Iterable[str],
+               workers: Optional[int],
+               chunksize: int,
+               start_method: Optional[str]) -> Iterator[Any]:
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(workers, init_worker, (parser,)) as pool:
+        yield from pool.imap(parse_input, inputs, chunksize)
+
+
+def split_points(input: str, boundary: Pattern, chunk_size: int) -> List[int]:
+    """
+    Offsets that cut `input` into chunks of at least `chunk_size`
+    characters, each offset right after a match of `boundary`.
+    """
+    points = [0]
+    offset = chunk_size
+    while offset < len(input):
+        match = boundary.search(input, offset)
+        if match is None or match.end() >= len(input):
+            break
+        points.append(match.end())
+        offset = match.end() + chunk_size
+    points.append(len(input))
+    return points
+
+
+def parse_parallel(parser: Parser,
+                   input: str,
+                   boundary: Union[str, Pattern],
+                   workers: Optional[int],
+                   chunk_size: Optional[int],
+                   start_method: Optional[str]) -> Any:
+    mult = parser.start_repetition()
+    if isinstance(boundary, str):
+        boundary = re.compile(boundary)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(MIN_CHUNK_SIZE, len(input) // (4 * workers))
+
+    points = split_points(input, boundary, chunk_size)
+    context = multiprocessing.get_context(start_method)
+    with context.Pool(workers, init_worker, (parser, input)) as pool:
+        chunks = pool.map(parse_chunk, zip(points, points[1:]), 1)
+
+    items = []
+    for start, res in zip(points, chunks):
+        if isinstance(res, ParsingError):
+            # Errors quote the line from the whole input, which may start
+            # before the chunk.
+            res.relocate(start + res.index, LineIndex(input))
+            raise res
+        items.extend(res)
+    if len(items) < mult.min:
+        # Too few items is reported the same way as a serial parse does.
+        return parser.parse(input)
+
+    action = parser.actions.get(parser.grammar.name)
+    return items if action is None else action(items)
@@ -0,0 +1,197 @@
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Any, Dict, List, Optional
+
+from .ast import Alt, Node, Rule
+from .parser import Parser, ParserRun, ParsingError, PRes, FAIL, MemoEntry, \
+    is_err
+
+# Columns of Profile.table(), with their headers.
+COLUMNS = {
+    'calls': 'calls',
+    'memo_hits': 'hits',
+    'memo_misses': 'misses',
+    'grow_iterations': 'grows',
+    'failed_branches': 'failed alts',
+    'inclusive': 'incl ms',
+    'exclusive': 'excl ms',
+    'allocated': 'alloc KiB',
+}
+
+
+@dataclass
+class RuleProfile:
+    """
+    What one rule cost over a parse. Times are in seconds and allocations
+    in bytes still allocated when the rule returned; inclusive figures
+    count each outermost call once, exclusive ones leave out the rules it
+    called.
+    """
+    calls: int = 0
+    memo_hits: int = 0
+    memo_misses: int = 0
+    grow_iterations: int = 0
+    # Alternatives of the rule's Alts that were tried and failed.
+    failed_branches: int = 0
+    inclusive: float = 0.0
+    exclusive: float = 0.0
+    allocated: int = 0
+    allocated_exclusive: int = 0
+
+
+@dataclass
+class Profile:
+    """The result or error of a profiled parse, and what each rule cost."""
+    result: Any
+    error: Optional[ParsingError]
+    # Seconds for the whole parse.
+    elapsed: float
+    rules: Dict[str, RuleProfile] = field(default_factory=dict)
+    memory: bool = False
+
+    def table(self, sort: str = 'exclusive', limit: Optional[int] = None) \
+            -> str:
+        """
+        The rules that were called as a table, most costly first by `sort`,
+        the name of a RuleProfile field.
+        """
+        columns = [name for name in COLUMNS
+                   if self.memory or name != 'allocated']
+        rows = sorted(((name, stats) for name, stats in self.rules.items()
+                       if stats.calls),
+                      key=lambda row: getattr(row[1], sort), reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+
+        cells = [['rule'] + [COLUMNS[column] for column in columns]]
+        for name, stats in rows:
+            cells.append([name] + [format_cell(column, getattr(stats, column))
+                                   for column in columns])
+        widths = [max(len(row[i]) for row in cells)
+                  for i in range(len(cells[0]))]
+        lines = [' '.join([row[0].ljust(widths[0])] +
+                          [cell.rjust(width)
+                           for cell, width in zip(row[1:], widths[1:])])
+                 for row in cells]
+        lines.append(f'total {self.elapsed * 1000:.3f} ms')
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.table()
+
+
+def format_cell(column: str, value: Any) -> str:
+    if column in ('inclusive', 'exclusive'):
+        return f'{value * 1000:.3f}'
+    if column == 'allocated':
+        return f'{value / 1024:.1f}'
+    return str(value)
+
+
+class ProfilingRun(ParserRun):
+    """
+    A visitor run that counts and times what each rule does. It is only
+    used by Parser.profile(), so plain parses do not pay for it.
+    """
+    stats: Dict[str, RuleProfile]
+    memory: bool
+    # For each rule being matched, innermost last: the time and allocation
+    # of the rules it called, and its RuleProfile.
+    frames: List[List[Any]]
+    active: Counter
+
+    def __init__(self, parser: Parser, input: str, memory: bool = False):
+        super().__init__(parser.actions, input, parser.ignore_ws,
+                         len(parser.rules), parser.has_cuts)
+        self.stats = {name: RuleProfile() for name in parser.rules}
+        self.memory = memory
+        self.frames = [[0.0, 0, None]]
+        self.active = Counter()
+
+    def visit_rule(self, rule: Rule, index: int, stack: List[str],
+                   involved) -> PRes:
+        stats = self.stats[rule.name]
+        stats.calls += 1
+        memo = self.memotable[rule.id][index]
+        if memo and not (rule.left_recursive and rule.name in involved):
+            stats.memo_hits += 1
+        else:
+            stats.memo_misses += 1
+
+        self.active[rule.name] += 1
+        self.frames.append([0.0, 0, stats])
+        allocated = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        start = perf_counter()
+        try:
+            return super().visit_rule(rule, index, stack, involved)
+        finally:
+            elapsed = perf_counter() - start
+            if self.memory:
+                allocated = tracemalloc.get_traced_memory()[0] - allocated
+            child_time, child_allocated, _ = self.frames.pop()
+            self.frames[-1][0] += elapsed
+            self.frames[-1][1] += allocated
+            stats.exclusive += elapsed - child_time
+            stats.allocated_exclusive += allocated - child_allocated
+            self.active[rule.name] -= 1
+            if not self.active[rule.name]:
+                stats.inclusive += elapsed
+                stats.allocated += allocated
+
+    def grow_parse(self, rule: Rule, beg_idx: int, stack: List[str],
+                   involved, memo: MemoEntry):
+        stats = self.stats[rule.name]
+        while True:
+            stats.grow_iterations += 1
+            res, end_idx = rule.node.visit(
+                self, beg_idx, stack, involved - {rule.name})
+            if is_err(res) or end_idx <= memo.idx:
+                break
+            memo.res = self.apply_action(res, rule, beg_idx, end_idx)
+            memo.idx = end_idx
+        return memo.unwrap()
+
+    def visit_alt(self, alt: Alt, index: int, stack: List[str],
+                  involved) -> PRes:
+        if alt.literals is not None:
+            return self.match_literals(alt.literals, index)
+        stats = self.frames[-1][2]
+        choice = self.push_choice(index, alt)
+        nodes = alt.nodes
+        if alt.dispatch is not None:
+            nodes = self.branches(alt, index)
+        for node in nodes:
+            if type(node) is tuple:
+                self.expect_skipped(index, node)
+                continue
+            res, idx = node.visit(self, index, stack, involved)
+            if not is_err(res):
+                self.pop_choice(choice)
+                return res, idx
+            if stats is not None:
+                stats.failed_branches += 1
+            if choice is not None and choice[2]:
+                break
+        self.pop_choice(choice)
+        return FAIL, index
+
+
+def profile_parse(parser: Parser, node: Node, input: str,
+                  memory: bool = False) -> Profile:
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    run = ProfilingRun(parser, input, memory)
+    start = perf_counter()
+    try:
+        res, end_index = node.visit(run, 0, [], set())
+        result, error = run.finish(res, end_index), None
+    except ParsingError as e:
+        result, error = None, e
+    finally:
+        elapsed = perf_counter() - start
+        if started:
+            tracemalloc.stop()
+    return Profile(result, error, elapsed, run.stats, memory)
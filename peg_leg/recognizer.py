@@ -0,0 +1,309 @@
+import sys
+from typing import Callable, Optional
+
+from .ast import Node, Rule, Seq, Mult, Str, Rgx, Fused, Literals
+from .compiler import Compiler, Match
+from .parser import Parser, ParserRun, PRes, MemoUsage, Error, FAIL, is_err
+from .stackless import StacklessCompiler
+
+# The memo entry of a rule that did not match where it was tried. Other
+# entries are the index the rule matched up to.
+FAILED = -1
+
+
+class RecognizerRun(ParserRun):
+    """
+    A visitor run that only tells how far the input matches: every value
+    is None, no actions run, and nothing that was expected is recorded.
+    Rules that are not left-recursive memoize the index they matched up to
+    in place of a MemoEntry.
+    """
+    def __init__(self, parser: Parser, input: str):
+        super().__init__({}, input, parser.ignore_ws, len(parser.rules),
+                         parser.has_cuts)
+
+    def memo_usage(self) -> MemoUsage:
+        entries = self.memo_entries
+        size = sys.getsizeof(self.memotable)
+        for table in self.memotable:
+            size += sys.getsizeof(table)
+        # Each entry is an index into the input.
+        size += entries * sys.getsizeof(len(self.input))
+        return MemoUsage(entries, size, self.dense)
+
+    def expect(self, index: int, expected):
+        pass
+
+    def expect_skipped(self, index: int, terminals):
+        pass
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        pos = self.skip_whitespace(index) if self.ignore_ws else index
+        rank = literals.match(self.input, pos)
+        if rank == -1:
+            return FAIL, index
+        return None, pos + len(literals.strings[rank].string)
+
+    def visit_rule(self, rule: Rule, index: int, *args) -> PRes:
+        if rule.left_recursive:
+            return super().visit_rule(rule, index, *args)
+        table = self.memotable[rule.id]
+        end = table[index]
+        if end is not None:
+            return (FAIL, index) if end == FAILED else (None, end)
+        res, idx = rule.node.visit(self, index, *args)
+        table[index] = FAILED if is_err(res) else idx
+        self.memo_entries += 1
+        return res, idx
+
+    def visit_seq(self, seq: Seq, index: int, *args) -> PRes:
+        for node in seq.nodes:
+            val, index = node.visit(self, index, *args)
+            if is_err(val):
+                return val, index
+        return None, index
+
+    def visit_mult(self, mult: Mult, index: int, *args) -> PRes:
+        count = 0
+        while True:
+            choice = self.push_choice(index, mult)
+            val, idx = mult.node.visit(self, index, *args)
+            self.pop_choice(choice)
+            if is_err(val):
+                if count < mult.min:
+                    return val, idx
+                return None, index
+            count += 1
+            index = idx
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        # The regex matches exactly where the subtree does, and there are
+        # no expectations to record by matching the subtree instead.
+        match = fused.regex.match(self.input, index)
+        if match:
+            return None, match.end()
+        return FAIL, index
+
+    def visit_str(self, string: Str, index: int, *args) -> PRes:
+        if self.ignore_ws:
+            index = self.skip_whitespace(index)
+        if self.input.startswith(string.string, index):
+            return None, index + len(string.string)
+        return FAIL, index
+
+    def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
+        if self.ignore_ws:
+            index = self.skip_whitespace(index)
+        match = regex.regex.match(self.input, index)
+        if match:
+            return None, match.end()
+        return FAIL, index
+
+
+class RecognizerMatching:
+    """
+    Overrides for the compilers that match terminals as a RecognizerRun
+    does, without values or expectations.
+    """
+    ignore_ws: bool
+
+    def literals_matcher(self, alt) -> Match:
+        literals = alt.literals
+        strings = [string.string for string in literals.strings]
+        ignore_ws = self.ignore_ws
+
+        def match_literals(run, index, stack, involved):
+            pos = run.skip_whitespace(index) if ignore_ws else index
+            rank = literals.match(run.input, pos)
+            if rank == -1:
+                return FAIL, index
+            return None, pos + len(strings[rank])
+
+        return match_literals
+
+    def visit_fused(self, fused: Fused) -> Match:
+        pattern = fused.regex
+
+        def match_fused(run, index, stack, involved):
+            match = pattern.match(run.input, index)
+            if match:
+                return None, match.end()
+            return FAIL, index
+
+        return match_fused
+
+    def visit_str(self, string: Str) -> Match:
+        s = string.string
+        length = len(s)
+        ignore_ws = self.ignore_ws
+
+        def match_str(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            if run.input.startswith(s, index):
+                return None, index + length
+            return FAIL, index
+
+        return match_str
+
+    def visit_rgx(self, regex: Rgx) -> Match:
+        pattern = regex.regex
+        ignore_ws = self.ignore_ws
+
+        def match_rgx(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            match = pattern.match(run.input, index)
+            if match:
+                return None, match.end()
+            return FAIL, index
+
+        return match_rgx
+
+
+class RecognizerCompiler(RecognizerMatching, Compiler):
+    """Compiles the matching of a RecognizerRun into closures."""
+    def __init__(self, ignore_ws: bool, cuts: bool = False):
+        super().__init__({}, ignore_ws, cuts)
+
+    def visit_rule(self, rule: Rule) -> Match:
+        name = rule.name
+        if rule.left_recursive or name in self.rules:
+            return super().visit_rule(rule)
+        rule_id = rule.id
+        body = None
+
+        def match_rule(run, index, stack, involved):
+            table = run.memotable[rule_id]
+            end = table[index]
+            if end is not None:
+                if end == FAILED:
+                    return FAIL, index
+                return None, end
+            res, idx = body(run, index, stack, involved)
+            table[index] = FAILED if type(res) is Error else idx
+            run.memo_entries += 1
+            return res, idx
+
+        self.rules[name] = match_rule
+        body = self.compile_body(rule)
+        return match_rule
+
+    def visit_seq(self, seq: Seq) -> Match:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            for match in matchers:
+                val, index = match(run, index, stack, involved)
+                if type(val) is Error:
+                    return val, index
+            return None, index
+
+        return match_seq
+
+    def visit_mult(self, mult: Mult) -> Match:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            count = 0
+            while True:
+                val, idx = match(run, index, stack, involved)
+                if type(val) is Error:
+                    if count < minimum:
+                        return val, idx
+                    return None, index
+                count += 1
+                index = idx
+
+        return match_mult
+
+
+class RecognizerStacklessCompiler(RecognizerMatching, StacklessCompiler):
+    """
+    Compiles the matching of a RecognizerRun into generator functions, as
+    StacklessCompiler does, for parsers compiled stackless.
+    """
+    def __init__(self, ignore_ws: bool, cuts: bool = False):
+        super().__init__({}, ignore_ws, cuts)
+
+    def visit_rule(self, rule: Rule) -> Callable:
+        name = rule.name
+        if rule.left_recursive or name in self.rules:
+            return super().visit_rule(rule)
+        rule_id = rule.id
+        body = None
+
+        def evaluate(run, index, stack, involved, table):
+            res, idx = yield body, index, stack, involved
+            table[index] = FAILED if type(res) is Error else idx
+            run.memo_entries += 1
+            return res, idx
+
+        def match_rule(run, index, stack, involved):
+            table = run.memotable[rule_id]
+            end = table[index]
+            if end is not None:
+                if end == FAILED:
+                    return FAIL, index
+                return None, end
+            return evaluate(run, index, stack, involved, table)
+
+        self.rules[name] = match_rule
+        body = self.compile_body(rule)
+        return match_rule
+
+    def visit_seq(self, seq: Seq) -> Callable:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            for match in matchers:
+                val, index = yield match, index, stack, involved
+                if type(val) is Error:
+                    return val, index
+            return None, index
+
+        return match_seq
+
+    def visit_mult(self, mult: Mult) -> Callable:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            count = 0
+            while True:
+                val, idx = yield match, index, stack, involved
+                if type(val) is Error:
+                    if count < minimum:
+                        return val, idx
+                    return None, index
+                count += 1
+                index = idx
+
+        return match_mult
+
+
+def match_length(parser: Parser, node: Node, input: str,
+                 whole: bool = False) -> Optional[int]:
+    """
+    The index `node` matches `input` up to from its start, or None. With
+    `whole`, None as well unless that is the end of the input.
+    """
+    run = RecognizerRun(parser, input)
+    if parser.compiler is None:
+        res, end_index = node.visit(run, 0, [], set())
+    else:
+        compiler_type = RecognizerStacklessCompiler \
+            if parser.compiler.stackless else RecognizerCompiler
+        compiler = compiler_type(parser.ignore_ws, parser.has_cuts)
+        match = compiler.compile(node)
+        res, end_index = match(run, 0, None, set())
+    parser.memo_usage = run.memo_usage()
+    if is_err(res):
+        return None
+    if whole:
+        if parser.ignore_ws:
+            end_index = run.skip_whitespace(end_index)
+        if end_index != len(input):
+            return None
+    return end_index
@@ -0,0 +1,86 @@
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Pattern, Tuple
+
+from .ast import Node
+from .parser import Parser, ParserRun, ParsingError, Input, is_err
+
+
+@dataclass
+class Recovery:
+    """
+    What parse_recovering() made of an input: the result, built from the
+    items that parsed, and an error for each stretch that did not.
+    """
+    result: Any
+    errors: List[ParsingError] = field(default_factory=list)
+
+
+def reset_failure(run: ParserRun):
+    run.fail_index = -1
+    run.expected = []
+
+
+def parse_recovering(parser: Parser,
+                     node: Node,
+                     minimum: int,
+                     input: Input,
+                     sync: Pattern) -> Tuple[List[Any], List[ParsingError]]:
+    """
+    Match items of `node` one after another. When one fails, record its
+    error and go on right after the next match of `sync` from where the
+    item failed. Returns the items that parsed, and the errors.
+    """
+    run = parser.new_run(input)
+    # Fused subtrees do not record what they expected, so failed items
+    # are matched again without them for their errors.
+    retry: Optional[ParserRun] = None
+
+    items = []
+    errors = []
+    index = 0
+    while True:
+        reset_failure(run)
+        res, end_index = parser.match_node(run, node, index)
+        if not is_err(res) and end_index > index:
+            items.append(parser.resolve(res))
+            index = end_index
+            continue
+
+        rest = run.skip_whitespace(index) if parser.ignore_ws else index
+        if rest == len(input):
+            if len(items) < minimum and not errors:
+                errors.append(run.error())
+            break
+
+        failed = run
+        if parser.fused:
+            if retry is None:
+                retry = parser.new_run(input, fusing=False)
+                retry.lines = run.line_index()
+            reset_failure(retry)
+            parser.match_node(retry, node, index)
+            failed = retry
+        errors.append(failed.error())
+        match = sync.search(input, max(failed.fail_index, index))
+        if match is None:
+            break
+        # A sync match that is empty, or ends where the item started,
+        # would not move past the failure.
+        index = max(match.end(), index + 1)
+    return items, errors
+
+
+def recover(parser: Parser,
+            rule: Optional[str],
+            input: Input,
+            sync: Any) -> Recovery:
+    if isinstance(sync, str):
+        sync = re.compile(sync if isinstance(input, str) else
+                          sync.encode('utf-8'))
+    node, minimum = parser.item_node(rule)
+    items, errors = parse_recovering(parser, node, minimum, input, sync)
+    if rule is not None:
+        return Recovery(items, errors)
+    action = parser.actions.get(parser.grammar.name)
+    return Recovery(items if action is None else action(items), errors)
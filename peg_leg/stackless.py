@@ -0,0 +1,265 @@
+from types import GeneratorType
+from typing import Callable, Generator
+
+from .ast import Node, Rule, Seq, Alt, Mult, Opt, Look, NLook
+from .compiler import Compiler, Match, get_involved_rules
+from .parser import PRes, Error, FAIL, LeftRecursion, MemoEntry, ParserRun
+
+# A frame yields (match, index, stack, involved) for each child it matches,
+# is sent back the child's result and returns its own.
+Frame = Generator[tuple, PRes, PRes]
+
+
+def drive(run: ParserRun, frame: Frame) -> PRes:
+    """
+    Run `frame` and the frames it asks for on a list instead of the Python
+    stack. A match function either returns its result straight away, as
+    terminals and memo hits do, or returns a frame to run.
+    """
+    frames = []
+    res = None
+    while True:
+        try:
+            match, index, stack, involved = frame.send(res)
+        except StopIteration as stop:
+            if not frames:
+                return stop.value
+            frame = frames.pop()
+            res = stop.value
+            continue
+        out = match(run, index, stack, involved)
+        if type(out) is GeneratorType:
+            frames.append(frame)
+            frame = out
+            res = None
+        else:
+            res = out
+
+
+class StacklessCompiler(Compiler):
+    """
+    Turns a linked grammar into closures like Compiler does, except that
+    nodes with children are generator functions. Matching a child is a
+    yield rather than a call, so nesting in the input grows a list of
+    suspended frames instead of the interpreter's stack.
+    """
+    stackless = True
+
+    def compile(self, node: Node) -> Match:
+        match = node.visit(self)
+
+        def match_stackless(run, index, stack, involved):
+            out = match(run, index, stack, involved)
+            if type(out) is GeneratorType:
+                return drive(run, out)
+            return out
+
+        return match_stackless
+
+    def choice_point(self, node: Node, match: Callable) -> Callable:
+        if not self.cuts:
+            return match
+
+        def match_choice(run, index, stack, involved):
+            choices = run.choices
+            choices.append([index, node, False])
+            res = yield match, index, stack, involved
+            choices.pop()
+            return res
+
+        return match_choice
+
+    def visit_rule(self, rule: Rule) -> Callable:
+        name = rule.name
+        rule_id = rule.id
+        if name in self.rules:
+            return self.rules[name]
+        assert rule.node is not None, f'Rule {name} does not have a body'
+
+        action = self.actions.get(name)
+        body = None
+
+        if rule.left_recursive:
+            def reevaluate(run, index, stack, involved, memo):
+                res, idx = yield body, index, (name, stack), involved - {name}
+                if action is not None and type(res) is not Error:
+                    res = action(res)
+                memo.res = res
+                memo.idx = idx
+                return res, idx
+
+            def evaluate(run, index, stack, involved, table):
+                choices = run.choices
+                if choices is not None:
+                    choices.append([index, rule, False])
+                lr = LeftRecursion()
+                memo = MemoEntry(lr, index)
+                table[index] = memo
+                run.memo_entries += 1
+                res, idx = yield body, index, (name, stack), involved
+                is_err = type(res) is Error
+                if action is not None and not is_err:
+                    res = action(res)
+                memo.res = res
+                memo.idx = idx
+                if lr.involved and not is_err:
+                    grown = lr.involved - {name}
+                    while True:
+                        res, end_idx = yield body, index, stack, grown
+                        if type(res) is Error or end_idx <= memo.idx:
+                            break
+                        if action is not None:
+                            res = action(res)
+                        memo.res = res
+                        memo.idx = end_idx
+                    res, idx = memo.res, memo.idx
+                if choices is not None:
+                    choices.pop()
+                return res, idx
+
+            def match_rule(run, index, stack, involved):
+                table = run.memotable[rule_id]
+                memo = table[index]
+                if not memo:
+                    return evaluate(run, index, stack, involved, table)
+                if name in involved:
+                    return reevaluate(run, index, stack, involved, memo)
+                if type(memo.res) is LeftRecursion:
+                    path = get_involved_rules(stack, name)
+                    memo.res.involved |= set(path)
+                    run.expect(index, path)
+                    return FAIL, index
+                return memo.res, memo.idx
+        else:
+            def evaluate(run, index, stack, involved, table):
+                res, idx = yield body, index, stack, involved
+                if action is not None and type(res) is not Error:
+                    res = action(res)
+                table[index] = MemoEntry(res, idx)
+                run.memo_entries += 1
+                return res, idx
+
+            def match_rule(run, index, stack, involved):
+                table = run.memotable[rule_id]
+                memo = table[index]
+                if memo:
+                    return memo.res, memo.idx
+                return evaluate(run, index, stack, involved, table)
+
+        self.rules[name] = match_rule
+        body = self.compile_body(rule)
+        return match_rule
+
+    def visit_seq(self, seq: Seq) -> Callable:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            res = []
+            for match in matchers:
+                val, index = yield match, index, stack, involved
+                if type(val) is Error:
+                    return val, index
+                res.append(val)
+            return res, index
+
+        return match_seq
+
+    def visit_alt(self, alt: Alt) -> Callable:
+        if alt.literals is not None:
+            return self.literals_matcher(alt)
+        matchers = [node.visit(self) for node in alt.nodes]
+        dispatch = self.dispatcher(alt, matchers)
+
+        if self.cuts:
+            def match_alt(run, index, stack, involved):
+                choices = run.choices
+                choice = [index, alt, False]
+                choices.append(choice)
+                branches = matchers
+                if dispatch is not None:
+                    branches = dispatch(run, index)
+                for match in branches:
+                    if type(match) is tuple:
+                        run.expect_skipped(index, match)
+                        continue
+                    res, idx = yield match, index, stack, involved
+                    if type(res) is not Error:
+                        choices.pop()
+                        return res, idx
+                    if choice[2]:
+                        break
+                choices.pop()
+                return FAIL, index
+        elif dispatch is not None:
+            def match_alt(run, index, stack, involved):
+                for match in dispatch(run, index):
+                    if type(match) is tuple:
+                        run.expect_skipped(index, match)
+                        continue
+                    res, idx = yield match, index, stack, involved
+                    if type(res) is not Error:
+                        return res, idx
+                return FAIL, index
+        else:
+            def match_alt(run, index, stack, involved):
+                for match in matchers:
+                    res, idx = yield match, index, stack, involved
+                    if type(res) is not Error:
+                        return res, idx
+                return FAIL, index
+
+        return match_alt
+
+    def visit_mult(self, mult: Mult) -> Callable:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            res = []
+            while True:
+                val, idx = yield match, index, stack, involved
+                if type(val) is Error:
+                    if len(res) < minimum:
+                        return val, idx
+                    else:
+                        return res, index
+                res.append(val)
+                index = idx
+
+        return match_mult
+
+    def visit_opt(self, opt: Opt) -> Callable:
+        match = self.choice_point(opt, opt.node.visit(self))
+
+        def match_opt(run, index, stack, involved):
+            res, idx = yield match, index, stack, involved
+            if type(res) is Error:
+                return None, index
+            else:
+                return res, idx
+
+        return match_opt
+
+    def visit_look(self, look: Look) -> Callable:
+        match = self.choice_point(look, look.node.visit(self))
+
+        def match_look(run, index, stack, involved):
+            res, _ = yield match, index, stack, involved
+            return res, index
+
+        return match_look
+
+    def visit_nlook(self, nlook: NLook) -> Callable:
+        match = self.choice_point(nlook, nlook.node.visit(self))
+
+        def match_nlook(run, index, stack, involved):
+            failure = run.save_failure()
+            res, _ = yield match, index, stack, involved
+            run.restore_failure(failure)
+            if type(res) is Error:
+                return None, index
+            else:
+                run.expect(index, nlook)
+                return FAIL, index
+
+        return match_nlook
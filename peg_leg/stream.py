@@ -0,0 +1,158 @@
+from typing import Any, IO, Iterator, List
+
+from .ast import Node
+from .parser import Parser, ParserRun, ParsingError, is_err
+
+# How much of the line the next item starts on is kept once matched, so
+# that errors on that line can quote it.
+MAX_KEPT_LINE = 1 << 16
+
+
+class ItemFeeder:
+    """
+    Matches `node` over and over against text pushed in with feed(). Each
+    attempt gets its own ParserRun over the text buffered so far; the text
+    of the items that were complete is then dropped along with the run,
+    but for the start of the line the rest is on, and the rest waits for
+    more text. An item is complete once `lookahead` characters past the
+    farthest point its match got to are buffered, or once close() says no
+    more text is coming.
+    """
+    parser: Parser
+    node: Node
+    minimum: int
+    lookahead: int
+
+    buffer: str
+    # Where the text not matched yet starts in the buffer.
+    offset: int
+    eof: bool
+    items: int
+    # The buffer length the next attempt waits for. Waiting until the
+    # buffer has grown by as much as it held keeps the number of attempts
+    # at an item longer than `lookahead` logarithmic in its size.
+    wanted: int
+    # Where the buffer starts in the whole input, for error locations. The
+    # buffer starts a line unless `columns` characters of it were dropped.
+    lines: int
+    columns: int
+
+    def __init__(self, parser: Parser, node: Node, minimum: int,
+                 lookahead: int):
+        self.parser = parser
+        self.node = node
+        self.minimum = minimum
+        self.lookahead = lookahead
+
+        self.buffer = ''
+        self.offset = 0
+        self.eof = False
+        self.items = 0
+        self.wanted = 0
+        self.lines = 0
+        self.columns = 0
+
+    def feed(self, text: str) -> List[Any]:
+        """Add `text` to the input, and return the items it completed."""
+        if self.eof:
+            raise ValueError('Cannot feed a closed feeder')
+        self.buffer += text
+        if len(self.buffer) < self.wanted:
+            return []
+        return self.match_items()
+
+    def close(self) -> List[Any]:
+        """
+        End the input, and return the items that were left. Raises a
+        ParsingError if what is left is not a whole number of items.
+        """
+        if self.eof:
+            return []
+        self.eof = True
+        return self.match_items()
+
+    def match_items(self) -> List[Any]:
+        run = self.parser.new_run(self.buffer)
+        results = []
+        index = self.offset
+        while True:
+            res, end_index = self.parser.match_node(run, self.node, index)
+            if is_err(res) or not self.is_complete(run, end_index):
+                break
+            self.items += 1
+            results.append(self.parser.resolve(res))
+            index = end_index
+
+        if self.eof:
+            self.finish(run, index)
+        else:
+            self.drop(index)
+            self.wanted = len(self.buffer) \
+                + max(len(self.buffer) - self.offset, self.lookahead)
+        return results
+
+    def is_complete(self, run: ParserRun, end_index: int) -> bool:
+        if self.eof:
+            return True
+        farthest = max(end_index, run.fail_index)
+        return len(self.buffer) - farthest >= self.lookahead
+
+    def is_finished(self, run: ParserRun, index: int) -> bool:
+        if self.items < self.minimum:
+            return False
+        if self.parser.ignore_ws:
+            index = run.skip_whitespace(index)
+        return index == len(self.buffer)
+
+    def drop(self, index: int):
+        newline = self.buffer.rfind('\n', 0, index)
+        if newline == -1:
+            start = 0
+        else:
+            self.lines += self.buffer.count('\n', 0, index)
+            self.columns = 0
+            start = newline + 1
+        if index - start > MAX_KEPT_LINE:
+            self.columns += index - start
+            start = index
+        self.buffer = self.buffer[start:]
+        self.offset = index - start
+
+    def finish(self, run: ParserRun, index: int):
+        if self.parser.fused and not self.is_finished(run, index):
+            # Fused subtrees that matched did not record what they expected,
+            # so the item that failed is matched again without them.
+            run = self.parser.new_run(self.buffer, fusing=False)
+            self.parser.match_node(run, self.node, index)
+        try:
+            if self.items < self.minimum:
+                raise run.error()
+            run.finish(None, index)
+        except ParsingError as e:
+            e.shift(self.lines, self.columns)
+            raise
+
+
+class ItemStream:
+    """
+    Feeds an ItemFeeder with text read from `fh`, reading at least as much
+    as is buffered, so that each read is worth another attempt.
+    """
+    feeder: ItemFeeder
+    chunk_size: int
+    fh: IO[str]
+
+    def __init__(self, parser: Parser, node: Node, minimum: int,
+                 chunk_size: int, fh: IO[str]):
+        self.feeder = ItemFeeder(parser, node, minimum, chunk_size)
+        self.chunk_size = chunk_size
+        self.fh = fh
+
+    def __iter__(self) -> Iterator[Any]:
+        feeder = self.feeder
+        while True:
+            chunk = self.fh.read(max(self.chunk_size, len(feeder.buffer)))
+            if not chunk:
+                yield from feeder.close()
+                return
+            yield from feeder.feed(chunk)
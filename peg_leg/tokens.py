@@ -0,0 +1,359 @@
+import re
+from array import array
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from .analysis import GrammarError
+from .ast import Rule, Seq, Alt, Mult, Opt, Look, NLook, Str, Rgx, Cut, \
+    Fused, Literals
+from .compiler import Compiler, Match
+from .fusion import HAS_ATOMIC_GROUPS, NotFusable, PatternBuilder
+from .parser import PRes, FAIL, END_OF_INPUT, ParserRun, ParsingError, \
+    describe_failure, is_err
+from .stackless import StacklessCompiler
+
+# The kind of the token after the last one.
+END = -1
+
+
+class LiteralCollector:
+    """Gathers the string literals a subtree matches outside of rule calls."""
+    literals: Dict[str, None]
+
+    def __init__(self):
+        self.literals = {}
+
+    def visit_rule(self, rule: Rule):
+        pass
+
+    def visit_seq(self, seq: Seq):
+        for node in seq.nodes:
+            node.visit(self)
+
+    def visit_alt(self, alt: Alt):
+        for node in alt.nodes:
+            node.visit(self)
+
+    def visit_mult(self, mult: Mult):
+        mult.node.visit(self)
+
+    def visit_opt(self, opt: Opt):
+        opt.node.visit(self)
+
+    def visit_look(self, look: Look):
+        look.node.visit(self)
+
+    def visit_nlook(self, nlook: NLook):
+        nlook.node.visit(self)
+
+    def visit_str(self, string: Str):
+        if string.string:
+            self.literals[string.string] = None
+
+    def visit_rgx(self, regex: Rgx):
+        pass
+
+    def visit_cut(self, cut: Cut):
+        pass
+
+    def visit_fused(self, fused: Fused):
+        fused.node.visit(self)
+
+
+class Tokenizer:
+    """
+    Cuts input into tokens with a single regex: the token rules in order,
+    then the string literals of the other rules, longest first. What `skip`
+    matches is dropped before each token, and a character that nothing
+    matches becomes a token of its own, of the kind `unknown`.
+    """
+    # Token rule names, then literals, by kind.
+    names: List[str]
+    # Kinds of the token rules, by name, and of the literals, by text.
+    kinds: Dict[str, int]
+    literals: Dict[str, int]
+    unknown: int
+    regex: re.Pattern
+
+    def __init__(self, rules: Dict[str, Rule], tokens: Iterable[str],
+                 skip: Optional[str], nullable: Iterable[str] = ()):
+        if not HAS_ATOMIC_GROUPS:
+            raise GrammarError('Token rules need Python 3.11 or later')
+        self.names = list(tokens)
+        self.kinds = {name: kind for kind, name in enumerate(self.names)}
+        patterns = []
+        for name in self.names:
+            rule = rules[name]
+            if name in nullable:
+                raise GrammarError(f'Token rule {name} can match the empty '
+                                   f'string')
+            builder = PatternBuilder({}, None, {name})
+            try:
+                pattern, _ = rule.node.visit(builder, False)
+            except NotFusable as e:
+                raise GrammarError(f'Token rule {name} cannot be written as '
+                                   f'a regex because of {e}') from None
+            patterns.append(pattern)
+
+        collector = LiteralCollector()
+        for name, rule in rules.items():
+            if name not in self.kinds and rule.node is not None:
+                rule.node.visit(collector)
+        literals = sorted(collector.literals, key=len, reverse=True)
+        self.literals = {literal: kind for kind, literal
+                         in enumerate(literals, len(self.names))}
+        self.names.extend(literals)
+        patterns.extend(map(re.escape, literals))
+        self.unknown = len(self.names)
+        patterns.append(r'[\s\S]')
+
+        # Tokens follow each other, so that finditer() finds all of them.
+        # Past the last one, the skip pattern cannot give back what it
+        # matched for the catch-all to match.
+        alternatives = '|'.join(f'({pattern})' for pattern in patterns)
+        if skip is not None:
+            alternatives = f'(?>{skip})(?:{alternatives})'
+        self.regex = re.compile(alternatives)
+
+    def tokenize(self, input: str) -> Tuple[array, array, array]:
+        """
+        The kinds, starts and ends of the tokens of `input`, followed by an
+        END token at the end of the input.
+        """
+        kinds = array('i')
+        starts = array('q')
+        ends = array('q')
+        for token in self.regex.finditer(input):
+            group = token.lastindex
+            kinds.append(group - 1)
+            starts.append(token.start(group))
+            ends.append(token.end(group))
+        kinds.append(END)
+        starts.append(len(input))
+        ends.append(len(input))
+        return kinds, starts, ends
+
+
+class TokenRun(ParserRun):
+    """
+    A run over the tokens of its input instead of its characters. Indexes
+    count tokens; a token rule matches one token of its kind, and a string
+    literal or regex the whole text of one token. Errors are still located
+    by character.
+    """
+    kinds: array
+    starts: array
+    ends: array
+    # The number of tokens before END.
+    count: int
+    tokenizer: Tokenizer
+    # The first position of each literal, by id of the Literals.
+    ranks: Dict[int, Dict[str, int]]
+
+    def __init__(self, actions, input: str, tokenizer: Tokenizer, rules: int,
+                 cuts: bool = False):
+        self.kinds, self.starts, self.ends = tokenizer.tokenize(input)
+        self.count = len(self.kinds) - 1
+        super().__init__(actions, input, False, rules, cuts, len(self.kinds))
+        self.tokenizer = tokenizer
+        self.ranks = {}
+
+    def text(self, index: int) -> str:
+        return self.input[self.starts[index]:self.ends[index]]
+
+    def has_text(self, text: str, index: int) -> bool:
+        start = self.starts[index]
+        return self.ends[index] - start == len(text) \
+            and self.input.startswith(text, start)
+
+    def has_literal(self, text: str, index: int) -> bool:
+        # Only tokens of a token rule can have the text of a literal
+        # without being of its kind.
+        kind = self.kinds[index]
+        literal = self.tokenizer.literals.get(text)
+        if literal is not None:
+            if kind == literal:
+                return True
+            if kind >= len(self.tokenizer.kinds):
+                return False
+        return self.has_text(text, index)
+
+    def match_token(self, rule: Rule, kind: int, index: int) -> PRes:
+        if self.kinds[index] == kind:
+            res = self.apply_action(self.text(index), rule, index, index + 1)
+            return res, index + 1
+        self.expect(index, rule)
+        return FAIL, index
+
+    def branches(self, alt: Alt, index: int):
+        start = self.starts[index]
+        branches = alt.dispatch.get(self.input[start:start + 1], alt.default)
+        if branches.skipped:
+            self.skipped[alt.id] += branches.skipped
+        return branches.steps
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        ranks = self.ranks.get(id(literals))
+        if ranks is None:
+            ranks = {}
+            for rank, string in enumerate(literals.strings):
+                ranks.setdefault(string.string, rank)
+            self.ranks[id(literals)] = ranks
+        rank = -1
+        if self.kinds[index] != END:
+            rank = ranks.get(self.text(index), -1)
+        if rank == -1:
+            if index >= self.fail_index:
+                self.expect(index, literals.strings)
+            return FAIL, index
+        if rank and index >= self.fail_index:
+            self.expect(index, literals.before[rank])
+        return literals.strings[rank].string, index + 1
+
+    def error(self) -> ParsingError:
+        msg = describe_failure(self.expected)
+        index = self.starts[max(self.fail_index, 0)]
+        return ParsingError(msg, index, self.input, self.line_index())
+
+    def finish(self, res, end_index: int):
+        if not is_err(res):
+            if end_index == self.count:
+                return res
+            self.expect(end_index, END_OF_INPUT)
+        raise self.error()
+
+    def visit_rule(self, rule: Rule, index: int, *args) -> PRes:
+        kind = self.tokenizer.kinds.get(rule.name)
+        if kind is None:
+            return super().visit_rule(rule, index, *args)
+        return self.match_token(rule, kind, index)
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        return fused.node.visit(self, index, *args)
+
+    def visit_str(self, string: Str, index: int, *args) -> PRes:
+        s = string.string
+        if not s:
+            return s, index
+        if self.has_literal(s, index):
+            return s, index + 1
+        self.expect(index, string)
+        return FAIL, index
+
+    def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
+        if self.kinds[index] != END:
+            match = regex.regex.fullmatch(
+                self.input, self.starts[index], self.ends[index])
+            if match:
+                return match.group(), index + 1
+        self.expect(index, regex)
+        return FAIL, index
+
+
+class TokenMatching:
+    """
+    Overrides for the compilers that match terminals and token rules
+    against the tokens of a TokenRun, as its visit methods do.
+    """
+    tokenizer: Tokenizer
+    actions: Dict[str, Callable]
+
+    def visit_rule(self, rule: Rule) -> Match:
+        kind = self.tokenizer.kinds.get(rule.name)
+        if kind is None:
+            return super().visit_rule(rule)
+        action = self.actions.get(rule.name)
+
+        def match_token(run, index, stack, involved):
+            if run.kinds[index] == kind:
+                res = run.input[run.starts[index]:run.ends[index]]
+                if action is not None:
+                    res = action(res)
+                return res, index + 1
+            if index >= run.fail_index:
+                run.expect(index, rule)
+            return FAIL, index
+
+        return match_token
+
+    def dispatch_on_character(self, alt_id: int, table: Dict[str, Any],
+                              default: Any) -> Callable[[TokenRun, int], Any]:
+        def dispatch(run, index):
+            start = run.starts[index]
+            steps, skipped = table.get(run.input[start:start + 1], default)
+            if skipped:
+                run.skipped[alt_id] += skipped
+            return steps
+
+        return dispatch
+
+    def visit_fused(self, fused: Fused) -> Match:
+        return fused.node.visit(self)
+
+    def visit_str(self, string: Str) -> Match:
+        s = string.string
+        length = len(s)
+
+        if not s:
+            def match_str(run, index, stack, involved):
+                return s, index
+
+            return match_str
+
+        literal = self.tokenizer.literals.get(s)
+        if literal is None:
+            def match_str(run, index, stack, involved):
+                start = run.starts[index]
+                if run.ends[index] - start == length \
+                        and run.input.startswith(s, start):
+                    return s, index + 1
+                if index >= run.fail_index:
+                    run.expect(index, string)
+                return FAIL, index
+
+            return match_str
+
+        first_literal = len(self.tokenizer.kinds)
+
+        def match_str(run, index, stack, involved):
+            kind = run.kinds[index]
+            if kind == literal:
+                return s, index + 1
+            if kind < first_literal:
+                start = run.starts[index]
+                if run.ends[index] - start == length \
+                        and run.input.startswith(s, start):
+                    return s, index + 1
+            if index >= run.fail_index:
+                run.expect(index, string)
+            return FAIL, index
+
+        return match_str
+
+    def visit_rgx(self, regex: Rgx) -> Match:
+        pattern = regex.regex
+
+        def match_rgx(run, index, stack, involved):
+            if run.kinds[index] != END:
+                match = pattern.fullmatch(
+                    run.input, run.starts[index], run.ends[index])
+                if match:
+                    return match.group(), index + 1
+            if index >= run.fail_index:
+                run.expect(index, regex)
+            return FAIL, index
+
+        return match_rgx
+
+
+class TokenCompiler(TokenMatching, Compiler):
+    def __init__(self, actions: Dict[str, Callable], tokenizer: Tokenizer,
+                 cuts: bool = False):
+        super().__init__(actions, False, cuts)
+        self.tokenizer = tokenizer
+
+
+class TokenStacklessCompiler(TokenMatching, StacklessCompiler):
+    def __init__(self, actions: Dict[str, Callable], tokenizer: Tokenizer,
+                 cuts: bool = False):
+        super().__init__(actions, False, cuts)
+        self.tokenizer = tokenizer
@@ -0,0 +1,448 @@
+from array import array
+from typing import Any, Callable, Iterator, List
+
+from .ast import Node, Rule, Seq, Alt, Mult, Look, Str, Rgx, Fused, Literals
+from .compiler import Compiler, Match
+from .parser import Parser, ParserRun, PRes, Error, FAIL, is_err, is_lr
+from .stackless import StacklessCompiler
+
+# Integers per node of a TreeBuilder, and the next sibling of a node that
+# is not a child yet.
+FIELDS = 5
+UNADOPTED = -2
+
+# Values while matching a tree: None for no rule matches, the index of a
+# node, or a list of node indexes, in order.
+Children = Any
+
+
+class Tree:
+    """
+    The rule matches of a parse as flat arrays, in preorder: the id of the
+    rule, the span of the input it matched, and the indexes of the node's
+    first child and next sibling, or -1. The root is node 0. Text is only
+    sliced from the input when a node's `text` is asked for.
+    """
+    input: str
+    # Rule names, by id.
+    names: List[str]
+    rules: array
+    starts: array
+    ends: array
+    first_child: array
+    next_sibling: array
+
+    def __init__(self, input: str, names: List[str]):
+        self.input = input
+        self.names = names
+        self.rules = array('i')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.first_child = array('i')
+        self.next_sibling = array('i')
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __getitem__(self, index: int) -> 'TreeNode':
+        if not 0 <= index < len(self.rules):
+            raise IndexError(index)
+        return TreeNode(self, index)
+
+    @property
+    def root(self) -> 'TreeNode':
+        return TreeNode(self, 0)
+
+
+class TreeNode:
+    """A view of one node of a Tree."""
+    __slots__ = ('tree', 'index')
+    tree: Tree
+    index: int
+
+    def __init__(self, tree: Tree, index: int):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other):
+        return type(other) is TreeNode and other.tree is self.tree \
+            and other.index == self.index
+
+    def __hash__(self):
+        return hash(self.index)
+
+    def __repr__(self):
+        return f'TreeNode({self.rule}, {self.start}, {self.end})'
+
+    @property
+    def rule(self) -> str:
+        return self.tree.names[self.tree.rules[self.index]]
+
+    @property
+    def start(self) -> int:
+        return self.tree.starts[self.index]
+
+    @property
+    def end(self) -> int:
+        return self.tree.ends[self.index]
+
+    @property
+    def text(self) -> str:
+        return self.tree.input[self.start:self.end]
+
+    def __iter__(self) -> Iterator['TreeNode']:
+        child = self.tree.first_child[self.index]
+        while child != -1:
+            yield TreeNode(self.tree, child)
+            child = self.tree.next_sibling[child]
+
+    @property
+    def children(self) -> List['TreeNode']:
+        return list(self)
+
+
+class TreeBuilder:
+    """
+    Nodes made while matching, including those of matches that were later
+    given up, as runs of FIELDS integers: rule id, start, end, first child
+    and next sibling. A memoized node can be a child of several candidate
+    parents; each parent after the first gets a copy, so that every node
+    has one list of siblings.
+    """
+    nodes: array
+
+    def __init__(self):
+        self.nodes = array('q')
+
+    def adopt(self, child: int) -> int:
+        nodes = self.nodes
+        offset = child * FIELDS
+        if nodes[offset + 4] != UNADOPTED:
+            child = len(nodes) // FIELDS
+            nodes.extend(nodes[offset:offset + 4])
+            nodes.append(-1)
+        else:
+            nodes[offset + 4] = -1
+        return child
+
+    def add(self, rule_id: int, start: int, end: int,
+            children: Children) -> int:
+        first = -1
+        if type(children) is int:
+            first = self.adopt(children)
+        elif children:
+            nodes = self.nodes
+            previous = -1
+            for child in children:
+                child = self.adopt(child)
+                if previous == -1:
+                    first = child
+                else:
+                    nodes[previous * FIELDS + 4] = child
+                previous = child
+        self.nodes.extend((rule_id, start, end, first, UNADOPTED))
+        return len(self.nodes) // FIELDS - 1
+
+    def build(self, root: int, input: str, names: List[str]) -> Tree:
+        """The nodes under `root`, numbered again in preorder."""
+        nodes = self.nodes
+        tree = Tree(input, names)
+        # Nodes to copy, with the new indexes of their parent and of the
+        # sibling before them, or -1.
+        pending = [(root, -1, -1)]
+        while pending:
+            node, parent, previous = pending.pop()
+            index = len(tree.rules)
+            offset = node * FIELDS
+            tree.rules.append(nodes[offset])
+            tree.starts.append(nodes[offset + 1])
+            tree.ends.append(nodes[offset + 2])
+            tree.first_child.append(-1)
+            tree.next_sibling.append(-1)
+            if previous != -1:
+                tree.next_sibling[previous] = index
+            elif parent != -1:
+                tree.first_child[parent] = index
+
+            child = nodes[offset + 3]
+            sibling = nodes[offset + 4]
+            # The next sibling waits until the node's children are done, so
+            # it is pushed first.
+            if sibling >= 0 and parent != -1:
+                pending.append((sibling, parent, index))
+            if child != -1:
+                pending.append((child, index, -1))
+        return tree
+
+
+def add_children(children: List[int], value: Children):
+    if value is None:
+        return
+    if type(value) is int:
+        children.append(value)
+    else:
+        children.extend(value)
+
+
+class TreeRun(ParserRun):
+    """
+    A visitor run whose values are nodes of a TreeBuilder rather than
+    results: terminals give None, Seqs and Mults the nodes of the rules
+    they matched, and a rule a new node in place of its action.
+    """
+    builder: TreeBuilder
+
+    def __init__(self, parser: Parser, input: str):
+        super().__init__({}, input, parser.ignore_ws, len(parser.rules),
+                         parser.has_cuts)
+        self.builder = TreeBuilder()
+
+    def apply_action(self, res, rule: Rule, start: int, end: int):
+        if is_err(res) or is_lr(res):
+            return res
+        return self.builder.add(rule.id, start, end, res)
+
+    def match_literals(self, literals: Literals, index: int) -> PRes:
+        res, idx = super().match_literals(literals, index)
+        return (res if is_err(res) else None), idx
+
+    def visit_seq(self, seq: Seq, index: int, *args) -> PRes:
+        children = []
+        for node in seq.nodes:
+            val, index = node.visit(self, index, *args)
+            if is_err(val):
+                return val, index
+            add_children(children, val)
+        return children, index
+
+    def visit_mult(self, mult: Mult, index: int, *args) -> PRes:
+        res, idx = super().visit_mult(mult, index, *args)
+        if is_err(res):
+            return res, idx
+        children = []
+        for val in res:
+            add_children(children, val)
+        return children, idx
+
+    def visit_look(self, look: Look, index: int, *args) -> PRes:
+        res, idx = super().visit_look(look, index, *args)
+        return (res if is_err(res) else None), idx
+
+    def visit_fused(self, fused: Fused, index: int, *args) -> PRes:
+        # The regex of a fused subtree does not say which rules it matched.
+        return fused.node.visit(self, index, *args)
+
+    def visit_str(self, string: Str, index: int, *args) -> PRes:
+        res, idx = super().visit_str(string, index, *args)
+        return (res if is_err(res) else None), idx
+
+    def visit_rgx(self, regex: Rgx, index: int, *args) -> PRes:
+        res, idx = super().visit_rgx(regex, index, *args)
+        return (res if is_err(res) else None), idx
+
+
+def terminal(match: Match) -> Match:
+    def match_terminal(run, index, stack, involved):
+        res, idx = match(run, index, stack, involved)
+        if type(res) is Error:
+            return res, idx
+        return None, idx
+
+    return match_terminal
+
+
+class TreeMatching:
+    """
+    Overrides for the compilers that match terminals as a TreeRun does,
+    giving None in place of their text.
+    """
+    ignore_ws: bool
+
+    def literals_matcher(self, alt: Alt) -> Match:
+        return terminal(super().literals_matcher(alt))
+
+    def visit_fused(self, fused: Fused) -> Match:
+        return fused.node.visit(self)
+
+    def visit_str(self, string: Str) -> Match:
+        s = string.string
+        length = len(s)
+        ignore_ws = self.ignore_ws
+
+        def match_str(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            if run.input.startswith(s, index):
+                return None, index + length
+            if index >= run.fail_index:
+                run.expect(index, string)
+            return FAIL, index
+
+        return match_str
+
+    def visit_rgx(self, regex: Rgx) -> Match:
+        pattern = regex.regex
+        ignore_ws = self.ignore_ws
+
+        def match_rgx(run, index, stack, involved):
+            if ignore_ws:
+                index = run.skip_whitespace(index)
+            match = pattern.match(run.input, index)
+            if match:
+                return None, match.end()
+            if index >= run.fail_index:
+                run.expect(index, regex)
+            return FAIL, index
+
+        return match_rgx
+
+
+class TreeCompiler(TreeMatching, Compiler):
+    """Compiles the matching of a TreeRun into closures."""
+    def __init__(self, ignore_ws: bool, cuts: bool = False):
+        super().__init__({}, ignore_ws, cuts)
+
+    def compile_body(self, rule: Rule) -> Match:
+        body = rule.node.visit(self)
+        rule_id = rule.id
+
+        def match_body(run, index, stack, involved):
+            res, idx = body(run, index, stack, involved)
+            if type(res) is Error:
+                return res, idx
+            return run.builder.add(rule_id, index, idx, res), idx
+
+        return match_body
+
+    def visit_seq(self, seq: Seq) -> Match:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            children = []
+            for match in matchers:
+                val, index = match(run, index, stack, involved)
+                if type(val) is Error:
+                    return val, index
+                if val is not None:
+                    if type(val) is int:
+                        children.append(val)
+                    else:
+                        children.extend(val)
+            return children, index
+
+        return match_seq
+
+    def visit_mult(self, mult: Mult) -> Match:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            children = []
+            count = 0
+            while True:
+                val, idx = match(run, index, stack, involved)
+                if type(val) is Error:
+                    if count < minimum:
+                        return val, idx
+                    return children, index
+                count += 1
+                if val is not None:
+                    if type(val) is int:
+                        children.append(val)
+                    else:
+                        children.extend(val)
+                index = idx
+
+        return match_mult
+
+    def visit_look(self, look: Look) -> Match:
+        return terminal(super().visit_look(look))
+
+
+class TreeStacklessCompiler(TreeMatching, StacklessCompiler):
+    """
+    Compiles the matching of a TreeRun into generator functions, as
+    StacklessCompiler does, for parsers compiled stackless.
+    """
+    def __init__(self, ignore_ws: bool, cuts: bool = False):
+        super().__init__({}, ignore_ws, cuts)
+
+    def compile_body(self, rule: Rule) -> Callable:
+        body = rule.node.visit(self)
+        rule_id = rule.id
+
+        def match_body(run, index, stack, involved):
+            res, idx = yield body, index, stack, involved
+            if type(res) is Error:
+                return res, idx
+            return run.builder.add(rule_id, index, idx, res), idx
+
+        return match_body
+
+    def visit_seq(self, seq: Seq) -> Callable:
+        matchers = [node.visit(self) for node in seq.nodes]
+
+        def match_seq(run, index, stack, involved):
+            children = []
+            for match in matchers:
+                val, index = yield match, index, stack, involved
+                if type(val) is Error:
+                    return val, index
+                if val is not None:
+                    if type(val) is int:
+                        children.append(val)
+                    else:
+                        children.extend(val)
+            return children, index
+
+        return match_seq
+
+    def visit_mult(self, mult: Mult) -> Callable:
+        match = self.choice_point(mult, mult.node.visit(self))
+        minimum = mult.min
+
+        def match_mult(run, index, stack, involved):
+            children = []
+            count = 0
+            while True:
+                val, idx = yield match, index, stack, involved
+                if type(val) is Error:
+                    if count < minimum:
+                        return val, idx
+                    return children, index
+                count += 1
+                if val is not None:
+                    if type(val) is int:
+                        children.append(val)
+                    else:
+                        children.extend(val)
+                index = idx
+
+        return match_mult
+
+    def visit_look(self, look: Look) -> Callable:
+        match = self.choice_point(look, look.node.visit(self))
+
+        def match_look(run, index, stack, involved):
+            res, _ = yield match, index, stack, involved
+            if type(res) is Error:
+                return res, index
+            return None, index
+
+        return match_look
+
+
+def parse_tree(parser: Parser, node: Node, input: str) -> Tree:
+    run = TreeRun(parser, input)
+    if parser.compiler is None:
+        res, end_index = node.visit(run, 0, [], set())
+    else:
+        compiler_type = TreeStacklessCompiler \
+            if parser.compiler.stackless else TreeCompiler
+        compiler = compiler_type(parser.ignore_ws, parser.has_cuts)
+        match = compiler.compile(node)
+        res, end_index = match(run, 0, None, set())
+    parser.memo_usage = run.memo_usage()
+    root = run.finish(res, end_index)
+    names = [rule.name for rule in parser.rules.values()]
+    return run.builder.build(root, input, names)
@@ -1,18 +1,23 @@
+import re
+
 import setuptools
 
 with open("README.md", "r", encoding="utf-8") as fh:
     long_description = fh.read()
 
+with open("peg_leg/__init__.py", "r", encoding="utf-8") as fh:
+    version = re.search(r'__version__ = "(.*)"', fh.read()).group(1)
+
 setuptools.setup(
     name="peg_leg",
-    version="0.4.0",
+    version=version,
     author="Gabriel Ionescu",
     author_email="gabe@erisian.tech",
     description="PEG parser generator",
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/formerly-a-trickster/peg-leg",
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks']),
     classifiers=[
         "Programming Language :: Python :: 3",
         "Operating System :: OS Independent",
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from peg_leg.analysis import GrammarError
+from peg_leg.parser import Parser
+
+
+class AnalysisTestCase(TestCase):
+    def test_nullable_rules(self):
+        parser = Parser.from_grammar("""
+        a <- b c ;
+        b <- "x"? ;
+        c <- /y*/ | "z" ;
+        d <- a "w" ;
+        """)
+        self.assertSetEqual(parser.analysis.nullable, {'a', 'b', 'c'})
+
+    def test_left_recursive_rules(self):
+        parser = Parser.from_grammar("""
+        stmt <- expr ";" ;
+        expr <- term "+" expr | sum ;
+        sum <- opt sum "-" term | term ;
+        opt <- "!"? ;
+        term <- call | id ;
+        call <- term "(" ")" ;
+        id <- /[a-z]+/ ;
+        """)
+        components = sorted(sorted(c) for c in parser.analysis.components)
+        self.assertListEqual(components, [['call', 'term'], ['sum']])
+        self.assertSetEqual({name for name, rule in parser.rules.items()
+                             if rule.left_recursive},
+                            {'call', 'term', 'sum'})
+
+        res = parser.parse('a()+b-c;')
+        expected = [[['a', '(', ')'], '+', [None, 'b', '-', 'c']], ';']
+        self.assertListEqual(res, expected)
+
+    def test_repeating_nullable_expressions_is_rejected(self):
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar('a <- ("x"?)* ;')
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar("""
+            a <- "[" b+ "]" ;
+            b <- &"x" | /y*/ ;
+            """)
+        # Zero-width patterns fail on an empty string, but still match
+        # nothing where they succeed.
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar(r's <- (/(?=a)/ "b"?)* "a" ;')
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar(r's <- /(?<=a)/+ ;')
+        parser = Parser.from_grammar(r's <- /(?=a)/ s "x" | "a" ;')
+        self.assertTrue(parser.rules['s'].left_recursive)
+
+    def test_first_sets(self):
+        parser = Parser.from_grammar(r"""
+        value <- number | string | word | "[" value "]" ;
+        number <- /-?[0-9]+/ ;
+        string <- /"[^"]*"/ ;
+        word <- !number /[a-z0-9]+|[^ ]+/ ;
+        call <- name? "(" ;
+        name <- /(?i)[a-z]/ ;
+        """)
+        firsts = parser.analysis.firsts
+        self.assertEqual(firsts['number'].chars, frozenset('-0123456789'))
+        self.assertEqual(firsts['string'].chars, frozenset('"'))
+        self.assertIsNone(firsts['word'].chars)
+        self.assertIsNone(firsts['call'].chars)
+        self.assertFalse(firsts['call'].nullable)
+
+        [(name, alt)] = parser.analysis.alts
+        self.assertEqual(name, 'value')
+        number, string, word, _ = alt.nodes
+        steps = alt.dispatch['7'].steps
+        self.assertEqual(steps[:3], (number, (string.node,), word))
+        self.assertEqual(alt.dispatch['"'].skipped, 2)
+        self.assertEqual(alt.default.skipped, 3)
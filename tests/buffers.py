@@ -0,0 +1,54 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from peg_leg.parser import Parser, ParsingError
+
+GRAMMAR = """
+rows <- row* ;
+row <- field ("," field)* "\n" ;
+field <- "true" | "false" | "nil" | /"[^"]*"/ | /[^,"\\\\n]*/ ;
+"""
+
+TEXT = 'a,"b, c",true\nnil,é,\n'
+
+
+class BuffersTestCase(TestCase):
+    def test_buffers(self):
+        expected = Parser.from_grammar(GRAMMAR).parse(TEXT)
+        expected = [[field.encode(), [[sep.encode(), rest.encode()]
+                                      for sep, rest in fields], end.encode()]
+                    for field, fields, end in expected]
+        data = TEXT.encode()
+        for mode in ['visitor', 'compiled', 'stackless', 'fused']:
+            parser = Parser.from_grammar(GRAMMAR)
+            if mode == 'fused':
+                parser.fuse()
+            if mode != 'visitor':
+                parser.compile(mode == 'stackless')
+            for input in [data, bytearray(data), memoryview(data)]:
+                self.assertEqual(parser.parse(input), expected)
+            self.assertEqual(parser.parse(TEXT)[1][0], 'nil')
+
+            # Errors are located in the text, not the bytes.
+            errors = []
+            for input in ['a\né,"b\n', 'a\né,"b\n'.encode()]:
+                with self.assertRaises(ParsingError) as raised:
+                    parser.parse(input)
+                errors.append(raised.exception.args)
+            self.assertEqual(errors[0], errors[1])
+            self.assertEqual(errors[1][1:], ((2, 2), 'é,"b\n'))
+
+    def test_parse_file(self):
+        parser = Parser.from_grammar(GRAMMAR).compile()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rows.csv')
+            with open(path, 'wb') as fh:
+                fh.write(TEXT.encode())
+            self.assertEqual(parser.parse_file(path)[1][1][0][1],
+                             'é'.encode())
+            self.assertEqual(parser.parse_file(path, 'utf-8')[1][1][0][1],
+                             'é')
+
+            open(path, 'wb').close()
+            self.assertEqual(parser.parse_file(path), [])
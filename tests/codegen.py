@@ -0,0 +1,134 @@
+import os
+import tempfile
+from types import ModuleType
+from unittest import TestCase, skipUnless
+
+from peg_leg.fusion import HAS_ATOMIC_GROUPS
+from peg_leg.parser import Parser, ParsingError
+from peg_leg.peg import peg_parser
+
+
+def load(source: str) -> ModuleType:
+    module = ModuleType('generated')
+    exec(compile(source, '<generated>', 'exec'), module.__dict__)
+    return module
+
+
+class CodegenTestCase(TestCase):
+    def test_generated_meta_grammar_matches_bootstrap(self):
+        module = load(peg_parser.generate_source())
+        module.ACTIONS.update(peg_parser.actions)
+
+        grammar = r"""
+        a <- b "x"* | !c &d e+ ;
+        b <- ( "\"" | /\/[a-z]/ )? ;
+        """
+        expect = peg_parser.parse_rule('grammar', grammar)
+        res = module.parse(grammar, 'grammar')
+        self.assertEqual([str(r.node) for r in expect],
+                         [str(r.node) for r in res])
+
+    def test_left_recursion(self):
+        module = load(Parser.from_grammar("""
+        lr1 <- lr2 "1" | "1" ;
+        lr2 <- lr3 "2" | "2" ;
+        lr3 <- lr1 "3" | "3" ;
+        """).generate_source())
+
+        res = module.parse('321321')
+        expected = [[[[['3', '2'], '1'], '3'], '2'], '1']
+        self.assertListEqual(res, expected)
+
+    def test_actions_are_hooked_by_name(self):
+        module = load(Parser.from_grammar("""
+        sum <- sum "+" num | num ;
+        num <- /[0-9]+/ ;
+        """, ignore_ws=True).generate_source())
+
+        @module.action('sum')
+        def sum_action(raw):
+            if isinstance(raw, list):
+                return raw[0] + raw[2]
+            return raw
+
+        module.action('num')(int)
+        self.assertEqual(module.parse('1 + 20 + 300'), 321)
+
+    def test_errors_are_raised(self):
+        module = load(Parser.from_grammar('list <- "[" /[0-9]/+ "]" ;')
+                      .generate_source())
+        with self.assertRaises(ParsingError):
+            module.parse('[]')
+        with self.assertRaises(ParsingError):
+            module.parse('[1]]')
+
+    def test_deep_nesting_is_split_into_functions(self):
+        grammar = 'deep <- ' + '("a" ' * 30 + '"a"' + ')' * 30 + ' ;'
+        module = load(Parser.from_grammar(grammar).generate_source())
+        res = module.parse('a' * 31)
+        for _ in range(30):
+            self.assertEqual(res[0], 'a')
+            res = res[1]
+        self.assertEqual(res, 'a')
+
+    def test_cut(self):
+        module = load(Parser.from_grammar("""
+        stmt <- "if" ~ "(" /[a-z]+/ ")" | /[a-z]+/ ;
+        """).generate_source())
+
+        self.assertEqual(module.parse('foo'), 'foo')
+        with self.assertRaises(ParsingError):
+            module.parse('if')
+
+    def test_write_source(self):
+        parser = Parser.from_grammar('greeting <- "hello" ;')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'greeting.py')
+            parser.write_source(path)
+            with open(path, encoding='utf-8') as fh:
+                module = load(fh.read())
+        self.assertEqual(module.parse('hello'), 'hello')
+
+    def test_alt_dispatch_keeps_errors(self):
+        parser = Parser.from_grammar("""
+        stmt <- "if" expr ":" | "pass" ";" | expr ";" ;
+        expr <- /[0-9]+/ | "(" expr ")" ;
+        """, ignore_ws=True)
+        module = load(parser.generate_source())
+        self.assertIn('_FIRST_', parser.generate_source())
+
+        self.assertEqual(module.parse('if (1) :'), parser.parse('if (1) :'))
+        for bad in ['if x:', 'pass', '(1;']:
+            with self.assertRaises(ParsingError) as expected:
+                parser.parse(bad)
+            with self.assertRaises(ParsingError) as actual:
+                module.parse(bad)
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+        # Alternatives that cannot start with any character have nothing
+        # to expect when they are skipped.
+        parser = Parser.from_grammar('r0 <- r0 | r0 ;')
+        module = load(parser.generate_source())
+        for bad in ['', 'x']:
+            with self.assertRaises(ParsingError) as expected:
+                parser.parse(bad)
+            with self.assertRaises(ParsingError) as actual:
+                module.parse(bad)
+            self.assertEqual(str(actual.exception), str(expected.exception))
+
+    @skipUnless(HAS_ATOMIC_GROUPS, 'needs atomic groups')
+    def test_fused_subtrees(self):
+        parser = Parser.from_grammar("""
+        items <- item* ;
+        item <- /[a-z]+/ ("," /[a-z]+/)* ";" ;
+        """).fuse()
+        source = parser.generate_source()
+        self.assertIn('_FUSED_', source)
+        module = load(source)
+
+        self.assertEqual(module.parse('a,b;c;'), parser.parse('a,b;c;'))
+        with self.assertRaises(ParsingError) as expected:
+            parser.parse('a,b;c,')
+        with self.assertRaises(ParsingError) as actual:
+            module.parse('a,b;c,')
+        self.assertEqual(str(actual.exception), str(expected.exception))
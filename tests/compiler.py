@@ -0,0 +1,106 @@
+from unittest import TestCase
+
+from peg_leg.ast import Rule, Str, Alt, Rgx, Seq, Mult
+from peg_leg.parser import Parser, ParsingError
+from peg_leg.peg import rules as peg_rules, peg_parser
+
+
+class CompilerTestCase(TestCase):
+    def test_direct_left_recursive_rules(self):
+        """
+        expr <- expr "+" num | num ;
+        num  <- /[0-9]/ ;
+        """
+        rules = [
+            Rule('expr', Alt(Seq(Rule('expr'),
+                                 Str('+'),
+                                 Rule('num')),
+                             Rule('num'))),
+            Rule('num', Rgx('[0-9]'))
+        ]
+
+        parser = Parser()
+        parser.rules = {rule.name: rule for rule in rules}
+        parser.grammar = parser.rules['expr']
+        parser.link_rules()
+        parser.compile()
+
+        res = parser.parse("1+2+3")
+        expected = [['1', '+', '2'], '+', '3']
+        self.assertListEqual(res, expected)
+
+    def test_multiple_mutually_recursive_rules(self):
+        parser = Parser.from_grammar("""
+        lr1 <- lr2 "1" | "1" ;
+        lr2 <- lr3 "2" | "2" ;
+        lr3 <- lr1 "3" | "3" ;
+        """).compile()
+
+        res = parser.parse('321321')
+        expected = [[[[['3', '2'], '1'], '3'], '2'], '1']
+        self.assertListEqual(res, expected)
+
+    def test_actions_are_applied(self):
+        parser = Parser(ignore_ws=True)
+
+        @parser.register_action('sum <- sum "+" num | num')
+        def sum_action(raw):
+            if isinstance(raw, list):
+                return raw[0] + raw[2]
+            return raw
+
+        parser.add_rule('num <- /[0-9]+/', int)
+        parser.link_rules()
+        parser.compile()
+
+        self.assertEqual(parser.parse("1 + 20 + 300"), 321)
+
+    def test_results_match_visitor(self):
+        compiled = Parser()
+        compiled.rules = {rule.name: rule for rule in peg_rules}
+        compiled.actions = peg_parser.actions
+        compiled.grammar = compiled.rules['grammar']
+        compiled.compile()
+
+        grammar = r"""
+        a <- b "x"* | !c &d e+ ;
+        b <- ( "\"" | /\/[a-z]/ )? ;
+        """
+        expect = peg_parser.parse_rule('grammar', grammar)
+        res = compiled.parse(grammar)
+        self.assertEqual([str(r.node) for r in expect],
+                         [str(r.node) for r in res])
+
+    def test_errors_match_visitor(self):
+        rules = [Rule('list', Seq(Str('['), Mult(1, Rgx('[0-9]')), Str(']')))]
+        parser = Parser()
+        parser.rules = {rule.name: rule for rule in rules}
+        parser.grammar = parser.rules['list']
+        parser.link_rules()
+
+        with self.assertRaises(ParsingError) as expected:
+            parser.parse('[]')
+
+        parser.compile()
+        with self.assertRaises(ParsingError) as actual:
+            parser.parse('[]')
+
+        self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_relinking_drops_compiled_rules(self):
+        parser = Parser.from_grammar('a <- "a" ;').compile()
+        self.assertIsNotNone(parser.compiler)
+        parser.link_rules()
+        self.assertIsNone(parser.compiler)
+
+    def test_cut(self):
+        parser = Parser.from_grammar("""
+        expr <- expr "+" ~ num | num ;
+        num <- /[0-9]+/ ;
+        """).compile()
+
+        res = parser.parse('1+2+3')
+        expected = [['1', '+', None, '2'], '+', None, '3']
+        self.assertListEqual(res, expected)
+        with self.assertRaises(ParsingError):
+            parser.parse('1+2+')
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from peg_leg.parser import Parser
+
+GRAMMAR = r"""
+stmt <- target "=" sum | sum ;
+target <- num ;
+sum <- sum "+" num | num ;
+num <- /[0-9]+/ | "(" sum ")" ;
+"""
+
+
+class DeferredTestCase(TestCase):
+    def make_parser(self, calls):
+        parser = Parser.from_grammar(GRAMMAR)
+
+        def action(name, make):
+            def run(res):
+                calls.append(name)
+                return make(res)
+            parser.actions[name] = run
+
+        action('stmt', lambda res: res if type(res) is int else res[2])
+        action('target', lambda res: ('target', res))
+        action('sum', lambda res: res if type(res) is int
+               else res[0] + res[2])
+        action('num', lambda res: int(res) if type(res) is str else res[1])
+        return parser
+
+    def test_same_result_without_abandoned_matches(self):
+        for mode in ['visitor', 'compiled', 'stackless']:
+            eager_calls, deferred_calls = [], []
+            eager = self.make_parser(eager_calls)
+            deferred = self.make_parser(deferred_calls).defer_actions()
+            if mode != 'visitor':
+                eager.compile(mode == 'stackless')
+                deferred.compile(mode == 'stackless')
+
+            self.assertEqual(deferred.parse('1+(2+3)'), 6)
+            self.assertEqual(eager.parse('1+(2+3)'), 6)
+            # target matched 1 before the first alternative of stmt was
+            # given up; only the eager parser ran its action for it.
+            self.assertEqual(eager_calls,
+                             ['num', 'target'] + ['sum', 'num'] * 3
+                             + ['sum', 'stmt'])
+            self.assertEqual(deferred_calls,
+                             ['num', 'sum'] * 4 + ['stmt'])
+            self.assertEqual(deferred.parse('4=5'), eager.parse('4=5'))
+
+    def test_shared_matches_run_once(self):
+        parser = Parser.from_grammar(r"""
+        pair <- &item item ;
+        item <- /[0-9]+/ ;
+        """)
+        calls = []
+        parser.actions['item'] = lambda res: calls.append(res) or [res]
+        parser.defer_actions()
+        look, item = parser.parse('12')
+        self.assertIs(look, item)
+        self.assertEqual(calls, ['12'])
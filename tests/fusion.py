@@ -0,0 +1,65 @@
+import pickle
+from unittest import TestCase, skipUnless
+
+from peg_leg.fusion import HAS_ATOMIC_GROUPS
+from peg_leg.parser import Parser, ParsingError
+from peg_leg.peg import peg_parser
+
+GRAMMAR = r"""
+items <- item* ;
+item <- word ("," word)* &";" ";" ;
+word <- !"end" /[a-z]+/ ("-" /[0-9]+/)? | "(" /[0-9]+/ ")" ;
+"""
+
+
+@skipUnless(HAS_ATOMIC_GROUPS, 'needs atomic groups')
+class FusionTestCase(TestCase):
+    def test_fused_subtrees_give_the_same_values(self):
+        plain = Parser.from_grammar(GRAMMAR)
+        parsers = [Parser.from_grammar(GRAMMAR).fuse(),
+                   Parser.from_grammar(GRAMMAR).fuse().compile(),
+                   Parser.from_grammar(GRAMMAR).fuse().compile(True)]
+        self.assertListEqual([name for name, _ in parsers[0].fused],
+                             ['items', 'item', 'word'])
+
+        text = 'ab,cd-12;(3);x-1,y,z;'
+        expected = plain.parse(text)
+        self.assertEqual(expected[0], [[None, 'ab', None],
+                                       [[',', [None, 'cd', ['-', '12']]]],
+                                       ';', ';'])
+        for parser in parsers:
+            self.assertEqual(parser.parse(text), expected)
+        copy = pickle.loads(pickle.dumps(parsers[0]))
+        self.assertEqual(copy.parse(text), expected)
+
+    def test_errors_are_unchanged(self):
+        plain = Parser.from_grammar(GRAMMAR, ignore_ws=True)
+        parsers = [Parser.from_grammar(GRAMMAR, ignore_ws=True).fuse(),
+                   Parser.from_grammar(GRAMMAR, ignore_ws=True).fuse()
+                   .compile()]
+        for text in ['a , b', 'a;end;', 'a-;', '(1;']:
+            with self.assertRaises(ParsingError) as expected:
+                plain.parse(text)
+            for parser in parsers:
+                with self.assertRaises(ParsingError) as actual:
+                    parser.parse(text)
+                self.assertEqual(str(actual.exception),
+                                 str(expected.exception))
+
+    def test_actions_and_cuts_are_not_fused(self):
+        parser = Parser.from_grammar(r"""
+        list <- "[" num ("," ";"?)? "]" ;
+        num <- /[0-9]+/ ;
+        pair <- "(" ~ /(a)b/ ("," /(?i)c/)? ")" ;
+        """)
+        parser.actions['num'] = int
+        parser.fuse()
+        fused = [(name, str(fused)) for name, fused in parser.fused]
+        self.assertListEqual(fused, [('list', '( , ;? )?')])
+        self.assertEqual(parser.parse_rule('list', '[1,]'),
+                         ['[', 1, [',', None], ']'])
+
+    def test_meta_grammar_strings_are_fused(self):
+        self.assertIn('string', [name for name, _ in peg_parser.fused])
+        res = peg_parser.parse_rule('string', r'"a\"b\\c"')
+        self.assertEqual(res.string, 'a"b\\c')
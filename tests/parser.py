@@ -1,7 +1,14 @@
-from unittest import TestCase
+import io
+import os
+import pickle
+import random
+import tempfile
+from unittest import TestCase, mock
 
+from peg_leg import cache
 from peg_leg.ast import Rule, Str, Alt, Rgx, Seq
-from peg_leg.parser import Parser
+from peg_leg.parser import Parser, ParsingError, LineIndex
+from peg_leg.peg import peg_parser
 
 
 class ParserTestCase(TestCase):
@@ -150,3 +157,407 @@ class ParserTestCase(TestCase):
                     '.', 'f'
                     ]
         self.assertListEqual(res, expected)
+
+    def test_add_rule_without_linking(self):
+        parser = Parser()
+        parser.add_rule('num <- /[0-9]+/', int)
+        self.assertEqual(parser.parse('42'), 42)
+        parser.add_rule('sum <- num "+" num', lambda res: res[0] + res[2])
+        self.assertEqual(parser.parse_rule('sum', '1+2'), 3)
+        self.assertEqual(parser.parse('7'), 7)
+
+    def test_error_reports_farthest_failure(self):
+        parser = Parser.from_grammar("""
+        list <- "[" num ("," num)* "]" ;
+        num <- !"0" /[0-9]+/ ;
+        """)
+
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse('[1,2 3]')
+        msg, loc, _ = ctx.exception.args
+        self.assertEqual(msg, 'Expected `,` or `]`')
+        self.assertEqual(loc, (1, 4))
+
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse('[1]]')
+        msg, loc, _ = ctx.exception.args
+        self.assertEqual(msg, 'Expected end of input')
+        self.assertEqual(loc, (1, 3))
+
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse('[0]')
+        msg, _, _ = ctx.exception.args
+        self.assertEqual(msg, 'Did not expect 0')
+
+    def test_memo_usage_is_reported(self):
+        parser = Parser.from_grammar("""
+        items <- item* ;
+        item <- /[0-9]+/ "," ;
+        """)
+
+        res = parser.parse('1,22,')
+        self.assertListEqual(res, [['1', ','], ['22', ',']])
+        self.assertTrue(parser.memo_usage.dense)
+        self.assertEqual(parser.memo_usage.entries, 4)
+        self.assertGreater(parser.memo_usage.bytes, 0)
+
+        res = parser.parse('1,' * 10000)
+        self.assertEqual(len(res), 10000)
+        self.assertFalse(parser.memo_usage.dense)
+        self.assertEqual(parser.memo_usage.entries, 10002)
+
+        # Many rules make a table per rule too many slots for short inputs,
+        # even where the input only needs a few of them.
+        rules = ''.join(f'r{i} <- "<{i}>" ;' for i in range(300))
+        parser = Parser.from_grammar(
+            f'items <- item* ; item <- /[0-9]+/ "," ; {rules}')
+        self.assertEqual(len(parser.parse('1,' * 500)), 500)
+        self.assertFalse(parser.memo_usage.dense)
+        self.assertEqual(parser.memo_usage.entries, 502)
+        self.assertLess(parser.memo_usage.bytes, 1 << 16)
+
+    def test_cut_stops_alternatives(self):
+        parser = Parser.from_grammar("""
+        stmt <- "if" ~ "(" id ")" | id ;
+        id <- /[a-z]+/ ;
+        """)
+
+        self.assertListEqual(parser.parse('if(x)'),
+                             ['if', None, '(', 'x', ')'])
+        self.assertEqual(parser.parse('foo'), 'foo')
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse('if')
+        msg, loc, _ = ctx.exception.args
+        self.assertEqual(msg, 'Expected `(`')
+
+    def test_cut_prunes_memo_table(self):
+        parser = Parser.from_grammar("""
+        items <- item* ;
+        item <- "[" ~ num "]" | "<" num ">" ;
+        num <- /[0-9]+/ ;
+        """)
+
+        for count in [10, 10000]:
+            res = parser.parse('[1]<2>' * count)
+            self.assertEqual(len(res), 2 * count)
+            self.assertLess(parser.memo_usage.entries, 10)
+
+    def test_parse_iter_yields_items(self):
+        parser = Parser.from_grammar("""
+        lines <- line* ;
+        line <- key "=" value ";\n" ;
+        key <- /[a-z]+/ ;
+        value <- "true" | "false" | /[0-9]+/ ;
+        """)
+        parser.actions['line'] = lambda raw: (raw[0], raw[2])
+        text = "alpha=true;\nbeta=12345;\n" * 20
+
+        res = list(parser.parse_iter(io.StringIO(text), chunk_size=8))
+        self.assertEqual(len(res), 40)
+        self.assertEqual(res[:2], [('alpha', 'true'), ('beta', '12345')])
+
+        res = parser.parse_iter(io.StringIO(text), 'line', chunk_size=8)
+        self.assertEqual(list(res), parser.parse(text))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'input.txt')
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write(text)
+            self.assertEqual(len(list(parser.parse_iter(path))), 40)
+
+        with self.assertRaises(ParsingError) as ctx:
+            list(parser.parse_iter(io.StringIO(text + 'gamma=x;\n'),
+                                   chunk_size=8))
+        _, loc, line = ctx.exception.args
+        self.assertEqual(loc, (41, 6))
+        self.assertEqual(line, 'gamma=x;\n')
+
+    def test_incremental_edits_match_full_parse(self):
+        parser = Parser.from_grammar("""
+        lines <- line* ;
+        line <- key "=" expr ";\n" ;
+        key <- /[a-z]+/ ;
+        expr <- expr "+" num | num ;
+        num <- /[0-9]+/ ;
+        """)
+        calls = []
+        parser.actions['line'] = lambda raw: calls.append(raw[0]) or raw[0]
+        text = "".join(f"k{chr(97 + i)}=1+2;\n" for i in range(20))
+
+        session = parser.parse_incremental(text)
+        self.assertEqual(session.result, parser.parse(text))
+
+        def find(s):
+            return session.text.index(s)
+
+        edits = [lambda: (3, 4, '42'),
+                 lambda: (0, 2, 'zz'),
+                 lambda: (len(session.text), len(session.text), 'q=7;\n'),
+                 lambda: (find(';\nkc'), find(';\nkc'), '+300'),
+                 lambda: (find('kc'), find('kd'), '')]
+        for edit in edits:
+            start, end, new_text = edit()
+            calls.clear()
+            res = session.edit(start, end, new_text)
+            self.assertLess(len(calls), 4)
+            self.assertEqual(res, parser.parse(session.text))
+
+        with self.assertRaises(ParsingError):
+            session.edit(0, 1, '=')
+        self.assertEqual(session.edit(0, 1, 'x'), parser.parse(session.text))
+
+        # Regexes can look past where they stop.
+        parser = Parser.from_grammar('s <- item* ; item <- str | /[a-z"]/ ; '
+                                     'str <- /"[a-z]*"/ ;')
+        session = parser.parse_incremental('"abc')
+        self.assertEqual(session.edit(4, 4, '"'), ['"abc"'])
+
+        # Or look behind where they start.
+        parser = Parser.from_grammar(r's <- (w | o)* ; w <- /\\bab/ ; '
+                                     r'o <- /./ ;')
+        parser.actions['w'] = lambda raw: ('W', raw)
+        session = parser.parse_incremental('x ab')
+        self.assertEqual(session.edit(1, 2, 'y'), parser.parse('xyab'))
+
+        # Entries made while left recursion grows are not reused.
+        parser = Parser.from_grammar("""
+        top <- ( r0 /./ | /./ )* ;
+        r0 <- ( r2 | "b" ) ( "c" | /b?a/ )* ( "b" | r2 | "a" ) ;
+        r2 <- ( /[ab]/ "ba" r2 ) | /a+/ | r0 | !"ab" ;
+        """)
+        session = parser.parse_incremental('bcccbbac')
+        session.edit(6, 8, 'baa')
+        self.assertEqual(session.edit(8, 8, 'bcb'),
+                         parser.parse(session.text))
+
+    def test_incremental_edits_at_random(self):
+        parser = Parser.from_grammar(r"""
+        items <- item* ;
+        item <- string | number | name | "=" | ";" ;
+        string <- /"[^"]*"/ ;
+        number <- /[0-9]+([.][0-9]+)?/ ;
+        name <- /[a-z]+(?=[=;])/ | /[a-z]/ ;
+        """, ignore_ws=True)
+
+        def outcome(parse):
+            try:
+                return parse()
+            except ParsingError as e:
+                return e.args
+
+        rnd = random.Random(0)
+        alphabet = 'ab"1.=; '
+        for _ in range(40):
+            session = parser.parse_incremental('')
+            for _ in range(20):
+                start = rnd.randint(0, len(session.text))
+                end = rnd.randint(start, min(start + 3, len(session.text)))
+                new_text = ''.join(rnd.choice(alphabet)
+                                   for _ in range(rnd.randint(0, 3)))
+                res = outcome(lambda: session.edit(start, end, new_text))
+                self.assertEqual(res,
+                                 outcome(lambda: parser.parse(session.text)))
+
+        # Dispatch looks at the next character, even where it skips every
+        # alternative.
+        parser = Parser.from_grammar('s <- q | /x./ ; q <- "x" r ; '
+                                     'r <- "a" | "b" ;')
+        session = parser.parse_incremental('xz')
+        self.assertEqual(session.edit(1, 2, 'a'), ['x', 'a'])
+
+    def test_parse_many_in_worker_processes(self):
+        parser = Parser.from_grammar("""
+        sum <- plus | num ;
+        plus <- sum "+" num ;
+        num <- /[0-9]+/ ;
+        """)
+        parser.actions['num'] = int
+        parser.actions['plus'] = lambda raw: raw[0] + raw[2]
+        inputs = [f'{i}+{i}+1' for i in range(50)] + ['1+', '7']
+
+        res = parser.parse_many(inputs, workers=2, chunksize=4)
+        self.assertEqual(res[:50], [2 * i + 1 for i in range(50)])
+        self.assertIsInstance(res[50], ParsingError)
+        self.assertEqual(str(res[50]), str(self.parse_error(parser, '1+')))
+        self.assertEqual(res[51], 7)
+
+        # Spawned workers get the parser pickled, actions included.
+        parser = Parser.from_grammar('num <- /[0-9]+/ ;')
+        parser.actions['num'] = int
+        res = parser.parse_many(['1', '22', 'x'], workers=2,
+                                start_method='spawn')
+        self.assertEqual(res[:2], [1, 22])
+        self.assertIsInstance(res[2], ParsingError)
+
+    def test_parser_pickles(self):
+        parser = Parser.from_grammar("""
+        pair <- key ":" key ;
+        key <- /[a-z]+/ ;
+        """).compile()
+        copy = pickle.loads(pickle.dumps(parser))
+        self.assertIsNotNone(copy.compiler)
+        self.assertEqual(copy.parse('ab:cd'), ['ab', ':', 'cd'])
+
+        error = self.parse_error(parser, 'ab:')
+        self.assertEqual(pickle.loads(pickle.dumps(error)).args, error.args)
+
+        # Long chains of rules pickle without recursing through them.
+        rules = [f'r{i} <- "x" r{i + 1} | "y" ;' for i in range(300)]
+        parser = Parser.from_grammar(''.join(rules) + 'r300 <- "z" ;')
+        copy = pickle.loads(pickle.dumps(parser))
+        self.assertIs(copy.grammar, copy.rules['r0'])
+        self.assertEqual(copy.parse('xxy'), parser.parse('xxy'))
+
+    def parse_error(self, parser, input):
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse(input)
+        return ctx.exception
+
+    def test_parse_parallel_splits_at_boundaries(self):
+        parser = Parser.from_grammar("""
+        lines <- line* ;
+        line <- key "=" value ";\n" ;
+        key <- /[a-z]+/ ;
+        value <- "true" | "false" | /[0-9]+/ ;
+        """)
+        parser.actions['line'] = lambda raw: (raw[0], raw[2])
+        parser.actions['lines'] = dict
+        text = "".join(f"k{'abcdefghij'[i % 10] * (i + 1)}={i};\n"
+                       for i in range(60))
+
+        for chunk_size in [1, 50, 10000]:
+            res = parser.parse_parallel(text, ';\n', workers=3,
+                                        chunk_size=chunk_size)
+            self.assertEqual(res, parser.parse(text))
+
+        bad = text.replace('=41;', '=x;')
+        error = self.parse_error(parser, bad)
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse_parallel(bad, ';\n', workers=3, chunk_size=50)
+        self.assertEqual(ctx.exception.args[1:], error.args[1:])
+        self.assertEqual(ctx.exception.args[1], (42, 44))
+
+        # Chunks can start partway into the line of an error.
+        parser = Parser.from_grammar(
+            'items <- (/[a-z0-9]+/ "=" /[0-9]+/ ";" "\n"?)* ;')
+        bad = ''.join(f'k{i}={i};' for i in range(60)).replace('=41;', '=x;')
+        error = self.parse_error(parser, bad)
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse_parallel(bad, ';', workers=3, chunk_size=50)
+        self.assertEqual(ctx.exception.args, error.args)
+
+    def test_from_grammar_uses_cache(self):
+        grammar = """
+        sum <- sum "+" num | num ;
+        num <- /[0-9]+/ ;
+        """
+        cache.clear_cache()
+        with tempfile.TemporaryDirectory() as tmp:
+            cache.set_cache_dir(tmp)
+            try:
+                first = Parser.from_grammar(grammar)
+                cache.clear_cache()
+                with mock.patch.object(peg_parser, 'parse_rule',
+                                       wraps=peg_parser.parse_rule) as parse:
+                    second = Parser.from_grammar(grammar)
+                    parse.assert_not_called()
+                    with mock.patch.object(cache, '__version__', '0.0.0'):
+                        Parser.from_grammar(grammar)
+                    parse.assert_called_once()
+                    with mock.patch.object(cache, 'CACHE_FORMAT', 0):
+                        Parser.from_grammar(grammar)
+                    self.assertEqual(parse.call_count, 2)
+
+                    # Damaged files are parsed again.
+                    cache.clear_cache()
+                    for name in os.listdir(tmp):
+                        with open(os.path.join(tmp, name), 'wb') as fh:
+                            fh.write(b'\x80')
+                    Parser.from_grammar(grammar)
+                    self.assertEqual(parse.call_count, 3)
+            finally:
+                cache.set_cache_dir(None)
+                cache.clear_cache()
+
+        self.assertIsNot(second.rules['sum'], first.rules['sum'])
+        self.assertEqual(second.analysis.left_recursive, {'sum'})
+        self.assertEqual(second.parse('1+2'), first.parse('1+2'))
+
+        # Grammars cached in memory before the directory was set are
+        # written there when they are next looked up.
+        Parser.from_grammar(grammar)
+        with tempfile.TemporaryDirectory() as tmp:
+            cache.set_cache_dir(tmp)
+            try:
+                Parser.from_grammar(grammar)
+                self.assertEqual(len(os.listdir(tmp)), 1)
+            finally:
+                cache.set_cache_dir(None)
+                cache.clear_cache()
+
+    def test_alt_dispatch_skips_branches(self):
+        grammar = """
+        stmts <- stmt+ ;
+        stmt <- "if" expr ":" | "while" expr ":" | "return" expr ";"
+              | "pass" ";" | expr ";" ;
+        expr <- /[0-9]+/ | "(" expr ")" ;
+        """
+        parser = Parser.from_grammar(grammar, ignore_ws=True)
+        plain = Parser.from_grammar(grammar, ignore_ws=True)
+        for _, alt in plain.analysis.alts:
+            alt.dispatch = None
+
+        text = "if 1: while (2): return 3; pass; 4;"
+        self.assertEqual(parser.parse(text), plain.parse(text))
+        counts = parser.pruned_branches
+        self.assertEqual(counts['expr: ( /[0-9]+/ | ( ( expr ) ) )'], 5)
+        self.assertEqual(sum(counts.values()), 30)
+
+        for bad in ['if 1: whilst 2:', 'return (3;', 'pass']:
+            with self.assertRaises(ParsingError) as expected:
+                plain.parse(bad)
+            for engine in [parser, parser.compile(), parser.compile(True)]:
+                with self.assertRaises(ParsingError) as actual:
+                    engine.parse(bad)
+                self.assertEqual(str(actual.exception),
+                                 str(expected.exception))
+
+    def test_literal_alternatives_keep_ordered_choice(self):
+        grammar = """
+        stmt <- &kw kw name ";" ;
+        kw <- "i" | "in" | "if" | "import" | "int" | "is" ;
+        name <- /[a-z]+/ ;
+        """
+        parser = Parser.from_grammar(grammar, ignore_ws=True)
+        plain = Parser.from_grammar(grammar, ignore_ws=True)
+        alt = plain.rules['kw'].node
+        self.assertIsNotNone(alt.literals)
+        alt.literals = None
+
+        self.assertEqual(parser.parse('import;'), ['i', 'i', 'mport', ';'])
+        self.assertEqual(parser.parse('import;'), plain.parse('import;'))
+        for bad in ['import', 'x y;', ' is']:
+            with self.assertRaises(ParsingError) as expected:
+                plain.parse(bad)
+            for engine in [parser, parser.compile(), parser.compile(True)]:
+                with self.assertRaises(ParsingError) as actual:
+                    engine.parse(bad)
+                self.assertEqual(str(actual.exception),
+                                 str(expected.exception))
+
+    def test_line_index_locates_positions(self):
+        text = 'ab\n\ncdé\nf\n' * 5 + 'gh'
+        with mock.patch('peg_leg.parser.LINE_BLOCK_SIZE', 4), \
+                mock.patch('peg_leg.parser.LINE_SEARCH_SIZE', 2):
+            lines = LineIndex(text)
+            buffer = LineIndex(memoryview(text.encode()))
+            for index in reversed(range(len(text) + 1)):
+                line = text.count('\n', 0, index)
+                start = text.rfind('\n', 0, index) + 1
+                end = text.find('\n', index)
+                source = text[start:None if end == -1 else end] + '\n'
+                self.assertEqual(lines.locate(index),
+                                 ((line + 1, index - start), source))
+                self.assertEqual(
+                    buffer.locate(len(text[:index].encode())),
+                    ((line + 1, index - start), source))
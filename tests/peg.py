@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from peg_leg.ast import Rule, Seq, Alt, Str, Rgx, Opt, Look, NLook, Mult
+from peg_leg.ast import Rule, Seq, Alt, Str, Rgx, Opt, Look, NLook, Mult, Cut
 from peg_leg.peg import peg_parser
 
 
@@ -182,4 +182,11 @@ class PegTestCase(TestCase):
         rule = 'test <- /\\\\one\\\\/'
         res = peg_parser.parse(rule)
         expect = Rule('test', Rgx('\\one\\'))
-        self.assertAstEqual(expect, res)
\ No newline at end of file
+        self.assertAstEqual(expect, res)
+
+    def test_cut_is_parsed(self):
+        rule = 'test <- "a" ~ b | c'
+        res = peg_parser.parse(rule)
+        expect = Rule('test', Alt(Seq(Str('a'), Cut(), Rule('b')),
+                                  Rule('c')))
+        self.assertAstEqual(expect, res)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+from peg_leg.parser import Parser
+
+GRAMMAR = r"""
+sum <- sum "+" num | num ;
+num <- /[0-9]+/ | "(" sum ")" ;
+"""
+
+
+class ProfilingTestCase(TestCase):
+    def test_rules_are_counted(self):
+        parser = Parser.from_grammar(GRAMMAR)
+        profile = parser.profile('1+(2+3)')
+        self.assertEqual(profile.result,
+                         ['1', '+', ['(', ['2', '+', '3'], ')']])
+        self.assertIsNone(profile.error)
+
+        sum_, num = profile.rules['sum'], profile.rules['num']
+        self.assertEqual((sum_.calls, sum_.memo_hits, sum_.memo_misses),
+                         (8, 6, 2))
+        self.assertEqual((num.calls, num.memo_hits, num.memo_misses),
+                         (6, 2, 4))
+        self.assertEqual(sum_.grow_iterations, 4)
+        self.assertEqual(sum_.failed_branches, 4)
+        self.assertGreaterEqual(sum_.inclusive, sum_.exclusive)
+        self.assertGreaterEqual(profile.elapsed, sum_.inclusive)
+
+        lines = profile.table(sort='calls').split('\n')
+        self.assertEqual(lines[0].split()[:4],
+                         ['rule', 'calls', 'hits', 'misses'])
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         ['sum', 'num', 'total'])
+
+    def test_errors_and_memory(self):
+        parser = Parser.from_grammar(GRAMMAR).compile()
+        profile = parser.profile('1+(2', memory=True)
+        self.assertIsNone(profile.result)
+        self.assertEqual(profile.error.args[0], 'Expected `+` or `)`')
+        self.assertGreater(profile.rules['num'].allocated, 0)
+        self.assertIn('alloc KiB', str(profile))
@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+from peg_leg.parser import Parser
+
+GRAMMAR = r"""
+stmt <- sum ";" ;
+sum <- sum "+" num | num ;
+num <- /[0-9]+/ | "(" sum ")" | "x" | "y" ;
+"""
+
+
+class RecognizerTestCase(TestCase):
+    def test_matches(self):
+        for mode in ['visitor', 'compiled', 'fused', 'stackless']:
+            parser = Parser.from_grammar(GRAMMAR, ignore_ws=True)
+            parser.actions['num'] = lambda res: self.fail('action ran')
+            if mode == 'fused':
+                parser.fuse()
+            if mode != 'visitor':
+                parser.compile(mode == 'stackless')
+            self.assertTrue(parser.matches('1 + (2 + x) ; '))
+            self.assertFalse(parser.matches('1 + (2 + x ;'))
+            self.assertFalse(parser.matches('1 + 2 ; 3'))
+            self.assertEqual(parser.match_length('1 + (2 + y) ; 3'), 13)
+            self.assertEqual(parser.match_length('1 + (2 + y)', 'sum'), 11)
+            self.assertEqual(parser.match_length('1 + (2 + x) ', 'sum'), 11)
+            self.assertIsNone(parser.match_length('1 + (2 + y) ;3',
+                                                  whole=True))
+            self.assertIsNone(parser.match_length('+', 'num'))
+
+    def test_memo_holds_end_indexes(self):
+        parser = Parser.from_grammar(r"""
+        items <- (item ";")* ;
+        item <- pair | word ;
+        pair <- word "=" word ;
+        word <- /[a-z]+/ ;
+        """)
+        self.assertTrue(parser.matches('a=b;c;'))
+        recognized = parser.memo_usage
+        parser.parse('a=b;c;')
+        self.assertEqual(recognized.entries, parser.memo_usage.entries)
+        self.assertLess(recognized.bytes, parser.memo_usage.bytes)
+
+    def test_stackless_deep_nesting(self):
+        parser = Parser.from_grammar(r"""
+        value <- "[" value "]" | "x" ;
+        """).compile(stackless=True)
+        depth = 50000
+        input = '[' * depth + 'x' + ']' * depth
+        self.assertTrue(parser.matches(input))
+        self.assertFalse(parser.matches(input[:-1]))
+        self.assertEqual(parser.match_length(input + ']'), len(input))
@@ -0,0 +1,51 @@
+from unittest import TestCase
+
+from peg_leg.parser import Parser
+
+GRAMMAR = r"""
+stmts <- stmt* ;
+stmt <- name "=" value ";" ;
+name <- /[a-z]+/ ;
+value <- /[0-9]+/ | "true" | "false" ;
+"""
+
+TEXT = """a = 1;
+b = ;
+c = true;
+d = 2 e = 3;
+f = false;
+g = maybe;"""
+
+
+class RecoveryTestCase(TestCase):
+    def test_errors_are_collected(self):
+        for mode in ['visitor', 'compiled', 'fused']:
+            parser = Parser.from_grammar(GRAMMAR, ignore_ws=True)
+            parser.actions['stmt'] = lambda raw: (raw[0], raw[2])
+            parser.actions['stmts'] = dict
+            if mode == 'fused':
+                parser.fuse()
+            if mode != 'visitor':
+                parser.compile()
+
+            recovery = parser.parse_recovering(TEXT)
+            self.assertEqual(recovery.result,
+                             {'a': '1', 'c': 'true', 'f': 'false'})
+            self.assertEqual([error.args[1] for error in recovery.errors],
+                             [(2, 4), (4, 6), (6, 4)])
+            self.assertEqual(recovery.errors[1].args,
+                             ('Expected `;`', (4, 6), 'd = 2 e = 3;\n'))
+
+            clean = 'x = 1; y = 2;'
+            recovery = parser.parse_recovering(clean)
+            self.assertEqual(recovery.result, parser.parse(clean))
+            self.assertEqual(recovery.errors, [])
+
+    def test_items_of_a_rule(self):
+        parser = Parser.from_grammar(GRAMMAR, ignore_ws=True)
+        recovery = parser.parse_recovering(TEXT.encode(), r';\s*', 'stmt')
+        self.assertEqual([item[0] for item in recovery.result],
+                         [b'a', b'c', b'f'])
+        self.assertEqual(len(recovery.errors), 3)
+        self.assertEqual(recovery.errors[2].args[1:],
+                         ((6, 4), 'g = maybe;\n'))
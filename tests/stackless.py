@@ -0,0 +1,78 @@
+import pickle
+import sys
+from unittest import TestCase
+
+from peg_leg.parser import Parser, ParsingError
+from peg_leg.peg import rules as peg_rules, peg_parser
+
+
+class StacklessTestCase(TestCase):
+    def test_left_recursive_rules(self):
+        parser = Parser.from_grammar("""
+        lr1 <- lr2 "1" | "1" ;
+        lr2 <- lr3 "2" | "2" ;
+        lr3 <- lr1 "3" | "3" ;
+        """).compile(stackless=True)
+
+        res = parser.parse('321321')
+        expected = [[[[['3', '2'], '1'], '3'], '2'], '1']
+        self.assertListEqual(res, expected)
+
+    def test_nesting_deeper_than_recursion_limit(self):
+        parser = Parser.from_grammar("""
+        expr <- expr "+" term | term ;
+        term <- "(" expr ")" | /[0-9]+/ ;
+        """)
+        parser.actions['term'] = lambda raw: raw[1] if type(raw) is list \
+            else int(raw)
+        parser.actions['expr'] = lambda raw: raw[0] + raw[2] \
+            if type(raw) is list else raw
+
+        depth = sys.getrecursionlimit()
+        text = '(' * depth + '1+2' + ')' * depth + '+3' * depth
+        with self.assertRaises(RecursionError):
+            parser.parse(text)
+
+        parser.compile(stackless=True)
+        self.assertEqual(parser.parse(text), 3 + 3 * depth)
+        with self.assertRaises(ParsingError):
+            parser.parse(text + ')')
+
+    def test_results_match_visitor(self):
+        stackless = Parser()
+        stackless.rules = {rule.name: rule for rule in peg_rules}
+        stackless.actions = peg_parser.actions
+        stackless.grammar = stackless.rules['grammar']
+        stackless.compile(stackless=True)
+
+        grammar = r"""
+        a <- b "x"* | !c &d e+ ;
+        b <- ( "\"" | /\/[a-z]/ )? ;
+        c <- "c" ~ "d" | "e" ;
+        """
+        expect = peg_parser.parse_rule('grammar', grammar)
+        res = stackless.parse(grammar)
+        self.assertEqual([str(r.node) for r in expect],
+                         [str(r.node) for r in res])
+
+    def test_cut_and_errors_match_visitor(self):
+        grammar = """
+        expr <- expr "+" ~ num | num ;
+        num <- /[0-9]+/ ;
+        """
+        visitor = Parser.from_grammar(grammar)
+        stackless = Parser.from_grammar(grammar).compile(stackless=True)
+
+        self.assertEqual(stackless.parse('1+2+3'), visitor.parse('1+2+3'))
+        for text in ['1+2+', '1+x']:
+            with self.assertRaises(ParsingError) as expected:
+                visitor.parse(text)
+            with self.assertRaises(ParsingError) as actual:
+                stackless.parse(text)
+            self.assertEqual(str(expected.exception), str(actual.exception))
+
+    def test_pickles_as_stackless(self):
+        parser = Parser.from_grammar('a <- "a"+ ;').compile(stackless=True)
+        copy = pickle.loads(pickle.dumps(parser))
+        self.assertTrue(copy.compiler.stackless)
+        self.assertEqual(copy.parse('aaa'), ['a', 'a', 'a'])
@@ -0,0 +1,83 @@
+import asyncio
+from unittest import TestCase, mock
+
+from peg_leg.parser import Parser, ParsingError
+
+GRAMMAR = """
+lines <- line* ;
+line <- key "=" value ";\n" ;
+key <- /[a-zé]+/ ;
+value <- "true" | "false" | /[0-9]+/ ;
+"""
+
+
+class StreamTestCase(TestCase):
+    def make_parser(self):
+        parser = Parser.from_grammar(GRAMMAR)
+        parser.actions['line'] = lambda raw: (raw[0], raw[2])
+        return parser
+
+    def test_feeder(self):
+        parser = self.make_parser()
+        text = 'alpha=true;\nbeta=12345;\n' * 20
+        feeder = parser.feeder(lookahead=4)
+        results = []
+        for i in range(0, len(text), 5):
+            results.extend(feeder.feed(text[i:i + 5]))
+            # Items come out while more input is on the way.
+            if i == 200:
+                self.assertGreater(len(results), 10)
+        self.assertLess(len(results), 40)
+        results.extend(feeder.close())
+        self.assertEqual(results, parser.parse(text))
+        self.assertEqual(feeder.close(), [])
+        with self.assertRaises(ValueError):
+            feeder.feed('gamma=1;\n')
+
+        feeder = parser.feeder('line', lookahead=4)
+        self.assertEqual(feeder.feed(text + 'gamma=x'), parser.parse(text))
+        with self.assertRaises(ParsingError) as ctx:
+            feeder.close()
+        self.assertEqual(ctx.exception.args[1:], ((41, 6), 'gamma=x\n'))
+
+        # Errors quote the whole line, including items already dropped.
+        parser = Parser.from_grammar('items <- (/[a-z]+/ "=" /[0-9]+/ ";")* ;',
+                                     ignore_ws=True)
+        text = 'a=1;\nb=2; c=3; d=x;\ne=4;'
+        with self.assertRaises(ParsingError) as ctx:
+            parser.parse(text)
+        expected = ctx.exception.args
+        feeder = parser.feeder(lookahead=2)
+        for char in text:
+            feeder.feed(char)
+        with self.assertRaises(ParsingError) as ctx:
+            feeder.close()
+        self.assertEqual(ctx.exception.args, expected)
+        self.assertEqual(expected[1:], ((2, 12), 'b=2; c=3; d=x;\n'))
+
+        # Past the start that is kept of a line, the line is left out.
+        with mock.patch('peg_leg.stream.MAX_KEPT_LINE', 4):
+            feeder = parser.feeder(lookahead=2)
+            for char in text:
+                feeder.feed(char)
+            with self.assertRaises(ParsingError) as ctx:
+                feeder.close()
+        self.assertEqual(ctx.exception.args, (expected[0], (2, 12), None))
+        self.assertTrue(str(ctx.exception).endswith('at line 2, pos 12'))
+
+    def test_aparse(self):
+        parser = self.make_parser()
+        text = 'clé=true;\nbeta=12345;\n' * 50
+        data = text.encode()
+
+        async def collect():
+            reader = asyncio.StreamReader()
+            results = parser.aparse(reader, chunk_size=3, lookahead=8)
+            reader.feed_data(data[:100])
+            # The first item comes out before the rest is sent.
+            first = await asyncio.wait_for(results.__anext__(), 5)
+            reader.feed_data(data[100:])
+            reader.feed_eof()
+            return [first] + [result async for result in results]
+
+        self.assertEqual(asyncio.run(collect()), parser.parse(text))
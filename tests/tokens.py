@@ -0,0 +1,75 @@
+import pickle
+from unittest import TestCase, skipUnless
+
+from peg_leg.analysis import GrammarError
+from peg_leg.fusion import HAS_ATOMIC_GROUPS
+from peg_leg.parser import Parser, ParsingError
+
+GRAMMAR = r"""
+program <- stmt* ;
+stmt <- "if" expr ":" stmt | "print" expr ";" | NAME "=" expr ";" ;
+expr <- expr "+" term | expr "-" term | term ;
+term <- term "*" atom | atom ;
+atom <- NUMBER | NAME | STRING | "(" expr ")" ;
+NAME <- /[a-z_][a-z0-9_]*/ ;
+NUMBER <- /[0-9]+/ ;
+STRING <- /"[^"]*"/ ;
+"""
+
+
+@skipUnless(HAS_ATOMIC_GROUPS, 'needs atomic groups')
+class TokensTestCase(TestCase):
+    def test_tokens_give_the_same_values(self):
+        plain = Parser.from_grammar(GRAMMAR, ignore_ws=True)
+        parsers = [Parser.from_grammar(GRAMMAR).tokenize(),
+                   Parser.from_grammar(GRAMMAR).tokenize().compile(),
+                   Parser.from_grammar(GRAMMAR).tokenize().compile(True)]
+        self.assertListEqual(parsers[0].tokenizer.names[:4],
+                             ['NAME', 'NUMBER', 'STRING', 'print'])
+
+        text = 'x = 1 + 2 * y;\nif ifx: print "a b" - (x * 3);\n'
+        expected = plain.parse(text)
+        self.assertEqual(expected[1][:2], ['if', 'ifx'])
+        for parser in parsers:
+            self.assertEqual(parser.parse(text), expected)
+        copy = pickle.loads(pickle.dumps(parsers[1]))
+        self.assertEqual(copy.parse(text), expected)
+
+    def test_literals_and_token_rules(self):
+        parser = Parser.from_grammar(r"""
+        cmp <- Num ("<" | "<=" | "=") Num ;
+        Num <- /[0-9]+/ ("." /[0-9]+/)? ;
+        """).tokenize(['Num'], r'[ \t]*')
+        parser.actions['Num'] = float
+        self.assertListEqual(parser.parse('1.5 <= 2'), [1.5, '<=', 2.0])
+        self.assertListEqual(parser.parse('3<2.25'), [3.0, '<', 2.25])
+
+    def test_errors_are_located_by_character(self):
+        parser = Parser.from_grammar(r"""
+        stmt <- NAME "=" NAME ";" ;
+        NAME <- /[a-z]+/ ;
+        """).tokenize()
+        for compiled in [False, True]:
+            if compiled:
+                parser.compile()
+            with self.assertRaises(ParsingError) as error:
+                parser.parse('x =\n  ;')
+            self.assertEqual(str(error.exception),
+                             'Expected NAME at line 2, pos 2:\n  ;\n /\\')
+            with self.assertRaises(ParsingError) as error:
+                parser.parse('x = y $')
+            self.assertEqual(str(error.exception).split('\n')[0],
+                             'Expected `;` at line 1, pos 6:')
+            with self.assertRaises(ParsingError) as error:
+                parser.parse('x = y; z')
+            self.assertEqual(str(error.exception).split('\n')[0],
+                             'Expected end of input at line 1, pos 7:')
+
+    def test_token_rules_must_be_regexes(self):
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar('a <- B ; B <- /[0-9]*/ ;').tokenize()
+        with self.assertRaises(GrammarError):
+            Parser.from_grammar('a <- B ; B <- "b" ~ "c" ;').tokenize()
+        parser = Parser.from_grammar('a <- B* ; B <- /[0-9]+/ ;').tokenize()
+        with self.assertRaises(ValueError):
+            list(parser.parse_iter(iter([])))
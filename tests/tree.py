@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+from peg_leg.parser import Parser, ParsingError
+
+GRAMMAR = r"""
+sum <- sum "+" num | num ;
+num <- /[0-9]+/ | "(" sum ")" ;
+"""
+
+
+def nested(node):
+    return [node.rule, node.text] + [nested(child) for child in node]
+
+
+class TreeTestCase(TestCase):
+    def test_rule_matches(self):
+        for mode in ['visitor', 'compiled', 'stackless']:
+            parser = Parser.from_grammar(GRAMMAR)
+            if mode != 'visitor':
+                parser.compile(mode == 'stackless')
+            tree = parser.parse_tree('1+(2+3)')
+            self.assertEqual(nested(tree.root),
+                             ['sum', '1+(2+3)',
+                              ['sum', '1', ['num', '1']],
+                              ['num', '(2+3)',
+                               ['sum', '2+3',
+                                ['sum', '2', ['num', '2']],
+                                ['num', '3']]]])
+            self.assertEqual(len(tree), 8)
+            self.assertListEqual(list(tree.first_child),
+                                 [1, 2, -1, 4, 5, 6, -1, -1])
+            self.assertListEqual(list(tree.next_sibling),
+                                 [-1, 3, -1, -1, -1, 7, -1, -1])
+            self.assertEqual(repr(tree[3]), 'TreeNode(num, 2, 7)')
+
+    def test_memoized_nodes_are_copied(self):
+        parser = Parser.from_grammar(r"""
+        pair <- left "x" item | right "y" item ;
+        left <- item ;
+        right <- item ;
+        item <- /[0-9]+/ ;
+        """)
+        tree = parser.parse_tree('1y2')
+        self.assertEqual(nested(tree.root),
+                         ['pair', '1y2',
+                          ['right', '1', ['item', '1']], ['item', '2']])
+        self.assertEqual(len(tree), 4)
+
+        with self.assertRaises(ParsingError):
+            parser.parse_tree('1z2')
+
+    def test_stackless_deep_nesting(self):
+        parser = Parser.from_grammar(r"""
+        value <- "[" value "]" | "x" ;
+        """).compile(stackless=True)
+        depth = 50000
+        tree = parser.parse_tree('[' * depth + 'x' + ']' * depth)
+        self.assertEqual(len(tree), depth + 1)
+        self.assertEqual(tree[depth].text, 'x')
+        self.assertListEqual(list(tree.first_child[:3]), [1, 2, 3])